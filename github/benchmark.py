@@ -0,0 +1,320 @@
+"""
+Times every stage of the pipeline on synthetic data in a local store of its own, the harvest against a stub API, and flags
+stages that got slower or bigger than the baseline or spend more than OVERHEAD_BUDGET of their time on telemetry.
+"""
+import argparse
+import configparser
+import contextlib
+import gc
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+import numpy as np
+import connections
+import harvester
+import synthetic
+import update_projects
+import contributor_scripts
+import generate_graphs
+import github
+import telemetry
+
+# ------------------- Global Variables & Config -------------------
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'benchmark_baseline.json')
+DEFAULT_PROJECTS = 200
+REPEAT = 3
+# how much slower or bigger than the baseline a stage may get
+TOLERANCE = 0.25
+HARVEST_REPOSITORIES = 20
+# the share of a stage's time telemetry may take
+OVERHEAD_BUDGET = 0.02
+# how often every kind of value is recorded to measure what recording costs
+TELEMETRY_SAMPLES = 20000
+
+# ------------------- Stub API -------------------
+
+class StubHandler(BaseHTTPRequestHandler):
+    # project -> list of encoded pages, filled by start_stub_api
+    pages = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        segments = parts.path.strip("/").split("/")
+        pages = self.pages.get(f"{segments[1]}/{segments[2]}") if len(segments) == 4 else None
+        if pages is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        page = int(dict(parse_qsl(parts.query)).get("page", 1))
+        body = pages[page - 1] if page <= len(pages) else b"[]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-RateLimit-Remaining", "5000")
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        if len(pages) > 1:
+            self.send_header("Link", f'<http://{self.headers["Host"]}{parts.path}?page={len(pages)}>; rel="last"')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def encode_pages(pull_requests):
+    return [json.dumps(page).encode() for page in synthetic.rest_pages(pull_requests)]
+
+
+def serve_stub_api(handler=StubHandler):
+    """
+    Starts a stub server in a background thread, the tests use it with handlers of their own.
+
+    Returns:
+    The server, shut it down when done.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_stub_api(repositories, seed):
+    """
+    Serves the pull requests of synthetic repositories like the REST API does.
+
+    Returns:
+    The base URL of the stub and the github URLs of the repositories.
+    """
+    rng = np.random.default_rng(seed)
+    urls = []
+    for i, amount in enumerate(synthetic.pull_request_amounts(rng, repositories)):
+        project = synthetic.project_name(i)
+        StubHandler.pages[project] = encode_pages(synthetic.generate_pull_requests(rng, project, int(amount)))
+        urls.append(f"git+https://github.com/{project}.git")
+
+    server = serve_stub_api()
+    return f"http://127.0.0.1:{server.server_address[1]}", urls
+
+# ------------------- Benchmarks -------------------
+
+class Benchmark:
+    def __init__(self, name, run, setup=None, teardown=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.teardown = teardown
+
+    def once(self, traced):
+        if self.setup:
+            self.setup()
+        gc.collect()
+        if traced:
+            tracemalloc.start()
+        operations = telemetry.operations.copy()
+        start = time.perf_counter()
+        # the stages print their progress, which is not what is measured
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            self.run()
+        seconds = time.perf_counter() - start
+        self.operations = dict(telemetry.operations - operations)
+        peak = 0
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if self.teardown:
+            self.teardown()
+        return seconds, peak
+
+    def measure(self, repeat):
+        seconds = min(self.once(traced=False)[0] for _ in range(repeat))
+        operations = self.operations
+        return {"seconds": seconds, "peak_bytes": self.once(traced=True)[1], "telemetry_operations": operations}
+
+
+def pipeline_benchmarks(harvest_urls):
+    db = connections.get_db()
+    flags = {}
+
+    def reset_projects():
+        # update_projects only works on projects without the documentation fields, and resets the flags
+        for project in db.projects.find({}, {"_id": 0, "github": 1, **{flag: 1 for flag in synthetic.DOCUMENTATION_FLAGS}}):
+            flags[project["github"]] = {flag: project[flag] for flag in synthetic.DOCUMENTATION_FLAGS if flag in project}
+        db.projects.update_many({}, {"$unset": {"README_documentation": ""}})
+
+    def restore_flags():
+        for github_url, values in flags.items():
+            db.projects.update_one({"github": github_url}, {"$set": values})
+
+    def graph_metrics():
+        generate_graphs.computed_metrics = None
+        for data, _ in generate_graphs.FIGURES.values():
+            data()
+
+    def harvest():
+        harvester.harvest(harvest_urls, github.get_pull_requests_url, github.parse_pull_requests)
+
+    return [
+        Benchmark("update_projects.main", update_projects.main, reset_projects, restore_flags),
+        Benchmark("contributor_scripts.aggregate", contributor_scripts.aggregate),
+        Benchmark("contributor_scripts.get_contributors_gained", contributor_scripts.get_contributors_gained),
+        Benchmark("generate_graphs metrics", graph_metrics),
+        Benchmark("harvest and parse", harvest),
+    ]
+
+
+def telemetry_cost(samples=TELEMETRY_SAMPLES):
+    """
+    Measures what recording one value of every kind costs: a counter, a gauge, a timer and a debug event.
+    Events are only done when the background thread has written them, so that work is included.
+
+    Returns:
+    A dictionary from kind, as in telemetry.operations, to seconds.
+    """
+    def timer():
+        with telemetry.timer("benchmark"):
+            pass
+
+    def events():
+        for _ in range(samples):
+            telemetry.event("benchmark", logging.DEBUG)
+        # stopping waits until every queued record is written
+        telemetry.stop()
+
+    kinds = {
+        "count": lambda: [telemetry.count("benchmark") for _ in range(samples)],
+        "gauge": lambda: [telemetry.gauge("benchmark", 1) for _ in range(samples)],
+        "timer": lambda: [timer() for _ in range(samples)],
+        "event": events,
+    }
+    costs = {}
+    for kind, record in kinds.items():
+        start = time.perf_counter()
+        record()
+        costs[kind] = (time.perf_counter() - start) / samples
+    return costs
+
+
+def telemetry_overhead(results, costs):
+    """
+    Adds the share of its time every stage spent on telemetry to its results.
+
+    Returns:
+    The names of the stages over OVERHEAD_BUDGET.
+    """
+    over = []
+    for name, result in results.items():
+        seconds = sum(amount * costs[kind] for kind, amount in result["telemetry_operations"].items())
+        result["telemetry_overhead"] = seconds / result["seconds"] if result["seconds"] else 0
+        if result["telemetry_overhead"] > OVERHEAD_BUDGET:
+            over.append(name)
+    return over
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the names of the stages that got slower or bigger than the baseline by more than tolerance.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["seconds"] > base["seconds"] * (1 + tolerance) or result["peak_bytes"] > base["peak_bytes"] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def report(results, baseline, regressions, over_budget):
+    print(f"{'stage':48} {'seconds':>9} {'peak MiB':>9} {'baseline s':>11} {'baseline MiB':>13} {'telemetry':>10}")
+    for name, result in results.items():
+        base = baseline.get(name, {})
+        base_seconds = f"{base['seconds']:.3f}" if base else "-"
+        base_peak = f"{base['peak_bytes'] / 2**20:.1f}" if base else "-"
+        flag = "  REGRESSION" if name in regressions else ""
+        flag += "  TELEMETRY OVER BUDGET" if name in over_budget else ""
+        print(f"{name:48} {result['seconds']:9.3f} {result['peak_bytes'] / 2**20:9.1f} {base_seconds:>11} {base_peak:>13} "
+              f"{result['telemetry_overhead']:9.2%}{flag}")
+
+
+def run(projects=DEFAULT_PROJECTS, seed=0, repeat=REPEAT, only=None):
+    """
+    Generates the data and runs every benchmark.
+
+    Parameters:
+    - projects: The scale of the synthetic data.
+    - seed: The seed of the synthetic data.
+    - repeat: How many timed runs per stage.
+    - only: Optional list of stage names to run.
+
+    Returns:
+    A dictionary from stage name to its seconds, peak_bytes and the values it recorded per kind in telemetry_operations,
+    and what recording a value of every kind costs, see telemetry_cost.
+    """
+    directory = tempfile.mkdtemp(prefix="benchmark-")
+    telemetry.stop()
+    telemetry.start("benchmark", log_path=os.path.join(directory, "telemetry.jsonl"), console=False)
+    # neither the configured database nor the response cache or tokens of config.ini are used
+    connections.config = configparser.ConfigParser()
+    connections.use_local_store(os.path.join(directory, "benchmark.sqlite"))
+    harvester.rate_limiter = harvester.TokenPool("benchmark", ["benchmark"])
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        synthetic.generate(projects, seed)
+    harvester.API_URL, harvest_urls = start_stub_api(HARVEST_REPOSITORIES, seed)
+
+    results = {}
+    try:
+        for benchmark in pipeline_benchmarks(harvest_urls):
+            if only and benchmark.name not in only:
+                continue
+            results[benchmark.name] = benchmark.measure(repeat)
+        costs = telemetry_cost()
+    finally:
+        telemetry.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+    return results, costs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every stage of the pipeline on synthetic data and compare with a baseline.")
+    parser.add_argument("--projects", type=int, default=DEFAULT_PROJECTS, help="amount of synthetic projects")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="timed runs per stage")
+    parser.add_argument("--only", action="append", help="run only this stage, can be repeated")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed slowdown, 0.25 is 25%%")
+    args = parser.parse_args()
+
+    results, costs = run(args.projects, args.seed, args.repeat, args.only)
+    over_budget = telemetry_overhead(results, costs)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            stored = json.load(file)
+        if (stored["projects"], stored["seed"]) == (args.projects, args.seed):
+            baseline = stored["results"]
+        else:
+            print(f"Baseline is for {stored['projects']} projects and seed {stored['seed']}, not comparing")
+
+    regressions = compare(results, baseline, args.tolerance)
+    report(results, baseline, regressions, over_budget)
+    print("Recording telemetry costs " + ", ".join(f"{cost * 1e6:.1f}us per {kind}" for kind, cost in costs.items())
+          + f", the budget is {OVERHEAD_BUDGET:.0%} of every stage")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump({"projects": args.projects, "seed": args.seed, "results": {**baseline, **results}}, file, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    sys.exit(1 if regressions or over_budget else 0)
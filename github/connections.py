@@ -0,0 +1,265 @@
+import configparser
+import os
+import re
+import threading
+from collections import Counter
+
+import requests
+from pymongo import MongoClient, monitoring
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import local_store
+import response_cache
+import telemetry
+
+# ------------------- Global Variables & Config -------------------
+
+# config.ini lives next to the scripts, wherever they are started from
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini')
+
+# connections kept open to MongoDB and to the GitHub API, enough for every harvester worker
+MONGO_POOL_SIZE = 32
+HTTP_POOL_SIZE = 32
+
+# how many connections and handshakes a run performed, see log_stats
+stats = Counter()
+telemetry.include(stats)
+
+lock = threading.Lock()
+config = None
+client = None
+# set by use_local_store, overrides the backend in config.ini
+backend = None
+local_db = None
+session = None
+cache = None
+
+# ------------------- Config -------------------
+
+def load_config():
+    global config
+    if config is None:
+        config = configparser.ConfigParser()
+        config.read(CONFIG_PATH)
+    return config
+
+
+def load_mongodb_config():
+    config = load_config()
+    return {
+        'host': config.get('mongodb', 'DB_HOST'),
+        'port': config.getint('mongodb', 'DB_PORT'),
+        'user': config.get('mongodb', 'DB_USER'),
+        'password': config.get('mongodb', 'DB_PASS'),
+        'dbname': config.get('mongodb', 'DB_NAME')
+    }
+
+
+def load_api_token():
+    return load_config().get('DEFAULT', 'GITHUB_API_TOKEN')
+
+
+def load_api_tokens():
+    """
+    Returns the tokens requests are spread over: GITHUB_API_TOKENS, separated by commas or newlines,
+    or the single GITHUB_API_TOKEN when there is no list.
+    """
+    tokens = load_config().get('DEFAULT', 'GITHUB_API_TOKENS', fallback='')
+    return [token for token in re.split(r'[,\s]+', tokens) if token] or [load_api_token()]
+
+
+def load_storage_config():
+    """
+    Returns which database the scripts use: 'mongodb', or 'local' for a SQLite file (see local_store.py).
+    A relative PATH is relative to config.ini.
+    """
+    config = load_config()
+    path = config.get('storage', 'PATH', fallback=os.path.join('..', 'data', 'local.sqlite'))
+    return {
+        'backend': backend or config.get('storage', 'BACKEND', fallback='mongodb').lower(),
+        'path': os.path.join(os.path.dirname(CONFIG_PATH), path),
+    }
+
+
+def load_cache_config():
+    """
+    Returns the settings of the HTTP response cache, which is off unless ENABLED is set in the [cache] section.
+    """
+    config = load_config()
+    path = config.get('cache', 'PATH', fallback=os.path.join('..', 'data', 'http_cache.sqlite'))
+    return {
+        'enabled': config.getboolean('cache', 'ENABLED', fallback=False),
+        'path': os.path.join(os.path.dirname(CONFIG_PATH), path),
+        'ttl': config.getint('cache', 'TTL', fallback=response_cache.DEFAULT_TTL),
+        'max_size': config.getint('cache', 'MAX_SIZE_MB', fallback=response_cache.DEFAULT_MAX_SIZE >> 20) << 20,
+    }
+
+
+def load_telemetry_config():
+    """
+    Returns the settings of telemetry.start: the JSON lines log (LOG_PATH, empty for none), how often the throughput
+    is reported (PROGRESS_INTERVAL, 0 for never) and the port of the Prometheus endpoint (PROMETHEUS_PORT, off when unset).
+    """
+    config = load_config()
+    path = config.get('telemetry', 'LOG_PATH', fallback=os.path.join('..', 'data', 'telemetry.jsonl'))
+    port = config.get('telemetry', 'PROMETHEUS_PORT', fallback='')
+    return {
+        'log_path': os.path.join(os.path.dirname(CONFIG_PATH), path) if path else None,
+        'progress_interval': config.getint('telemetry', 'PROGRESS_INTERVAL', fallback=telemetry.PROGRESS_INTERVAL),
+        'prometheus_port': int(port) if port else None,
+    }
+
+
+def start_telemetry(run):
+    """
+    Starts the telemetry of a script with the settings of config.ini, see telemetry.py.
+    """
+    telemetry.start(run, **load_telemetry_config())
+
+
+def uses_mongodb():
+    """
+    Whether the scripts talk to a MongoDB server, the local store has no aggregation pipelines.
+    """
+    return load_storage_config()['backend'] == 'mongodb'
+
+# ------------------- MongoDB -------------------
+
+class ConnectionCounter(monitoring.ConnectionPoolListener):
+    def connection_created(self, event):
+        stats['mongo_connections'] += 1
+
+    def connection_ready(self, event):
+        # the connection finished its handshake and authentication
+        stats['mongo_handshakes'] += 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def connection_check_out_failed(self, event): pass
+    def connection_checked_out(self, event): pass
+    def connection_checked_in(self, event): pass
+
+
+class CommandCounter(monitoring.CommandListener):
+    def started(self, event):
+        telemetry.count('mongo_commands')
+
+    def succeeded(self, event):
+        telemetry.add_time('mongo_command', event.duration_micros / 1e6)
+
+    def failed(self, event):
+        telemetry.count('mongo_command_failures')
+
+
+def get_client():
+    """
+    Returns the MongoClient shared by everything in this process, creating it on first use.
+    MongoClient is thread safe and keeps a pool of connections, so there is no need for more than one.
+    """
+    global client
+    with lock:
+        if client is None:
+            mdb_config = load_mongodb_config()
+            # MongoDB URI string
+            mongo_uri = f"mongodb://{mdb_config['user']}:{mdb_config['password']}@{mdb_config['host']}:{mdb_config['port']}/{mdb_config['dbname']}?authSource=admin"
+            client = MongoClient(mongo_uri, maxPoolSize=MONGO_POOL_SIZE, event_listeners=[ConnectionCounter(), CommandCounter()])
+            stats['mongo_clients'] += 1
+    return client
+
+
+def get_local_db():
+    """
+    Returns the local store shared by everything in this process, opening it on first use.
+    """
+    global local_db
+    with lock:
+        if local_db is None:
+            path = load_storage_config()['path']
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            local_db = local_store.LocalDatabase(path)
+            stats['local_databases'] += 1
+    return local_db
+
+
+def use_local_store(path):
+    """
+    Points every script in this process at the local store in path, whatever config.ini says.
+    The benchmarks use this to run on their own data.
+    """
+    global backend, local_db
+    with lock:
+        backend = 'local'
+        local_db = local_store.LocalDatabase(path)
+    return local_db
+
+
+def get_db():
+    if not uses_mongodb():
+        return get_local_db()
+    return get_client()[load_mongodb_config()['dbname']]
+
+# ------------------- HTTP -------------------
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        stats['http_connections'] += 1
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        stats['http_connections'] += 1
+        return super()._new_conn()
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+def get_session():
+    """
+    Returns the keep-alive session used for every GitHub API request, creating it on first use.
+    The token is not part of the session, harvester.send picks one per request.
+    """
+    global session
+    with lock:
+        if session is None:
+            session = requests.Session()
+            adapter = CountingHTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Accept": "application/vnd.github.v3+json"})
+            stats['http_sessions'] += 1
+    return session
+
+
+def get_response_cache():
+    """
+    Returns the HTTP response cache shared by everything in this process, or None when it is disabled.
+    """
+    global cache
+    with lock:
+        if cache is None:
+            cache_config = load_cache_config()
+            if not cache_config['enabled']:
+                return None
+            os.makedirs(os.path.dirname(cache_config['path']), exist_ok=True)
+            cache = response_cache.ResponseCache(cache_config['path'], cache_config['ttl'], cache_config['max_size'], stats)
+    return cache
+
+
+def log_stats():
+    """
+    Reports the connections of this run, and the timers and throughput of telemetry.
+    """
+    telemetry.event("Connections: " + (", ".join(f"{key}={stats[key]}" for key in sorted(stats)) or "none"), **stats)
+    telemetry.log_summary()
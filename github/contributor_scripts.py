@@ -1,154 +1,209 @@
-import configparser
 from collections import defaultdict
-from datetime import datetime, timedelta
-from pymongo import MongoClient
+from itertools import groupby
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+import connections
+import contributors
+import metrics
+import telemetry
+from github import get_owner_and_repo
 
 PERIODS = 10
-
-
-# Connect to MongoDB
-def load_mongodb_config():
-    config = configparser.ConfigParser()
-    config.read('config.ini')
-    return {
-        'host': config.get('mongodb', 'DB_HOST'),
-        'port': config.getint('mongodb', 'DB_PORT'),
-        'user': config.get('mongodb', 'DB_USER'),
-        'password': config.get('mongodb', 'DB_PASS'),
-        'dbname': config.get('mongodb', 'DB_NAME')
-    }
-
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# how many project updates are sent to MongoDB in one bulk write
+BATCH_SIZE = 500
+# print progress every PROGRESS_EVERY projects
+PROGRESS_EVERY = 100
+
+
+def get_project_keys(db):
+    """
+    Maps every project in '<owner>/<repo>' format, the way pull requests refer to it,
+    to the github URLs of its documents in db.projects, so updates can match on the exact URL.
+    """
+    keys = defaultdict(list)
+    for project in db.projects.find({}, {"_id": 0, "github": 1}):
+        keys["/".join(get_owner_and_repo(project["github"]))].append(project["github"])
+    return keys
+
+
+def contributor_groups(db):
+    """
+    Counts the contributors per developer group of every project in db.projects, see contributors.group_sizes.
+    Projects without contributor documents, like the ones of an npm-miner export that come without their
+    pull requests, are counted from the reviewers embedded in them instead.
+
+    Returns:
+    A dictionary from the github URL of a project to the amount of new, contributing and core developers.
+    """
+    keys = get_project_keys(db)
+    groups = {github: sizes for project, sizes in contributors.group_sizes().items() for github in keys.get(project, [])}
+    for project in db.projects.find({"reviewers": {"$exists": True}}, {"_id": 0, "github": 1, "reviewers": 1}):
+        if project["github"] not in groups:
+            groups[project["github"]] = metrics.contributor_group_sizes([reviewer["contributions"] for reviewer in project["reviewers"]])
+    return groups
+
+
+def iterate_contributors(db):
+    """
+    Reads the contributors collection (see contributors.py) once, sorted by project, one project at a time.
+    Projects with pull requests but without contributors, stored before the harvesters kept the collection
+    up to date, are computed from their pull requests first.
+
+    Returns:
+    A generator of (project, contributors), where contributors is an iterator over the contributor documents of that project.
+    """
+    missing = set(db.pull_requests.distinct("project")) - set(db.contributors.distinct("project"))
+    if missing:
+        telemetry.event(f"Computing the contributors of {len(missing)} projects from their pull requests")
+        contributors.rebuild(missing)
+    cursor = db.contributors.find({}, {"_id": 0}).sort([("project", ASCENDING), ("login", ASCENDING)])
+    return groupby(cursor, key=lambda contributor: contributor["project"])
+
+
+def write_projects(db, results):
+    """
+    Writes the results of every project to its documents in db.projects, in batched bulk writes.
+
+    Parameters:
+    - db: The database.
+    - results: An iterable of (project, fields), the fields are set on the documents of the project.
+    """
+    keys = get_project_keys(db)
+    updates = []
+    done = 0
+
+    def flush():
+        if updates:
+            db.projects.bulk_write(updates, ordered=False)
+            updates.clear()
+
+    for project, fields in results:
+        updates.extend(UpdateOne({"github": github}, {"$set": fields}) for github in keys.get(project, []))
+        if len(updates) >= BATCH_SIZE:
+            flush()
+
+        done += 1
+        if done % PROGRESS_EVERY == 0:
+            telemetry.event(f"Processed {done} projects")
+
+    flush()
+    telemetry.event(f"Processed {done} projects in total")
+
+
+@telemetry.timed("contributor_scripts.aggregate")
 def aggregate():
-    mdb_config = load_mongodb_config()
-    # MongoDB URI string
-    mongo_uri = f"mongodb://{mdb_config['user']}:{mdb_config['password']}@{mdb_config['host']}:{mdb_config['port']}/{mdb_config['dbname']}?authSource=admin"
-    client = MongoClient(mongo_uri)
-    db = client[mdb_config['dbname']]
-
-    aggregated_data = defaultdict(lambda: defaultdict(lambda: {'count': 0, 'first_pull_request': None, 'last_pull_request': None}))
-
-    pull_requests = db.pull_requests
-
-    # Iterate over pull requests
-    for pr in pull_requests.find():
-        project = pr['project']
-        submitter = pr['submitter']
-        created_at = pr['created_at']
-
-        aggregated_data[project][submitter]['count'] += 1
-        if not aggregated_data[project][submitter]['first_pull_request']:
-            aggregated_data[project][submitter]['first_pull_request'] = created_at
-        aggregated_data[project][submitter]['last_pull_request'] = created_at
-
-    # Prepare final result
-    final_result = []
-    for project, submitters_data in aggregated_data.items():
-        project_reviews = {
-            "project": project,
-            "submitters": []
-        }
-        for submitter, review_data in submitters_data.items():
-            submitter_info = {
-                "name": submitter,
-                "contributions": review_data['count'],
-                "first_pull_request": review_data['first_pull_request'],
-                "last_pull_request": review_data['last_pull_request']
+    """
+    Stores the contributions and the first and last pull request of every submitter of every project,
+    in order of their first pull request, from the contributors collection instead of all pull requests.
+    """
+    db = connections.get_db()
+
+    def results():
+        for project, rows in iterate_contributors(db):
+            rows = sorted(rows, key=lambda contributor: contributor["first_pull_request"])
+            yield project, {"submitters": [{
+                "name": contributor["login"],
+                "contributions": contributor["count"],
+                "first_pull_request": contributor["first_pull_request"],
+                "last_pull_request": contributor["last_pull_request"]
+            } for contributor in rows]}
+
+    write_projects(db, results())
+
+
+def parse_dates(dates):
+    # native dates convert directly, older documents have '2024-03-07T10:25:25Z', which numpy wants without the Z
+    return np.array([date[:19] if isinstance(date, str) else date for date in dates], dtype="datetime64[s]")
+
+
+def format_date(date):
+    return date.astype(object).strftime(DATE_FORMAT)
+
+
+def period_edges(start, end, periods=PERIODS, unit=None):
+    """
+    Splits the time between the first and the last pull request of a project into periods.
+
+    Parameters:
+    - start: The time of the first pull request, as numpy datetime64.
+    - end: The time of the last pull request, as numpy datetime64.
+    - periods: The amount of periods of equal length, when no unit is given.
+    - unit: Use calendar periods instead, a numpy datetime unit like 'W', 'M' or 'Y'.
+
+    Returns:
+    The edges of the periods, one more than there are periods.
+    """
+    if unit is not None:
+        # from the start of the calendar period with the first pull request to the end of the one with the last
+        first = start.astype(f"datetime64[{unit}]")
+        last = end.astype(f"datetime64[{unit}]")
+        return np.arange(first, last + 2).astype("datetime64[s]")
+
+    total_duration = (end - start).astype(np.int64)
+    offsets = np.arange(periods + 1) * total_duration // periods
+    return start + offsets.astype("timedelta64[s]")
+
+
+def gained_per_period(first_times, start, end, periods=PERIODS, unit=None):
+    """
+    Counts how many new contributors a project gained in every period, a contributor is new
+    in the period of their first pull request.
+
+    Parameters:
+    - first_times: The time of the first pull request of every contributor, as numpy datetime64.
+    - start: The time of the first pull request of the project.
+    - end: The time of the last pull request of the project.
+    - periods: See period_edges.
+    - unit: See period_edges.
+
+    Returns:
+    A list with the start, end and amount of new contributors of every period.
+    """
+    edges = period_edges(start, end, periods, unit)
+
+    # periods include their start, the last one also includes its end, so every contributor counts once
+    buckets = np.searchsorted(edges, first_times, side="right") - 1
+    buckets = np.minimum(buckets, len(edges) - 2)
+    counts = np.bincount(buckets, minlength=len(edges) - 1)
+
+    return [{
+        "start": format_date(edges[i]),
+        "end": format_date(edges[i + 1]),
+        "count": int(counts[i])
+    } for i in range(len(edges) - 1)]
+
+
+@telemetry.timed("contributor_scripts.get_contributors_gained")
+def get_contributors_gained(periods=PERIODS, unit=None):
+    """
+    Stores the first and last pull request date and the contributors gained per period of every project.
+    Only the contributors collection is read, a contributor is new in the period of their first pull request.
+
+    Parameters:
+    - periods: See period_edges.
+    - unit: See period_edges.
+    """
+    db = connections.get_db()
+
+    def results():
+        for project, rows in iterate_contributors(db):
+            rows = list(rows)
+            first = min(contributor["first_pull_request"] for contributor in rows)
+            last = max(contributor["last_pull_request"] for contributor in rows)
+            first_times = parse_dates([contributor["first_pull_request"] for contributor in rows])
+            start, end = parse_dates([first, last])
+
+            yield project, {
+                "first_pr_date": first,
+                "last_pr_date": last,
+                "periods": gained_per_period(first_times, start, end, periods, unit)
             }
-            project_reviews["submitters"].append(submitter_info)
-        final_result.append(project_reviews)
-
-    projects = db.projects
-    print(final_result)
-    for project in final_result:
-        query = {"github": {"$regex": project['project']}}
-        projects.update_many(query, {"$set": {
-            "submitters": project['submitters']
-        }})
-
-
-def get_contributors_gained():
-    mdb_config = load_mongodb_config()
-    # MongoDB URI string
-    mongo_uri = f"mongodb://{mdb_config['user']}:{mdb_config['password']}@{mdb_config['host']}:{mdb_config['port']}/{mdb_config['dbname']}?authSource=admin"
-    client = MongoClient(mongo_uri)
-    db = client[mdb_config['dbname']]
-    collection = db.pull_requests
-
-    # Dictionary to store aggregated information
-    aggregated_data = defaultdict(
-        lambda: {'first_pr_date': None, 'last_pr_date': None, 'periods': lambda: {'start': None, 'end': None, 'count': None}})
-
-    # Iterate over pull requests
-    for pr in collection.find():
-        project = pr['project']
-        created_at = pr['created_at']
-
-        if not aggregated_data[project]['last_pr_date']:
-            aggregated_data[project]['last_pr_date'] = created_at
-        aggregated_data[project]['first_pr_date'] = created_at
-
-    # Prepare final result
-    final_result = []
-    for project, project_data in aggregated_data.items():
-        project_info = {
-            "project": project,
-            "first_pr_date": project_data['first_pr_date'],
-            "last_pr_date": project_data['last_pr_date']
-        }
-        final_result.append(project_info)
-
-    # Divide the total duration into 5 periods
-    for project_data in final_result:
-        start_time = datetime.strptime(project_data['first_pr_date'], "%Y-%m-%dT%H:%M:%SZ")
-        end_time = datetime.strptime(project_data['last_pr_date'], "%Y-%m-%dT%H:%M:%SZ")
-        total_duration = (end_time - start_time).total_seconds()
-        period_duration = total_duration / PERIODS
-
-        # Create a list to store the periods
-        periods = []
-        contributor_names = []
-
-        # Iterate to create 5 periods
-        for i in range(PERIODS):
-            # Calculate the start and end time of each period
-            period_start = start_time + timedelta(seconds=i * period_duration)
-            period_end = start_time + timedelta(seconds=(i + 1) * period_duration)
-
-            project_name = project_data['project']
-            period_contributor_count = 0
-
-            # Query with specified conditions
-            query = {
-                "project": project_name
-            }
-
-            for pr in collection.find(query):
-                created_at = datetime.strptime(pr['created_at'], "%Y-%m-%dT%H:%M:%SZ")
-                if period_start < created_at < period_end and pr['submitter'] not in contributor_names:
-                    contributor_names.append(pr['submitter'])
-                    period_contributor_count += 1
-
-            period_info = {
-                "start": datetime.strftime(period_start, "%Y-%m-%dT%H:%M:%SZ"),
-                "end": datetime.strftime(period_end, "%Y-%m-%dT%H:%M:%SZ"),
-                "count": period_contributor_count
-            }
-
-            # Append the period to the list
-            periods.append(period_info)
-
-        project_data['periods'] = periods
 
-    projects = db.projects
-    print(final_result)
-    for project in final_result:
-        query = {"github": {"$regex": project['project']}}
-        projects.update_many(query, {"$set": {
-            "first_pr_date": project['first_pr_date'],
-            "last_pr_date": project['last_pr_date'],
-            "periods": project['periods']
-        }})
+    write_projects(db, results())
 
 
 if __name__ == '__main__':
-    get_contributors_gained()
\ No newline at end of file
+    connections.start_telemetry("contributor_scripts")
+    get_contributors_gained()
+    connections.log_stats()
@@ -0,0 +1,163 @@
+"""
+The contributors of every project in db.contributors, one document per (project, login) with their amount of merged
+pull requests (count) and the first and last one. The harvesters keep it up to date, rebuild computes it from scratch.
+"""
+import argparse
+from collections import Counter, defaultdict
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+import connections
+import metrics
+import telemetry
+
+# ------------------- Global Variables & Config -------------------
+
+# how many contributor updates are sent in one bulk write
+BATCH_SIZE = 1000
+
+# ------------------- Functions -------------------
+
+def ensure_indexes():
+    collection = connections.get_db().contributors
+    collection.create_index([("project", ASCENDING), ("login", ASCENDING)], unique=True)
+    # the developer groups are ranges of count
+    collection.create_index([("count", DESCENDING)])
+
+
+def contributor_update(project, login, count, first, last):
+    return UpdateOne({"project": project, "login": login}, {
+        "$inc": {"count": count},
+        "$min": {"first_pull_request": first},
+        "$max": {"last_pull_request": last},
+    }, upsert=True)
+
+
+def write_updates(updates):
+    collection = connections.get_db().contributors
+    for start in range(0, len(updates), BATCH_SIZE):
+        collection.bulk_write(updates[start:start + BATCH_SIZE], ordered=False)
+
+
+def record(pull_requests):
+    """
+    Adds pull requests to the contributors of their projects. Every pull request must only be recorded once,
+    so only pass the ones that were not stored before.
+
+    Parameters:
+    - pull_requests: Pull request documents, of any amount of projects.
+    """
+    totals = {}
+    for pr in pull_requests:
+        key = (pr["project"], pr["submitter"])
+        if key in totals:
+            count, first, last = totals[key]
+            totals[key] = (count + 1, min(first, pr["created_at"]), max(last, pr["created_at"]))
+        else:
+            totals[key] = (1, pr["created_at"], pr["created_at"])
+
+    write_updates([contributor_update(project, login, *total) for (project, login), total in totals.items()])
+
+
+def contributor_totals(projects=None):
+    """
+    Counts the pull requests and finds the first and last one of every contributor, on MongoDB in one aggregation.
+
+    Returns:
+    A list of (project, login, count, first, last).
+    """
+    db = connections.get_db()
+    query = {"project": {"$in": list(projects)}} if projects is not None else {}
+    if connections.uses_mongodb():
+        cursor = db.pull_requests.aggregate([
+            {"$match": query},
+            {"$group": {"_id": {"project": "$project", "login": "$submitter"},
+                        "count": {"$sum": 1},
+                        "first": {"$min": "$created_at"},
+                        "last": {"$max": "$created_at"}}},
+        ], allowDiskUse=True)
+        return [(result["_id"]["project"], result["_id"]["login"], result["count"], result["first"], result["last"])
+                for result in cursor]
+
+    totals = defaultdict(list)
+    for pr in db.pull_requests.find(query, {"_id": 0, "project": 1, "submitter": 1, "created_at": 1}):
+        totals[(pr["project"], pr["submitter"])].append(pr["created_at"])
+    return [(project, login, len(times), min(times), max(times)) for (project, login), times in totals.items()]
+
+
+@telemetry.timed("contributors.rebuild")
+def rebuild(projects=None):
+    """
+    Computes the contributors from all stored pull requests, replacing what was recorded before.
+
+    Parameters:
+    - projects: Only rebuild these projects, in '<owner>/<repo>' format.
+
+    Returns:
+    The amount of contributors.
+    """
+    ensure_indexes()
+    totals = contributor_totals(projects)
+    connections.get_db().contributors.delete_many({"project": {"$in": list(projects)}} if projects is not None else {})
+    write_updates([contributor_update(*total) for total in totals])
+    return len(totals)
+
+
+def group_filter(group):
+    """
+    Returns the condition on count of a developer group, 'new', 'contributing' or 'core', see metrics.CONTRIBUTOR_GROUP_BOUNDS.
+    """
+    new, contributing, core = metrics.CONTRIBUTOR_GROUP_BOUNDS
+    return {
+        "new": {"$gt": new, "$lt": contributing},
+        "contributing": {"$gte": contributing, "$lt": core},
+        "core": {"$gte": core},
+    }[group]
+
+
+def group_members(group, project=None):
+    """
+    Returns the contributors of a developer group, of one project or of all of them, most active first.
+    """
+    query = {"count": group_filter(group)}
+    if project is not None:
+        query["project"] = project
+    return list(connections.get_db().contributors.find(query, {"_id": 0}).sort([("count", DESCENDING)]))
+
+
+def group_sizes():
+    """
+    Counts the members of every developer group of every project, with a query on the count index per group.
+
+    Returns:
+    A dictionary from project, in '<owner>/<repo>' format, to the amount of new, contributing and core developers.
+    """
+    db = connections.get_db()
+    sizes = defaultdict(lambda: [0] * len(metrics.CONTRIBUTOR_GROUPS))
+    for i, group in enumerate(metrics.CONTRIBUTOR_GROUPS):
+        query = {"count": group_filter(group)}
+        if connections.uses_mongodb():
+            cursor = db.contributors.aggregate([{"$match": query}, {"$group": {"_id": "$project", "members": {"$sum": 1}}}])
+            members = [(result["_id"], result["members"]) for result in cursor]
+        else:
+            members = Counter(contributor["project"] for contributor in db.contributors.find(query, {"_id": 0, "project": 1})).items()
+        for project, amount in members:
+            sizes[project][i] = amount
+    return dict(sizes)
+
+
+def retained(project, since):
+    """
+    Returns the logins of the contributors of a project that submitted a pull request created at or after since.
+    """
+    query = {"project": project, "last_pull_request": {"$gte": since}}
+    return [contributor["login"] for contributor in connections.get_db().contributors.find(query, {"_id": 0, "login": 1})]
+
+
+if __name__ == "__main__":
+    connections.start_telemetry("contributors")
+    parser = argparse.ArgumentParser(description="Compute the contributors collection from the stored pull requests.")
+    parser.add_argument("projects", nargs="*", help="only these projects, in <owner>/<repo> format")
+    args = parser.parse_args()
+
+    print(f"Stored {rebuild(args.projects or None)} contributors")
+    connections.log_stats()
@@ -0,0 +1,317 @@
+"""
+Derives the documentation flags from the repositories themselves: README, homepage and wiki from the GraphQL metadata,
+comments from the tarball of the latest commit. Scans are kept per commit in db.doc_scans.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import tarfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+import connections
+import harvester
+import graphql_harvester
+import telemetry
+from github import get_owner_and_repo
+
+# ------------------- Global Variables & Config -------------------
+
+MIN_README_BYTES = 300
+MIN_COMMENT_RATIO = 0.1
+SOURCE_EXTENSIONS = (".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".mts", ".cts")
+# dependencies, build output and minified files say nothing about how the code is documented
+SKIPPED_DIRECTORIES = {"node_modules", "dist", "build", "vendor", "coverage", "bower_components"}
+SKIPPED_SUFFIXES = (".min.js", ".bundle.js")
+MAX_FILE_BYTES = 1 << 20
+# homepages that only point back at the repository or the package
+NOT_A_WEBSITE = re.compile(r"^https?://(www\.)?(github\.com|npmjs\.com|npmjs\.org|npm\.im)(/|$)", re.IGNORECASE)
+
+REPOSITORIES_PER_QUERY = 50
+SCAN_WORKERS = os.cpu_count() or 4
+DOWNLOAD_WORKERS = 4
+TARBALL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'tarballs')
+
+METADATA_FIELDS = """
+    hasWikiEnabled
+    homepageUrl
+    defaultBranchRef { target { oid } }
+    object(expression: "HEAD:") { ... on Tree { entries { name type object { ... on Blob { byteSize } } } } }
+"""
+
+TOKEN = re.compile(r"""
+    (?P<line_comment>//[^\n]*)
+  | (?P<block_comment>/\*.*?(?:\*/|\Z))
+  | (?P<string>'(?:\\.|[^'\\\n])*'?|"(?:\\.|[^"\\\n])*"?)
+  | (?P<template>`(?:\\.|[^`\\])*`?)
+  | (?P<word>[A-Za-z_$][\w$]*|\d[\w.]*)
+  | (?P<newline>\n)
+  | (?P<space>[ \t\r\f\v]+)
+  | (?P<other>.)
+""", re.DOTALL | re.VERBOSE)
+REGEX_LITERAL = re.compile(r"/(?:\\.|\[(?:\\.|[^\]\\\n])*\]|[^/\\\n\[])+/[a-z]*")
+# after these a / starts a regular expression instead of a division
+REGEX_PRECEDERS = set("(,=:[!&|?{};+-*%<>~^") | {""}
+REGEX_KEYWORDS = {"return", "typeof", "case", "do", "else", "in", "of", "new", "delete", "void", "throw", "instanceof", "yield", "await"}
+
+# ------------------- Tokenizing -------------------
+
+def count_comment_lines(source):
+    """
+    Counts the lines of a JavaScript or TypeScript file that have code or comments, and those that have comments.
+    Strings, template literals and regular expressions are skipped, so a // or /* inside them is no comment.
+
+    Returns:
+    A tuple of the amount of non-blank lines and the amount of lines with a comment.
+    """
+    lines = set()
+    comment_lines = set()
+    line = 0
+    previous = ""
+    position = 0
+    while position < len(source):
+        if source[position] == "/" and (previous in REGEX_PRECEDERS or previous in REGEX_KEYWORDS) \
+                and not source.startswith(("//", "/*"), position):
+            match = REGEX_LITERAL.match(source, position)
+            if match:
+                lines.add(line)
+                previous = "regex"
+                position = match.end()
+                continue
+
+        match = TOKEN.match(source, position)
+        kind = match.lastgroup
+        text = match.group()
+        position = match.end()
+        if kind == "newline":
+            line += 1
+            continue
+        if kind == "space":
+            continue
+
+        spanned = range(line, line + text.count("\n") + 1)
+        lines.update(spanned)
+        if kind in ("line_comment", "block_comment"):
+            comment_lines.update(spanned)
+        else:
+            previous = text if kind in ("word", "other") else kind
+        line = spanned[-1]
+
+    return len(lines), len(comment_lines)
+
+
+def is_source_file(path):
+    parts = path.split("/")
+    return path.endswith(SOURCE_EXTENSIONS) and not path.endswith(SKIPPED_SUFFIXES) \
+        and not any(part in SKIPPED_DIRECTORIES for part in parts[:-1])
+
+
+def scan_tarball(path):
+    """
+    Streams a repository tarball, laid out like GitHub's with everything in one top directory,
+    and counts the comments in its source files. Runs in the scan processes.
+
+    Returns:
+    A dictionary with the amount of source files, lines and comment lines, the size of the README in the root
+    and the homepage from the package.json in the root.
+    """
+    scan = {"files": 0, "lines": 0, "comment_lines": 0, "readme_bytes": 0, "homepage": None}
+    with tarfile.open(path, "r|*") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            name = member.name.split("/", 1)[1] if "/" in member.name else member.name
+
+            if "/" not in name and name.lower().startswith("readme"):
+                scan["readme_bytes"] = max(scan["readme_bytes"], member.size)
+            elif name == "package.json":
+                try:
+                    homepage = json.load(archive.extractfile(member)).get("homepage")
+                    scan["homepage"] = homepage if isinstance(homepage, str) else None
+                except ValueError:
+                    pass
+            elif is_source_file(name) and member.size <= MAX_FILE_BYTES:
+                source = archive.extractfile(member).read().decode("utf-8", errors="replace")
+                lines, comment_lines = count_comment_lines(source)
+                scan["files"] += 1
+                scan["lines"] += lines
+                scan["comment_lines"] += comment_lines
+    return scan
+
+# ------------------- Metadata -------------------
+
+def build_metadata_query(amount):
+    variables = ", ".join(f"$owner{i}: String!, $name{i}: String!" for i in range(amount))
+    fields = "".join(f"\n  r{i}: repository(owner: $owner{i}, name: $name{i}) {{{METADATA_FIELDS}  }}" for i in range(amount))
+    return f"query({variables}) {{\n  rateLimit {{ cost remaining resetAt }}{fields}\n}}"
+
+
+def parse_metadata(node):
+    readme_bytes = 0
+    for entry in ((node.get("object") or {}).get("entries") or []):
+        if entry["type"] == "blob" and entry["name"].lower().startswith("readme"):
+            readme_bytes = max(readme_bytes, (entry.get("object") or {}).get("byteSize") or 0)
+    return {
+        "sha": ((node.get("defaultBranchRef") or {}).get("target") or {}).get("oid"),
+        "has_wiki": node["hasWikiEnabled"],
+        "homepage": node["homepageUrl"] or None,
+        "readme_bytes": readme_bytes,
+    }
+
+
+def fetch_metadata(projects):
+    """
+    Fetches the metadata of many repositories, REPOSITORIES_PER_QUERY per GraphQL query.
+
+    Returns:
+    A dictionary from project to its metadata, repositories that do not exist are left out.
+    """
+    metadata = {}
+    for start in range(0, len(projects), REPOSITORIES_PER_QUERY):
+        batch = projects[start:start + REPOSITORIES_PER_QUERY]
+        variables = {}
+        for i, project in enumerate(batch):
+            variables[f"owner{i}"], variables[f"name{i}"] = project.split("/")
+        data = graphql_harvester.run_query(build_metadata_query(len(batch)), variables)
+        for i, project in enumerate(batch):
+            if data.get(f"r{i}"):
+                metadata[project] = parse_metadata(data[f"r{i}"])
+    return metadata
+
+
+def load_fixture_metadata(fixtures):
+    # optional, without it the README and homepage come from the tarball and there is no wiki
+    path = os.path.join(fixtures, "metadata.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+# ------------------- Scanning -------------------
+
+def fixture_path(fixtures, project):
+    return os.path.join(fixtures, project.replace("/", "_") + ".tar.gz")
+
+
+def file_sha(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download_tarball(project, sha):
+    path = os.path.join(TARBALL_DIR, f"{project.replace('/', '_')}_{sha}.tar.gz")
+    response = harvester.send('GET', f"{harvester.API_URL}/repos/{project}/tarball/{sha}", stream=True)
+    if response.status_code != 200:
+        raise Exception(f"GitHub API returned {response.status_code} for the tarball of {project}")
+    with open(path, "wb") as file:
+        for chunk in response.iter_content(1 << 20):
+            file.write(chunk)
+    return path
+
+
+def documentation_flags(metadata, scan):
+    readme_bytes = metadata.get("readme_bytes") or scan["readme_bytes"]
+    homepage = metadata.get("homepage") or scan["homepage"]
+    return {
+        "README_documentation": readme_bytes >= MIN_README_BYTES,
+        "comments_in_code": scan["lines"] > 0 and scan["comment_lines"] / scan["lines"] >= MIN_COMMENT_RATIO,
+        "website_linked": bool(homepage) and not NOT_A_WEBSITE.match(homepage),
+        # only says the wiki is switched on, which it is by default, not that it has any pages: GitHub has no API
+        # for wiki pages and an empty wiki is not a repository that can be cloned
+        "wiki_present": bool(metadata.get("has_wiki")),
+    }
+
+
+@telemetry.timed("doc_scanner.scan_projects")
+def scan_projects(github_urls, fixtures=None, workers=SCAN_WORKERS):
+    """
+    Scans the repositories and stores their documentation flags in db.projects.
+
+    Parameters:
+    - github_urls: The github URLs of the projects, as in db.projects.
+    - fixtures: A directory with <owner>_<repo>.tar.gz tarballs and optionally a metadata.json,
+      scanned instead of the repositories on GitHub, without any network access.
+    - workers: How many processes scan tarballs at the same time.
+
+    Returns:
+    A dictionary from github URL to its flags.
+    """
+    db = connections.get_db()
+    projects = {url: "/".join(get_owner_and_repo(url)) for url in github_urls}
+    if fixtures:
+        metadata = load_fixture_metadata(fixtures)
+        for url, project in list(projects.items()):
+            if not os.path.exists(fixture_path(fixtures, project)):
+                telemetry.event(f"No fixture for {project}, skipping", logging.WARNING)
+                del projects[url]
+            else:
+                metadata.setdefault(project, {})["sha"] = metadata.get(project, {}).get("sha") or file_sha(fixture_path(fixtures, project))
+    else:
+        metadata = fetch_metadata(sorted(set(projects.values())))
+
+    # only commits that were never scanned before are scanned
+    keys = {project: f"{project}@{metadata[project]['sha']}" for project in set(projects.values())
+            if metadata.get(project, {}).get("sha")}
+    scans = {scan.pop("_id"): scan for scan in db.doc_scans.find({"_id": {"$in": list(keys.values())}})}
+    missing = sorted(project for project, key in keys.items() if key not in scans)
+    telemetry.event(f"Scanning {len(missing)} repositories, {len(keys) - len(missing)} cached")
+
+    def tarball(project):
+        if fixtures:
+            return fixture_path(fixtures, project)
+        os.makedirs(TARBALL_DIR, exist_ok=True)
+        return download_tarball(project, metadata[project]["sha"])
+
+    # downloads overlap with the scanning, every tarball is scanned as soon as it is on disk
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as download_pool, \
+            ProcessPoolExecutor(max_workers=workers) as scan_pool:
+        downloads = {project: download_pool.submit(tarball, project) for project in missing}
+        pending = {}
+        for project, download in downloads.items():
+            try:
+                pending[project] = (download.result(), scan_pool.submit(scan_tarball, download.result()))
+            except Exception as e:
+                telemetry.event(f"Failed to download {project}: {e}", logging.ERROR)
+
+        for project, (path, future) in pending.items():
+            try:
+                scan = future.result()
+            except Exception as e:
+                telemetry.event(f"Failed to scan {project}: {e}", logging.ERROR)
+                continue
+            finally:
+                if not fixtures:
+                    os.remove(path)
+            scans[keys[project]] = scan
+            db.doc_scans.update_one({"_id": keys[project]}, {"$set": {**scan, "scanned_at": datetime.now(timezone.utc)}}, upsert=True)
+
+    results = {}
+    updates = []
+    for url, project in projects.items():
+        if keys.get(project) in scans:
+            results[url] = documentation_flags(metadata[project], scans[keys[project]])
+            updates.append(UpdateOne({"github": url}, {"$set": {**results[url], "documentation_sha": metadata[project]["sha"]}}))
+    if updates:
+        db.projects.bulk_write(updates, ordered=False)
+    telemetry.event(f"Updated the documentation flags of {len(updates)} projects")
+    return results
+
+
+if __name__ == "__main__":
+    connections.start_telemetry("doc_scanner")
+    parser = argparse.ArgumentParser(description="Derive the documentation flags of every project from its repository.")
+    parser.add_argument("--fixtures", help="directory with <owner>_<repo>.tar.gz tarballs to scan instead of GitHub")
+    parser.add_argument("--workers", type=int, default=SCAN_WORKERS, help="scan processes")
+    args = parser.parse_args()
+
+    urls = [project["github"] for project in connections.get_db().projects.find({}, {"_id": 0, "github": 1})]
+    scan_projects(urls, args.fixtures, args.workers)
+    connections.log_stats()
+    harvester.log_token_stats()
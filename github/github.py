@@ -1,68 +1,95 @@
-import requests
-import configparser
-from pymongo import MongoClient
+from pymongo import ASCENDING, UpdateOne
+import logging
 import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import connections
+import contributors
+import harvester
+import graphql_harvester
+import telemetry
 
 # ------------------- Global Variables & Config -------------------
 
-url_pattern = re.compile(r'<(https?://[^>]+)>; rel="next"')
+# a project needs more than MIN_MERGED_PRS and less than MAX_MERGED_PRS merged human PRs
+MIN_MERGED_PRS = 100
+MAX_MERGED_PRS = 1000
 
-def load_mongodb_config():
-    config = configparser.ConfigParser()
-    config.read('config.ini')
-    return {
-        'host': config.get('mongodb', 'DB_HOST'),
-        'port': config.getint('mongodb', 'DB_PORT'),
-        'user': config.get('mongodb', 'DB_USER'),
-        'password': config.get('mongodb', 'DB_PASS'),
-        'dbname': config.get('mongodb', 'DB_NAME')
-    }
+# candidates are the repositories of npm packages with more than MIN_DOWNLOADS and less than MAX_DOWNLOADS downloads
+MIN_DOWNLOADS = 2000000
+MAX_DOWNLOADS = 10000000
+# how many candidates fetch_github_urls returns at a time, and the cursor it continues from by default
+CANDIDATE_BATCH_SIZE = 100
+CANDIDATE_CURSOR = "npm"
 
-mdb_config = load_mongodb_config()
-# MongoDB URI string
-mongo_uri = f"mongodb://{mdb_config['user']}:{mdb_config['password']}@{mdb_config['host']}:{mdb_config['port']}/{mdb_config['dbname']}?authSource=admin"
-client = MongoClient(mongo_uri)
-db = client[mdb_config['dbname']]
+# ------------------- Functions -------------------
 
-def load_api_token():
-    config = configparser.ConfigParser()
-    config.read('config.ini')
-    return config.get('DEFAULT', 'GITHUB_API_TOKEN')
+def ensure_candidate_index():
+    # the candidates are read in URL order starting right after the cursor, the download count is filtered in the index
+    connections.get_db().npm.create_index([("github", ASCENDING), ("downloads.downloads", ASCENDING)])
 
-# Use the loaded API token
-api_token = load_api_token()
-headers = {
-    "Accept": "application/vnd.github.v3+json",
-    "Authorization": f"token {api_token}",
-}
 
-# ------------------- Functions -------------------
+def select_candidates(position, batch_size):
+    """
+    Selects the next candidates: every github URL of a package with a download count in range, ordered by URL,
+    which doesn't change when a package is published again. The packages are read from the index starting right
+    after the position, the last URL that was processed, and only until the batch is full, so a batch costs the
+    same wherever the cursor is.
 
-def insert_pull_requests_to_mongodb(pull_requests):
-    collection = db.pull_requests
-    collection.insert_many(pull_requests)
-
-def fetch_github_urls():
-    collection = db.npm
-    
-    # Query with specified conditions
-    query = {
-        "downloads.downloads": {
-            "$gt": 2000000,
-            "$lt": 10000000
-        }
-    }
-    
-    # Sorting, limiting and projecting the query
-    github_urls = collection.find(query).sort("pkg.time.modified", -1).distinct("github")
-    
-    # return the url 100 till 200
-    return github_urls[201:300]
+    Returns:
+    A list of github URLs, in order.
+    """
+    # every URL is greater than "", packages without one are left out
+    query = {"github": {"$gt": position or ""}, "downloads.downloads": {"$gt": MIN_DOWNLOADS, "$lt": MAX_DOWNLOADS}}
+    packages = connections.get_db().npm.find(query, {"_id": 0, "github": 1}).sort([("github", ASCENDING)])
+    candidates = []
+    for package in packages:
+        # the packages of a repository come one after the other
+        if candidates and candidates[-1] == package["github"]:
+            continue
+        if len(candidates) == batch_size:
+            break
+        candidates.append(package["github"])
+    return candidates
+
+
+def fetch_github_urls(batch_size=CANDIDATE_BATCH_SIZE, cursor=CANDIDATE_CURSOR):
+    """
+    Returns the next batch of candidate repositories, after the position of the cursor.
+    The cursor only moves when the batch is done, see advance_candidate_cursor, so a run that is interrupted
+    gets the same batch again. The position is stored in db.candidate_cursors, so every run continues where
+    the previous one stopped. An empty list means every candidate was processed, reset_candidate_cursor starts over.
+
+    Parameters:
+    - batch_size: How many github URLs are returned.
+    - cursor: The name of the cursor, runs that use different names select candidates independently.
+    """
+    ensure_candidate_index()
+    state = connections.get_db().candidate_cursors.find_one({"_id": cursor}) or {}
+    return select_candidates(state.get("position"), batch_size)
+
+
+def advance_candidate_cursor(github_urls, cursor=CANDIDATE_CURSOR):
+    """
+    Moves the cursor past a batch of fetch_github_urls, once every repository in it was processed.
+    """
+    if github_urls:
+        connections.get_db().candidate_cursors.update_one({"_id": cursor}, {
+            "$max": {"position": max(github_urls)},
+            "$set": {"last_run": datetime.now(timezone.utc)},
+            "$inc": {"processed": len(github_urls)},
+        }, upsert=True)
+
+
+def reset_candidate_cursor(cursor=CANDIDATE_CURSOR):
+    connections.get_db().candidate_cursors.delete_one({"_id": cursor})
 
 
 def get_owner_and_repo(url):
     """
-    Extracts the owner and repository name from a GitHub URL.
+    Extracts the owner and repository name from a GitHub URL. Every script uses this to turn the github
+    field of a project into the '<owner>/<repo>' the pull requests are stored under.
     Example input url: git+https://github.com/element-plus/element-plus.git
 
     Parameters:
@@ -71,131 +98,375 @@ def get_owner_and_repo(url):
     Returns:
     A tuple containing the owner and repository name.
     """
-    parts = url.split('/')
-    owner = parts[-2]
-    repo = parts[-1].split('.')[0]
-    return owner, repo
+    # some links point to a branch like '...repo.git#main', and names can contain dots, like 'bar.js'
+    path = url.split('#')[0].rstrip('/')
+    if path.endswith('.git'):
+        path = path[:-4]
+    # ':' separates the owner in links like 'git@github.com:owner/repo'
+    parts = re.split(r'[/:]', path)
+    return parts[-2], parts[-1]
 
 
-def get_pull_requests(repo_url):
+def get_pull_requests_url(repo_url):
+    owner, repo = get_owner_and_repo(repo_url)
+    # most recently updated first, so incremental runs can stop at the first pull request they have already seen
+    return f"{harvester.API_URL}/repos/{owner}/{repo}/pulls?state=closed&sort=updated&direction=desc&per_page=100"
+
+
+def parse_pull_request(project, pr):
+    if pr['merged_at'] is None or pr['user']['type'] != 'User': # only consider merged PRs
+        return None
+
+    created_at = harvester.parse_date(pr['created_at'])
+    merged_at = harvester.parse_date(pr['merged_at'])
+    return {
+        'project': project,
+        'number': pr['number'],
+        'title': pr['title'],
+        'created_at': created_at,
+        'merged_at': merged_at,
+        'merge_seconds': harvester.merge_seconds(created_at, merged_at),
+        'submitter': pr['user']['login'],
+        'reviewers': [reviewer['login'] for reviewer in pr.get('requested_reviewers', [])],
+        'assignees': [assignee['login'] for assignee in pr.get('assignees', [])],
+    }
+
+
+def parse_pull_requests(repo_url, pages):
     """
-    Fetches pull request data for a given GitHub repository.
+    Extracts the merged, human made pull requests from the fetched pages of a repository.
 
     Parameters:
-    - owner: The owner of the repository.
-    - repo: The name of the repository.
+    - repo_url: The URL of the GitHub repository.
+    - pages: The decoded JSON of every page of closed pull requests.
 
     Returns:
     A list of dictionaries, each containing data about a pull request.
     """
     pull_requests = []
     owner, repo = get_owner_and_repo(repo_url)
-    url = f"https://api.github.com/repos/{owner}/{repo}/pulls?state=closed&per_page=100"
-
-    # GitHub API paginates responses, so we need to handle pagination.
-    while url:
-        print(f"Requesting URL: {url}")  # Debug: Print the URL before the request
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            raise Exception(f"GitHub API returned {response.status_code}: {response.json()}")
-        data = response.json()
+
+    for data in pages:
         for pr in data:
-            if pr['merged_at'] is None or pr['user']['type'] != 'User': # only consider merged PRs
-                continue
-
-            pr_data = {
-                'project': f"{owner}/{repo}",
-                'title': pr['title'],
-                'created_at': pr['created_at'],
-                'merged_at': pr['merged_at'],
-                'submitter': pr['user']['login'],
-                'reviewers': [reviewer['login'] for reviewer in pr.get('requested_reviewers', [])],
-                'assignees': [assignee['login'] for assignee in pr.get('assignees', [])],
-            }
-
-            pull_requests.append(pr_data)
-
-        # GitHub provides the next page URL in the Link header
-        link = response.headers.get('Link')
-        if link:
-            match = url_pattern.search(link)
-        else:
-            match = None
-        
-        if match:
-            url = match.group(1)  # Extract the URL directly without angle brackets
-        else:
-            url = None
+            pr_data = parse_pull_request(f"{owner}/{repo}", pr)
+            if pr_data is not None:
+                pull_requests.append(pr_data)
 
     return pull_requests
 
+
+def get_pull_requests(repo_url):
+    """
+    Fetches pull request data for a given GitHub repository.
+    After the first page, the remaining pages are requested in parallel.
+
+    Parameters:
+    - repo_url: The URL of the GitHub repository.
+
+    Returns:
+    A list of dictionaries, each containing data about a pull request.
+    """
+    with ThreadPoolExecutor(max_workers=harvester.MAX_PAGE_WORKERS) as page_pool:
+        pages = harvester.fetch_all_pages(get_pull_requests_url(repo_url), page_pool)
+    return parse_pull_requests(repo_url, pages)
+
+
+def is_good_repo(merged_human_prs_count):
+    # make sure the project is big enough, but not too big
+    return MIN_MERGED_PRS < merged_human_prs_count < MAX_MERGED_PRS
+
+
+def count_merged_human_prs(repo_url, pages):
+    merged_human_prs_count = 0
+    for data in pages:
+        for pr in data:
+            if pr.get('merged_at') is not None and pr['user']['type'] == 'User':  # Check if PR is merged and made by a human
+                merged_human_prs_count += 1
+        # too big already, no need to fetch the remaining pages
+        if merged_human_prs_count >= MAX_MERGED_PRS:
+            break
+    return merged_human_prs_count
+
+
+def collect_good_repo_pull_requests(repo_url, pages):
+    """
+    Parses the pages of a repository while counting its merged human PRs.
+    Stops fetching as soon as the repository has too many of them.
+
+    Parameters:
+    - repo_url: The URL of the GitHub repository.
+    - pages: The pages of closed pull requests, see harvester.stream_pages.
+
+    Returns:
+    The pull requests of the repository if it qualifies, None otherwise.
+    """
+    pull_requests = []
+    for data in pages:
+        pull_requests.extend(parse_pull_requests(repo_url, [data]))
+        if len(pull_requests) >= MAX_MERGED_PRS:
+            return None
+
+    if not is_good_repo(len(pull_requests)):
+        return None
+    return pull_requests
+
+
+def unavailable_as_none(process):
+    """
+    Wraps a process function of harvester.harvest, so a repository that is gone for good has the result None
+    instead of being left out of the results like the repositories that failed.
+    """
+    def process_available(repo_url, pages):
+        try:
+            return process(repo_url, pages)
+        except harvester.RepositoryUnavailable as e:
+            harvester.skip_unavailable(repo_url, e)
+            return None
+    return process_available
+
+
+def completed_candidates(candidates, results):
+    """
+    Returns the candidates up to the first one that failed, the ones the cursor may move past.
+    The failed one and everything after it are selected again by the next run, so a repository
+    that failed for a temporary reason is not skipped for good.
+    """
+    completed = []
+    for repo_url in candidates:
+        if repo_url not in results:
+            telemetry.event(f"Failed to harvest {repo_url}, the next run starts at it again", logging.WARNING, repository=repo_url)
+            break
+        completed.append(repo_url)
+    return completed
+
+
 def filter_repos_with_many_merged_prs(repo_list):
-    qualified_repos = []
+    """
+    Returns the repositories that qualify, and the candidates the cursor may move past, see completed_candidates.
+    """
+    counts = harvester.harvest(repo_list, get_pull_requests_url, unavailable_as_none(count_merged_human_prs))
 
+    qualified_repos = []
     for repo_url in repo_list:
-        owner, repo = get_owner_and_repo(repo_url)
-        url = f"https://api.github.com/repos/{owner}/{repo}/pulls?state=closed&per_page=100"
-        merged_human_prs_count = 0
-        while url:
-            response = requests.get(url, headers=headers)
-            if response.status_code != 200:
-                print(f"Failed to fetch data for {repo}: {response.status_code}")
+        # repos that could not be fetched are left out of counts, the ones that are gone count 0
+        if is_good_repo(counts.get(repo_url) or 0):
+            qualified_repos.append(repo_url)
+
+    return qualified_repos, completed_candidates(repo_list, counts)
+
+def ensure_indexes():
+    db = connections.get_db()
+    # pull requests are upserted by number, older documents without a number are left out of the index
+    db.pull_requests.create_index([("project", ASCENDING), ("number", ASCENDING)], unique=True,
+                                  partialFilterExpression={"number": {"$exists": True}})
+    # the dates are native, so date ranges of a project are answered from an index
+    db.pull_requests.create_index([("project", ASCENDING), ("merged_at", ASCENDING)])
+    contributors.ensure_indexes()
+
+
+def replace_pull_requests(project, pull_requests):
+    """
+    Stores all pull requests of a repository, and deletes the documents from before the pull request number was stored,
+    which the upsert can't match, so the repository doesn't end up with every pull request twice.
+    """
+    replaced = connections.get_db().pull_requests.delete_many({"project": project, "number": {"$exists": False}}).deleted_count
+    upsert_pull_requests_to_mongodb(pull_requests)
+    if replaced:
+        # the replaced documents may have been counted, and are counted again now
+        contributors.rebuild([project])
+
+
+def upsert_pull_requests_to_mongodb(pull_requests):
+    if pull_requests:
+        result = connections.get_db().pull_requests.bulk_write([
+            UpdateOne({"project": pr["project"], "number": pr["number"]}, {"$set": pr}, upsert=True)
+            for pr in pull_requests
+        ], ordered=False)
+        # pull requests that were stored before, like on pages that are fetched again, are already counted
+        contributors.record([pull_requests[index] for index in result.upserted_ids])
+        telemetry.count("pull_requests_stored", len(pull_requests))
+
+
+def sync_pull_requests(repo_url, page_pool):
+    """
+    Brings the pull requests of a repository in MongoDB up to date.
+    The sync state of the repository (db.sync_state) keeps the newest updated_at seen and the ETag of every page.
+    A re-run sends every page with If-None-Match, and stops at the first unchanged page (304, which does not
+    count against the rate limit) or at the first pull request that was not updated since the last run.
+    Without sync state every page is fetched, and documents from before the pull request number was stored are replaced.
+
+    Parameters:
+    - repo_url: The URL of the GitHub repository.
+    - page_pool: The executor that fetches the pages, see harvester.for_each_repo.
+
+    Returns:
+    The amount of pull requests that were stored.
+    """
+    db = connections.get_db()
+    owner, repo = get_owner_and_repo(repo_url)
+    project = f"{owner}/{repo}"
+    state = db.sync_state.find_one({"_id": project}) or {}
+    etags = state.get("etags", {})
+    watermark = state.get("last_updated_at")
+
+    def page_headers(page):
+        etag = etags.get(str(page))
+        return {"If-None-Match": etag} if etag else None
+
+    # a warm run usually only needs the first page, so don't request pages ahead
+    window = 1 if watermark else harvester.PAGE_WINDOW
+    responses = harvester.stream_responses(get_pull_requests_url(repo_url), page_pool, window, page_headers)
+
+    new_etags = {}
+    last_updated_at = watermark
+    pull_requests = []
+    try:
+        for page, response in enumerate(responses, start=1):
+            if response.status_code == 304:
+                new_etags[str(page)] = etags[str(page)]
                 break
-            data = response.json()
-            for pr in data:
-                if pr.get('merged_at') is not None and pr['user']['type'] == 'User':  # Check if PR is merged and made by a human
-                    merged_human_prs_count += 1
+            data = harvester.check_response(response)
+            new_etags[str(page)] = response.headers.get("ETag")
 
-            # Check for the next page
-            if 'next' in response.links:
-                url = response.links['next']['url']
-            else:
+            reached_watermark = False
+            for pr in data:
+                if watermark and pr["updated_at"] < watermark:
+                    reached_watermark = True
+                    break
+                if last_updated_at is None or pr["updated_at"] > last_updated_at:
+                    last_updated_at = pr["updated_at"]
+                pr_data = parse_pull_request(project, pr)
+                if pr_data is not None:
+                    pull_requests.append(pr_data)
+            if reached_watermark:
                 break
-        
-        # make sure the project is big enough, but not too big
-        if merged_human_prs_count > 100 and merged_human_prs_count < 1000:
-            qualified_repos.append(repo_url)
+    finally:
+        responses.close()
 
-    return qualified_repos
+    if watermark:
+        upsert_pull_requests_to_mongodb(pull_requests)
+    else:
+        replace_pull_requests(project, pull_requests)
 
+    # only keep the ETags of pages requested in this run, the content of the other pages may have shifted
+    db.sync_state.update_one({"_id": project}, {"$set": {
+        "last_updated_at": last_updated_at,
+        "etags": new_etags,
+        "last_run": datetime.now(timezone.utc),
+    }}, upsert=True)
+
+    return len(pull_requests)
+
+
+@telemetry.timed("github.push_pull_requests_to_mongodb")
 def push_pull_requests_to_mongodb(urls):
+    ensure_indexes()
+
+    def sync(url, page_pool):
+        amount = sync_pull_requests(url, page_pool)
+        telemetry.event(f"Stored {amount} new or updated pull requests for {url}", repository=url, pull_requests=amount)
 
-    # Fetch pull requests for each URL and insert them into MongoDB
-    for url in urls:
-        pull_requests = get_pull_requests(url)
-        insert_pull_requests_to_mongodb(pull_requests)
-        print(f"Inserted {len(pull_requests)} pull requests for {url}")
+    # Sync the pull requests for all URLs at the same time, only fetching what changed since the last run
+    harvester.for_each_repo(urls, sync)
+    connections.log_stats()
+    harvester.log_token_stats()
+
+@telemetry.timed("github.push_pull_requests_to_mongodb_graphql")
+def push_pull_requests_to_mongodb_graphql(urls):
+    """
+    Like push_pull_requests_to_mongodb, but fetches through the GraphQL API, several repositories per query.
+    This also stores the submitted reviews of every pull request and the time of the first review,
+    which the REST API only has through one extra request per pull request.
+    """
+    ensure_indexes()
+    projects = ["/".join(get_owner_and_repo(url)) for url in urls]
 
+    def store(project, pull_requests):
+        upsert_pull_requests_to_mongodb(pull_requests)
+        telemetry.event(f"Stored {len(pull_requests)} pull requests for {project}", project=project, pull_requests=len(pull_requests))
+
+    graphql_harvester.harvest(projects, store)
+    connections.log_stats()
+    harvester.log_token_stats()
+
+def project_document(github_url):
+    return {
+        "github": github_url,
+        "average_pull_request_merge_time": 0,  # Default value, since not calculated
+        "README_documentation": False,  # Default value, assuming not checked
+        "comments_in_code": False,  # Default value, assuming not checked
+        "website_linked": False,  # Default value, assuming not checked
+        "wiki_present": False,  # Default value, assuming not checked
+        "amount_of_pull_requests": 0  # Default value, since not calculated
+    }
+
+
+def store_projects(github_urls):
+    # projects that are already stored keep what was computed for them, re-runs don't add duplicates
+    if github_urls:
+        connections.get_db().projects.bulk_write([
+            UpdateOne({"github": github_url}, {"$setOnInsert": project_document(github_url)}, upsert=True)
+            for github_url in github_urls
+        ], ordered=False)
+
+@telemetry.timed("github.find_good_repos")
 def find_good_repos():
-    good_repos = filter_repos_with_many_merged_prs(fetch_github_urls())
-    collection = db.projects
-
-    print(good_repos)
-
-    # Prepare the list of documents to insert into MongoDB
-    documents_to_insert = []
-    for github_url in good_repos:
-        document = {
-            "github": github_url,
-            "average_pull_request_merge_time": 0,  # Default value, since not calculated
-            "README_documentation": False,  # Default value, assuming not checked
-            "comments_in_code": False,  # Default value, assuming not checked
-            "website_linked": False,  # Default value, assuming not checked
-            "wiki_present": False,  # Default value, assuming not checked
-            "amount_of_pull_requests": 0  # Default value, since not calculated
-        }
-        documents_to_insert.append(document)
-    
-    # Insert documents into the MongoDB collection
-    if documents_to_insert:
-        collection.insert_many(documents_to_insert)
+    candidates = fetch_github_urls()
+    good_repos, completed = filter_repos_with_many_merged_prs(candidates)
+
+    telemetry.event(f"Found {len(good_repos)} good repos", repositories=good_repos)
+
+    if good_repos:
+        store_projects(good_repos)
     else:
-        print("No good repos found to insert.")
+        telemetry.event("No good repos found to insert.")
+    advance_candidate_cursor(completed)
+
+@telemetry.timed("github.find_and_harvest_good_repos")
+def find_and_harvest_good_repos():
+    """
+    Does find_good_repos and push_pull_requests_to_mongodb in one go, so every page is downloaded once.
+    The pages of each candidate are parsed while counting, and the pull requests are only stored
+    when the repository turns out to qualify. Pull requests and projects are upserted, so a re-run,
+    or a repository that push_pull_requests_to_mongodb already synced, doesn't store anything twice, and the
+    documents of an earlier harvest without pull request numbers are replaced. The cursor only moves past
+    the candidates before the first one that failed, see completed_candidates.
+
+    Returns:
+    The URLs of the repositories that qualified.
+    """
+    def store(url, pages):
+        pull_requests = collect_good_repo_pull_requests(url, pages)
+        if pull_requests is None:
+            return False
+
+        replace_pull_requests("/".join(get_owner_and_repo(url)), pull_requests)
+        store_projects([url])
+        telemetry.event(f"Stored {len(pull_requests)} pull requests for {url}", repository=url, pull_requests=len(pull_requests))
+        return True
+
+    ensure_indexes()
+    candidates = fetch_github_urls()
+    stored = harvester.harvest(candidates, get_pull_requests_url, unavailable_as_none(store))
+    good_repos = [url for url in candidates if stored.get(url)]
+    advance_candidate_cursor(completed_candidates(candidates, stored))
+
+    if not good_repos:
+        telemetry.event("No good repos found to insert.")
+    connections.log_stats()
+    harvester.log_token_stats()
+    return good_repos
 
 def delete_records_for_projects(projects_to_delete):
+    db = connections.get_db()
+    # the project documents are matched on their parsed key, like the pull requests refer to them
+    project_urls = defaultdict(list)
+    for document in db.projects.find({}, {"_id": 0, "github": 1}):
+        project_urls["/".join(get_owner_and_repo(document["github"]))].append(document["github"])
     for project in projects_to_delete:
-        regex_pattern = ".*github\.com/" + re.escape(project) + "\.git"
-        db.projects.delete_one({"github": {"$regex": regex_pattern}})
+        db.projects.delete_many({"github": {"$in": project_urls.get(project, [])}})
         db.pull_requests.delete_many({"project": project})
-        print(f"Deleted records for project: {project}")
+        db.contributors.delete_many({"project": project})
+        db.sync_state.delete_one({"_id": project})
+        telemetry.event(f"Deleted records for project: {project}", project=project)
     
\ No newline at end of file
@@ -0,0 +1,190 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import harvester
+import telemetry
+
+# ------------------- Global Variables & Config -------------------
+
+PULL_REQUESTS_PER_QUERY = 100
+ASSIGNEES_PER_PULL_REQUEST = 10
+REVIEW_REQUESTS_PER_PULL_REQUEST = 10
+# reviews after the first REVIEWS_PER_PULL_REQUEST are not fetched, which is plenty for small projects
+REVIEWS_PER_PULL_REQUEST = 50
+# upper bound on the nodes a single query may ask for, GitHub allows 500,000 but big queries tend to time out
+MAX_QUERY_NODES = 40000
+# queries running at the same time, GitHub advises against many concurrent GraphQL requests
+MAX_QUERY_WORKERS = 2
+
+# the GraphQL API has its own budget of points, separate from the REST budget
+rate_limiter = harvester.TokenPool("GraphQL")
+
+PULL_REQUEST_FIELDS = f"""
+    pageInfo {{ hasNextPage endCursor }}
+    nodes {{
+      number
+      title
+      createdAt
+      mergedAt
+      author {{ __typename login }}
+      assignees(first: {ASSIGNEES_PER_PULL_REQUEST}) {{ nodes {{ login }} }}
+      reviewRequests(first: {REVIEW_REQUESTS_PER_PULL_REQUEST}) {{ nodes {{ requestedReviewer {{ ... on User {{ login }} }} }} }}
+      reviews(first: {REVIEWS_PER_PULL_REQUEST}) {{ nodes {{ author {{ login }} state submittedAt }} }}
+    }}
+"""
+
+# ------------------- Functions -------------------
+
+def nodes_per_repository():
+    # every pull request is a node, plus every node of its nested connections
+    nested = ASSIGNEES_PER_PULL_REQUEST + REVIEW_REQUESTS_PER_PULL_REQUEST + REVIEWS_PER_PULL_REQUEST
+    return PULL_REQUESTS_PER_QUERY * (1 + nested)
+
+
+def repositories_per_query():
+    return max(1, MAX_QUERY_NODES // nodes_per_repository())
+
+
+def build_query(amount):
+    """
+    Builds a query that fetches a page of merged pull requests for several repositories,
+    one aliased repository field (r0, r1, ...) per repository.
+
+    Parameters:
+    - amount: The amount of repositories in the query.
+
+    Returns:
+    The query string, taking the variables owner<i>, name<i> and after<i> for every repository.
+    """
+    variables = []
+    fields = []
+    for i in range(amount):
+        variables.append(f"$owner{i}: String!, $name{i}: String!, $after{i}: String")
+        fields.append(f"""
+  r{i}: repository(owner: $owner{i}, name: $name{i}) {{
+    pullRequests(states: MERGED, first: {PULL_REQUESTS_PER_QUERY}, after: $after{i}, orderBy: {{field: CREATED_AT, direction: ASC}}) {{
+      {PULL_REQUEST_FIELDS}
+    }}
+  }}""")
+
+    return f"query({', '.join(variables)}) {{\n  rateLimit {{ cost remaining resetAt }}{''.join(fields)}\n}}"
+
+
+def run_query(query, variables):
+    response = harvester.send('POST', f"{harvester.API_URL}/graphql", rate_limiter, json={"query": query, "variables": variables})
+    result = harvester.check_response(response)
+
+    # a repository that does not exist (anymore) only nulls its own alias, anything else is fatal
+    errors = [error for error in result.get("errors", []) if error.get("type") != "NOT_FOUND"]
+    if errors:
+        raise Exception(f"GitHub GraphQL API returned errors: {errors}")
+    return result["data"]
+
+
+def parse_pull_request(project, node):
+    """
+    Turns a pull request node into the same document get_pull_requests builds from the REST API,
+    with the submitted reviews added.
+
+    Parameters:
+    - project: The project in '<owner>/<repo>' format.
+    - node: The pull request node from the query.
+
+    Returns:
+    A dictionary with the pull request data, or None when the pull request was not made by a human.
+    """
+    # deleted accounts have no author anymore, the REST API reports those as the 'ghost' user
+    author = node["author"] or {"__typename": "User", "login": "ghost"}
+    if author["__typename"] != "User":
+        return None
+
+    reviews = []
+    for review in node["reviews"]["nodes"]:
+        if review["submittedAt"] is None:  # pending reviews have not been submitted yet
+            continue
+        reviews.append({
+            "reviewer": review["author"]["login"] if review["author"] else "ghost",
+            "state": review["state"],
+            "submitted_at": harvester.parse_date(review["submittedAt"]),
+        })
+
+    # reviews on your own pull request are only comments, they don't count towards time to first review
+    review_times = [review["submitted_at"] for review in reviews if review["reviewer"] != author["login"]]
+
+    created_at = harvester.parse_date(node["createdAt"])
+    merged_at = harvester.parse_date(node["mergedAt"])
+    return {
+        "project": project,
+        "number": node["number"],
+        "title": node["title"],
+        "created_at": created_at,
+        "merged_at": merged_at,
+        "merge_seconds": harvester.merge_seconds(created_at, merged_at),
+        "submitter": author["login"],
+        "reviewers": [request["requestedReviewer"]["login"] for request in node["reviewRequests"]["nodes"]
+                      if request["requestedReviewer"] and "login" in request["requestedReviewer"]],
+        "assignees": [assignee["login"] for assignee in node["assignees"]["nodes"]],
+        "reviews": reviews,
+        "first_review_at": min(review_times) if review_times else None,
+    }
+
+
+def harvest_batch(projects, store):
+    """
+    Fetches all merged pull requests of a batch of repositories, a page of every repository per query.
+    Repositories drop out of the query once their last page is in.
+
+    Parameters:
+    - projects: The projects in '<owner>/<repo>' format.
+    - store: Function called with (project, pull_requests) for every page that comes in.
+    """
+    cursors = {project: None for project in projects}
+    while cursors:
+        batch = list(cursors)
+        variables = {}
+        for i, project in enumerate(batch):
+            owner, repo = project.split("/")
+            variables[f"owner{i}"] = owner
+            variables[f"name{i}"] = repo
+            variables[f"after{i}"] = cursors[project]
+
+        data = run_query(build_query(len(batch)), variables)
+
+        for i, project in enumerate(batch):
+            repository = data.get(f"r{i}")
+            if repository is None:
+                telemetry.event(f"Repository {project} not found", logging.WARNING)
+                del cursors[project]
+                continue
+
+            pull_requests = repository["pullRequests"]
+            parsed = [parse_pull_request(project, node) for node in pull_requests["nodes"]]
+            store(project, [pr for pr in parsed if pr is not None])
+
+            if pull_requests["pageInfo"]["hasNextPage"]:
+                cursors[project] = pull_requests["pageInfo"]["endCursor"]
+            else:
+                del cursors[project]
+
+
+@telemetry.timed("graphql_harvester.harvest")
+def harvest(projects, store, query_workers=MAX_QUERY_WORKERS):
+    """
+    Fetches all merged pull requests with their reviews for many repositories,
+    as many repositories per query as the node limit allows.
+
+    Parameters:
+    - projects: The projects in '<owner>/<repo>' format.
+    - store: Function called with (project, pull_requests) for every page that comes in.
+    - query_workers: How many queries run at the same time.
+    """
+    size = repositories_per_query()
+    batches = [projects[i:i + size] for i in range(0, len(projects), size)]
+
+    with ThreadPoolExecutor(max_workers=query_workers) as pool:
+        futures = [pool.submit(harvest_batch, batch, store) for batch in batches]
+        for batch, future in zip(batches, futures):
+            try:
+                future.result()
+            except Exception as e:
+                telemetry.event(f"Failed to harvest {', '.join(batch)}: {e}", logging.ERROR)
@@ -0,0 +1,543 @@
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+import connections
+import telemetry
+
+# ------------------- Global Variables & Config -------------------
+
+API_URL = "https://api.github.com"
+
+# how many repositories are harvested at the same time
+MAX_REPO_WORKERS = 8
+# how many pages are fetched at the same time, over all repositories
+MAX_PAGE_WORKERS = 16
+# how many pages of a single repository are requested ahead of the page being processed
+PAGE_WINDOW = 4
+# stop a few requests before zero, so requests that are already in flight don't fail
+RATE_LIMIT_RESERVE = 10
+# how long a token is parked after a secondary rate limit without Retry-After, as GitHub asks
+SECONDARY_RATE_LIMIT_WAIT = 60
+
+# server errors and connection problems are retried this often, the n-th retry after
+# BACKOFF_BASE * BACKOFF_FACTOR ** n seconds times a random factor between 1 and 2, like npm-miner does
+MAX_RETRIES = 5
+BACKOFF_BASE = 1
+BACKOFF_FACTOR = 4
+# seconds without an answer before a request counts as failed
+REQUEST_TIMEOUT = 60
+# after this many failed requests in a row a host gets a rest of BREAKER_COOLDOWN seconds, then one request probes it
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+# the repository was deleted, made private or blocked for legal reasons, asking again won't help
+UNAVAILABLE_STATUSES = (404, 410, 451)
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+last_page_pattern = re.compile(r'<([^>]+)>; rel="last"')
+# a secondary rate limit without Retry-After is only recognisable by its message or documentation_url
+secondary_rate_limit_pattern = re.compile(r'secondary[ -]rate[ -]limit|abuse detection', re.IGNORECASE)
+
+
+class TokenState:
+    """
+    What is known about the rate limit of one API token, and how much it was used.
+    """
+
+    def __init__(self, token, reserve=RATE_LIMIT_RESERVE):
+        self.token = token
+        self.reserve = reserve
+        self.remaining = None
+        self.limit = None
+        self.reset = 0
+        self.parked_until = 0
+        self.requests = 0
+        self.rate_limited = 0
+
+    def is_exhausted(self, now):
+        return self.remaining is not None and self.remaining <= self.reserve and now < self.reset
+
+    def quota(self, now):
+        # a token we have no headers for yet, or whose window is over, is assumed to have its whole budget
+        if self.remaining is None or now >= self.reset:
+            return float('inf')
+        return self.remaining
+
+
+class TokenPool:
+    """
+    The API tokens requests are spread over, shared by all worker threads.
+    Every request is sent with the token that has the most of its rate limit left, and every response
+    updates what is known about that token. Tokens that ran out are parked until their reset time,
+    tokens that hit a secondary rate limit until their Retry-After. When all tokens are parked the workers
+    pause until the first one comes back, instead of failing.
+
+    The tokens are read from config.ini on first use, see connections.load_api_tokens.
+    """
+
+    def __init__(self, name, tokens=None, reserve=RATE_LIMIT_RESERVE):
+        self.name = name
+        self.lock = threading.Lock()
+        self.reserve = reserve
+        self.states = None if tokens is None else [TokenState(token, reserve) for token in tokens]
+        token_pools.append(self)
+
+    def get_states(self):
+        if self.states is None:
+            self.states = [TokenState(token, self.reserve) for token in connections.load_api_tokens()]
+        return self.states
+
+    def acquire(self):
+        """
+        Waits until a token may be used and claims one request of its budget.
+
+        Returns:
+        The TokenState to send the request with.
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                states = self.get_states()
+                available = [state for state in states if state.parked_until <= now and not state.is_exhausted(now)]
+                if available:
+                    # the most budget left, and of tokens we know nothing about yet the least used
+                    state = max(available, key=lambda state: (state.quota(now), -state.requests))
+                    if state.remaining is not None and now >= state.reset:
+                        state.remaining = None
+                    elif state.remaining is not None:
+                        state.remaining -= 1
+                    state.requests += 1
+                    return state
+
+                delay = min(max(state.parked_until, state.reset if state.is_exhausted(now) else now) for state in states) - now + 1
+            telemetry.event(f"All {len(states)} {self.name} tokens are rate limited, sleeping {delay:.0f}s",
+                            logging.WARNING, pool=self.name, sleep_seconds=delay)
+            with telemetry.timer("rate_limit_wait"):
+                time.sleep(delay)
+
+    def update(self, state, response):
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        remaining = int(remaining)
+        reset = int(reset)
+        with self.lock:
+            limit = response.headers.get('X-RateLimit-Limit')
+            if limit is not None:
+                state.limit = int(limit)
+            # requests can come back out of order, so within one window only ever count down
+            if reset != state.reset or state.remaining is None:
+                state.remaining = remaining
+                state.reset = reset
+            else:
+                state.remaining = min(state.remaining, remaining)
+            headroom = state.remaining
+        telemetry.gauge("rate_limit_remaining", headroom, pool=self.name, token="..." + state.token[-4:])
+
+    def park(self, state, seconds):
+        with self.lock:
+            state.parked_until = max(state.parked_until, time.time() + seconds)
+            state.rate_limited += 1
+
+    def metrics(self):
+        """
+        Returns a dictionary per token, identified by its last 4 characters, with the requests sent with it,
+        how often it was rate limited, its remaining budget and which share of its limit is used.
+        """
+        with self.lock:
+            return [{
+                "token": "..." + state.token[-4:],
+                "requests": state.requests,
+                "rate_limited": state.rate_limited,
+                "remaining": state.remaining,
+                "limit": state.limit,
+                "reset": state.reset,
+                "utilisation": (state.limit - state.remaining) / state.limit if state.limit and state.remaining is not None else None,
+            } for state in self.states or []]
+
+
+token_pools = []
+rate_limiter = TokenPool("REST")
+
+
+class CircuitBreaker:
+    """
+    Stops all worker threads from hammering a host that keeps failing. After BREAKER_THRESHOLD failed
+    requests in a row the circuit opens and requests to the host wait for BREAKER_COOLDOWN seconds.
+    Then a single request probes the host: when it succeeds the circuit closes again, when it fails the
+    host gets another rest. Requests wait instead of failing, so an outage only delays the harvest.
+    """
+
+    def __init__(self, host, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.open_until = 0
+        self.probing = False
+
+    def wait(self):
+        """
+        Waits until a request may be sent to the host.
+
+        Returns:
+        Whether the request is the probe, which must end with succeeded, failed or abandoned.
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                if self.failures < self.threshold:
+                    return False
+                if now >= self.open_until and not self.probing:
+                    self.probing = True
+                    return True
+                # while another request probes, check again soon
+                delay = max(self.open_until - now, 1)
+            with telemetry.timer("circuit_wait"):
+                time.sleep(delay)
+
+    def succeeded(self):
+        with self.lock:
+            if self.failures >= self.threshold:
+                telemetry.event(f"{self.host} answers again, closing its circuit", logging.WARNING, host=self.host)
+            self.failures = 0
+            self.probing = False
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            # a failed probe, or the request that reached the threshold
+            if self.probing or self.failures == self.threshold:
+                self.open_until = time.time() + self.cooldown
+                telemetry.count("circuit_opened")
+                telemetry.event(f"{self.failures} failed requests in a row to {self.host}, pausing it for {self.cooldown}s",
+                                logging.WARNING, host=self.host, failures=self.failures)
+            self.probing = False
+
+    def abandoned(self):
+        # the probe ended with an error that says nothing about the host, so another request may probe
+        with self.lock:
+            self.probing = False
+
+
+circuit_breakers = {}
+breaker_lock = threading.Lock()
+
+
+def get_circuit_breaker(url):
+    host = urlsplit(url).netloc
+    with breaker_lock:
+        if host not in circuit_breakers:
+            circuit_breakers[host] = CircuitBreaker(host)
+        return circuit_breakers[host]
+
+
+class RepositoryUnavailable(Exception):
+    """
+    The API answered 404, 410 or 451 for a repository, which is gone for good, so it is not retried.
+    """
+
+# ------------------- Functions -------------------
+
+def is_rate_limited(response):
+    if response.status_code == 429:
+        return True
+    if response.status_code != 403:
+        return False
+    if response.headers.get('X-RateLimit-Remaining') == '0' or 'Retry-After' in response.headers:
+        return True
+    return secondary_rate_limit_pattern.search(response.text) is not None
+
+
+def is_retryable(response):
+    return response.status_code >= 500
+
+
+def backoff(attempt):
+    return BACKOFF_BASE * BACKOFF_FACTOR ** attempt * random.uniform(1, 2)
+
+
+def wait_to_retry(attempt, url, reason):
+    delay = backoff(attempt)
+    telemetry.count("http_retries")
+    telemetry.event(f"{reason} for {url}, retry {attempt + 1} of {MAX_RETRIES} in {delay:.0f}s", logging.WARNING,
+                    url=url, reason=reason, attempt=attempt + 1, sleep_seconds=delay)
+    with telemetry.timer("retry_wait"):
+        time.sleep(delay)
+
+
+def send(method, url, limiter=None, **kwargs):
+    """
+    Sends a request with the token that has the most budget left, waiting for the rate limit when needed.
+    Rate limited requests are sent again once a token is available. Server errors and connection problems
+    are retried MAX_RETRIES times with a growing, jittered delay, and a host that keeps failing is paused,
+    see CircuitBreaker. Other responses, like 404 for a deleted repository, are returned right away.
+
+    Parameters:
+    - method: The HTTP method.
+    - url: The full API URL.
+    - limiter: The TokenPool the request counts against, the REST limit by default.
+    - kwargs: Passed on to requests, e.g. headers or json.
+
+    Returns:
+    The response of the last attempt. When every attempt failed without a response, the last error is raised.
+    GET requests are answered from the response cache when it is enabled, see response_cache.py.
+    """
+    limiter = limiter or rate_limiter
+    session = connections.get_session()
+    breaker = get_circuit_breaker(url)
+    headers = kwargs.pop('headers', None) or {}
+    kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+    # streamed bodies, like tarballs, are not cached
+    cache = connections.get_response_cache() if method == 'GET' and not kwargs.get('stream') else None
+    if cache is not None:
+        accept = headers.get('Accept', session.headers.get('Accept'))
+        cached = cache.get(method, url, accept)
+        if cached is not None:
+            return cached
+
+    attempt = 0
+    while True:
+        probe = breaker.wait()
+        token = limiter.acquire()
+        try:
+            with telemetry.timer("http_request"):
+                response = session.request(method, url, headers={**headers, "Authorization": f"token {token.token}"}, **kwargs)
+                if not kwargs.get('stream'):
+                    # reading the body can fail as well
+                    telemetry.count("http_bytes", len(response.content))
+        except RETRY_ERRORS as e:
+            telemetry.count("http_errors")
+            breaker.failed()
+            if attempt >= MAX_RETRIES:
+                raise
+            wait_to_retry(attempt, url, type(e).__name__)
+            attempt += 1
+            continue
+        except BaseException:
+            # like too many redirects or an interrupt, the probe must not keep the circuit open forever
+            if probe:
+                breaker.abandoned()
+            raise
+        telemetry.count("http_requests")
+        limiter.update(token, response)
+
+        if is_retryable(response):
+            telemetry.count("http_errors")
+            breaker.failed()
+            if attempt >= MAX_RETRIES:
+                return response
+            wait_to_retry(attempt, url, f"GitHub API returned {response.status_code}")
+            attempt += 1
+            continue
+        breaker.succeeded()
+
+        if not is_rate_limited(response):
+            if cache is not None:
+                cache.store(method, url, accept, response)
+            return response
+
+        # secondary rate limits tell us how long to back off, primary ones park the token until its reset
+        telemetry.count("http_rate_limited")
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None or response.headers.get('X-RateLimit-Remaining') != '0':
+            wait = int(retry_after) if retry_after is not None else SECONDARY_RATE_LIMIT_WAIT
+            telemetry.event(f"Secondary rate limit hit, parking token for {wait}s", logging.WARNING,
+                            pool=limiter.name, retry_after=wait)
+            limiter.park(token, wait)
+
+
+def log_token_stats():
+    for pool in token_pools:
+        for metrics in pool.metrics():
+            telemetry.event(f"{pool.name} token {metrics['token']}: " + ", ".join(f"{key}={value}" for key, value in metrics.items() if key != "token"),
+                            pool=pool.name, **metrics)
+
+
+def fetch_page(url, headers=None):
+    """
+    Requests a single page, waiting for the rate limit when needed.
+
+    Parameters:
+    - url: The full API URL of the page.
+    - headers: Extra headers for this request only, e.g. If-None-Match.
+
+    Returns:
+    The response of the last attempt, see send.
+    """
+    return send('GET', url, headers=headers)
+
+
+def parse_date(value):
+    """
+    Turns a timestamp of the GitHub APIs, like '2024-03-07T10:25:25Z', into an aware datetime,
+    so it is stored as a native date instead of a string.
+    """
+    if value is None:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def merge_seconds(created_at, merged_at):
+    # computed once at ingest, so the analyses never have to parse or subtract dates per pull request
+    return int((merged_at - created_at).total_seconds())
+
+
+def get_last_page(link):
+    """
+    Reads the number of the last page from a Link header, 1 if there is no last page.
+    """
+    if not link:
+        return 1
+    match = last_page_pattern.search(link)
+    if not match:
+        return 1
+    query = dict(parse_qsl(urlsplit(match.group(1)).query))
+    return int(query.get('page', 1))
+
+
+def with_page(url, page):
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query['page'] = str(page)
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def check_response(response):
+    if response.status_code in UNAVAILABLE_STATUSES:
+        raise RepositoryUnavailable(f"GitHub API returned {response.status_code}: {response.text}")
+    if response.status_code != 200:
+        raise Exception(f"GitHub API returned {response.status_code}: {response.text}")
+    return response.json()
+
+
+def stream_responses(url, page_pool, window=PAGE_WINDOW, page_headers=None, start_page=1):
+    """
+    Yields the response of every page of a paginated endpoint in page order. The first page is requested
+    on its own, its Link header tells how many pages there are, and the rest is fetched in parallel, a window
+    of pages ahead of the consumer. When the consumer stops early, the pages that were not sent yet are dropped.
+
+    Parameters:
+    - url: The URL of the first page.
+    - page_pool: The executor that fetches the remaining pages.
+    - window: How many pages are requested ahead.
+    - page_headers: Optional function mapping a page number to extra headers for that page.
+    - start_page: The first page that is requested, to continue where an earlier run stopped.
+
+    Returns:
+    A generator of responses, which are not checked.
+    """
+    def fetch(page):
+        headers = page_headers(page) if page_headers else None
+        return fetch_page(with_page(url, page) if page > 1 else url, headers)
+
+    first = fetch(start_page)
+    telemetry.count("pages")
+    yield first
+
+    last_page = get_last_page(first.headers.get('Link'))
+    next_page = start_page + 1
+    pending = deque()
+    try:
+        while next_page <= last_page or pending:
+            while next_page <= last_page and len(pending) < window:
+                pending.append(page_pool.submit(fetch, next_page))
+                next_page += 1
+            response = pending.popleft().result()
+            telemetry.count("pages")
+            yield response
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def stream_pages(url, page_pool, window=PAGE_WINDOW):
+    """
+    Yields the decoded JSON of every page of a paginated endpoint in page order, see stream_responses.
+    """
+    for response in stream_responses(url, page_pool, window):
+        yield check_response(response)
+
+
+def fetch_all_pages(url, page_pool):
+    """
+    Fetches every page of a paginated endpoint, see stream_pages.
+
+    Returns:
+    A list with the decoded JSON of every page, in page order.
+    """
+    return list(stream_pages(url, page_pool))
+
+
+def skip_unavailable(repo_url, error):
+    telemetry.count("repositories_unavailable")
+    telemetry.event(f"Skipping {repo_url}, it is no longer available: {error}", logging.WARNING, repository=repo_url, error=str(error))
+
+
+def for_each_repo(repo_urls, work, repo_workers=MAX_REPO_WORKERS, page_workers=MAX_PAGE_WORKERS):
+    """
+    Runs work for many repositories at the same time.
+
+    Parameters:
+    - repo_urls: The repositories to work on.
+    - work: Function called with (repo_url, page_pool), it fetches its pages through the page pool.
+    - repo_workers: How many repositories are worked on at the same time.
+    - page_workers: How many pages are fetched at the same time, over all repositories.
+
+    Returns:
+    A dictionary from repository to the result of work. Repositories that failed or are gone are left out.
+    """
+    @telemetry.timed("repository")
+    def timed_work(repo_url, page_pool):
+        return work(repo_url, page_pool)
+
+    results = {}
+    # two separate pools, so repository workers waiting on pages can never starve the page workers
+    with ThreadPoolExecutor(max_workers=page_workers) as page_pool, \
+            ThreadPoolExecutor(max_workers=repo_workers) as repo_pool:
+        futures = {repo_pool.submit(timed_work, repo_url, page_pool): repo_url for repo_url in repo_urls}
+        for future in as_completed(futures):
+            repo_url = futures[future]
+            try:
+                results[repo_url] = future.result()
+            except RepositoryUnavailable as e:
+                skip_unavailable(repo_url, e)
+            except Exception as e:
+                telemetry.event(f"Failed to harvest {repo_url}: {e}", logging.ERROR, repository=repo_url, error=str(e))
+
+    return results
+
+
+@telemetry.timed("harvester.harvest")
+def harvest(repo_urls, build_url, process, repo_workers=MAX_REPO_WORKERS, page_workers=MAX_PAGE_WORKERS):
+    """
+    Fetches all pages for many repositories at the same time.
+
+    Parameters:
+    - repo_urls: The repositories to harvest.
+    - build_url: Function mapping a repository to the URL of its first page.
+    - process: Function called with (repo_url, pages), where pages is a generator from stream_pages.
+      It can stop iterating early to skip the rest of the repository.
+    - repo_workers: How many repositories are harvested at the same time.
+    - page_workers: How many pages are fetched at the same time, over all repositories.
+
+    Returns:
+    A dictionary from repository to the result of process. Repositories that failed are left out.
+    """
+    def harvest_repo(repo_url, page_pool):
+        pages = stream_pages(build_url(repo_url), page_pool)
+        try:
+            return process(repo_url, pages)
+        finally:
+            pages.close()
+
+    return for_each_repo(repo_urls, harvest_repo, repo_workers, page_workers)
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+
+from bson import json_util
+from pymongo import UpdateOne
+import connections
+import telemetry
+
+# ------------------- Global Variables & Config -------------------
+
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'softwareanalytics.projects.json')
+# how many characters are read from the file at a time
+CHUNK_SIZE = 1 << 20
+# how many documents are upserted in one bulk write
+BATCH_SIZE = 1000
+
+# the fields of a project the rest of the pipeline uses, everything else in the export is dropped
+PROJECT_FIELDS = [
+    "_id",
+    "github",
+    "downloads",
+    "README_documentation",
+    "comments_in_code",
+    "website_linked",
+    "wiki_present",
+    "amount_of_pull_requests",
+    "average_pull_request_merge_time",
+    "median_pull_request_merge_time",
+    "p90_pull_request_merge_time",
+    "first_pr_date",
+    "last_pr_date",
+    "submitters",
+    "reviewers",
+    "periods",
+]
+
+# MongoDB exports use extended JSON like {"$oid": ...}, turn those back into the BSON types
+decoder = json.JSONDecoder(object_hook=json_util.object_hook)
+
+# ------------------- Functions -------------------
+
+def iterate_json_array(file, chunk_size=CHUNK_SIZE):
+    """
+    Yields the elements of a JSON array one at a time, without ever holding more than one element
+    and a chunk of the file in memory.
+
+    Parameters:
+    - file: A text file positioned right after the opening '['.
+    - chunk_size: How many characters are read at a time.
+    """
+    buffer = ""
+    position = 0
+    eof = False
+    read_size = chunk_size
+
+    while True:
+        # skip the whitespace and the comma between elements
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position < len(buffer) and buffer[position] == "]":
+            return
+
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+            # a number at the end of the buffer may continue in the next chunk
+            if end < len(buffer) or eof:
+                yield element
+                position = end
+                read_size = chunk_size
+                continue
+        except json.JSONDecodeError:
+            if eof:
+                raise
+
+        # the element is not complete yet, read more; double the read size so big elements don't get parsed over and over
+        chunk = file.read(read_size)
+        read_size *= 2
+        eof = chunk == ""
+        buffer = buffer[position:] + chunk
+        position = 0
+        if eof and not buffer.strip():
+            raise ValueError("JSON array is not closed")
+
+
+def iterate_json_lines(file):
+    for line in file:
+        if line.strip():
+            yield decoder.decode(line)
+
+
+def iterate_documents(path):
+    """
+    Yields the documents of a file with either a single JSON array, like a MongoDB export, or one document per line.
+    """
+    with open(path, encoding="utf-8") as file:
+        first = file.read(1)
+        while first.isspace():
+            first = file.read(1)
+
+        if first == "[":
+            yield from iterate_json_array(file)
+        elif first:
+            # JSON Lines, put back the character that was read
+            file.seek(0)
+            yield from iterate_json_lines(file)
+
+
+def project_update(document):
+    fields = {field: document[field] for field in PROJECT_FIELDS if field in document and field != "_id"}
+    # documents without an _id are matched on their github URL
+    key = {"_id": document["_id"]} if "_id" in document else {"github": document["github"]}
+    return UpdateOne(key, {"$set": fields}, upsert=True)
+
+
+@telemetry.timed("ingest.ingest")
+def ingest(path=DEFAULT_FILE, batch_size=BATCH_SIZE):
+    """
+    Upserts the projects of an npm-miner export into db.projects, in bounded batches,
+    so memory use stays flat whatever the size of the file.
+
+    Parameters:
+    - path: The export, a JSON array or JSON Lines.
+    - batch_size: How many projects are upserted in one bulk write.
+    """
+    collection = connections.get_db().projects
+    updates = []
+    total = 0
+
+    for document in iterate_documents(path):
+        updates.append(project_update(document))
+        if len(updates) >= batch_size:
+            collection.bulk_write(updates, ordered=False)
+            total += len(updates)
+            updates = []
+            telemetry.event(f"Ingested {total} projects")
+
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+        total += len(updates)
+    telemetry.event(f"Ingested {total} projects in total")
+
+
+if __name__ == "__main__":
+    connections.start_telemetry("ingest")
+    parser = argparse.ArgumentParser(description="Stream an npm-miner export into the projects collection.")
+    parser.add_argument("file", nargs="?", default=DEFAULT_FILE, help="JSON array or JSON Lines file")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="projects per bulk write")
+    args = parser.parse_args()
+
+    ingest(args.file, args.batch_size)
+    connections.log_stats()
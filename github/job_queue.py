@@ -0,0 +1,259 @@
+"""
+A durable queue of repositories to harvest, in db.harvest_jobs. Workers lease a job and record the next page after every
+stored page, so any number of workers can drain the queue and the job of a dead worker continues where it stopped.
+"""
+import argparse
+import logging
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, ReturnDocument
+import connections
+import harvester
+import github
+import telemetry
+
+# ------------------- Global Variables & Config -------------------
+
+# how long a worker owns a job without storing a page before others may take it over, in seconds
+LEASE_SECONDS = 10 * 60
+# how often a job is tried before it is marked failed
+MAX_ATTEMPTS = 3
+# a failed job waits RETRY_DELAY * RETRY_FACTOR ** (attempts - 1) seconds before it is tried again,
+# so a short outage or a secondary rate limit doesn't use up all of its attempts at once
+RETRY_DELAY = 5 * 60
+RETRY_FACTOR = 4
+# oldest first, so new pull requests end up on the last pages and the pages already stored don't shift
+JOB_PULL_REQUESTS_QUERY = "state=closed&sort=created&direction=asc&per_page=100"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# ------------------- Queue -------------------
+
+def ensure_indexes():
+    connections.get_db().harvest_jobs.create_index([("status", ASCENDING), ("lease_expires", ASCENDING)])
+    connections.get_db().harvest_jobs.create_index([("status", ASCENDING), ("not_before", ASCENDING)])
+    github.ensure_indexes()
+
+
+def enqueue(urls, requeue=False):
+    """
+    Adds a job for every repository that does not have one yet.
+
+    Parameters:
+    - urls: The repository URLs.
+    - requeue: Also queue jobs that are done or failed again. Failed jobs continue at the page after the last one
+      that was stored, with all their attempts, done jobs start over from their first page.
+
+    Returns:
+    The amount of jobs that were added or started over.
+    """
+    db = connections.get_db()
+    now = datetime.now(timezone.utc)
+    added = 0
+    for url in urls:
+        project = "/".join(github.get_owner_and_repo(url))
+        new_job = {"url": url, "status": PENDING, "next_page": 1, "pages": 0, "pull_requests": 0, "attempts": 0, "created": now}
+        if requeue:
+            result = db.harvest_jobs.update_one({"_id": project, "status": FAILED},
+                                                {"$set": {"status": PENDING, "attempts": 0}, "$unset": {"error": "", "not_before": ""}})
+            if not result.modified_count:
+                result = db.harvest_jobs.update_one({"_id": project, "status": DONE}, {"$set": new_job, "$unset": {"error": ""}})
+            if result.modified_count:
+                added += 1
+                continue
+        result = db.harvest_jobs.update_one({"_id": project}, {"$setOnInsert": new_job}, upsert=True)
+        if result.upserted_id is not None:
+            added += 1
+    return added
+
+
+def claim(worker):
+    """
+    Takes the oldest pending job that is not waiting to be retried, or a running job whose lease ran out, and leases it to worker.
+
+    Returns:
+    The job document, with the lease that has to be passed to checkpoint, finish and release, or None.
+    """
+    now = datetime.now(timezone.utc)
+    return connections.get_db().harvest_jobs.find_one_and_update(
+        {"$or": [{"status": PENDING, "not_before": {"$not": {"$gt": now}}}, {"status": RUNNING, "lease_expires": {"$lt": now}}]},
+        {"$set": {"status": RUNNING, "worker": worker, "lease": uuid.uuid4().hex,
+                  "lease_expires": now + timedelta(seconds=LEASE_SECONDS)},
+         "$inc": {"attempts": 1}},
+        sort=[("created", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def checkpoint(job, next_page, pull_requests, updated_at):
+    """
+    Records that the pages before next_page are stored, and extends the lease.
+
+    Returns:
+    False when the job was taken over by another worker, which then continues it.
+    """
+    now = datetime.now(timezone.utc)
+    update = {"$set": {"next_page": next_page, "lease_expires": now + timedelta(seconds=LEASE_SECONDS)},
+              "$inc": {"pages": 1, "pull_requests": pull_requests}}
+    if updated_at is not None:
+        update["$max"] = {"last_updated_at": updated_at}
+    result = connections.get_db().harvest_jobs.update_one({"_id": job["_id"], "lease": job["lease"]}, update)
+    return result.matched_count == 1
+
+
+def finish(job):
+    db = connections.get_db()
+    result = db.harvest_jobs.find_one_and_update(
+        {"_id": job["_id"], "lease": job["lease"]},
+        {"$set": {"status": DONE, "finished": datetime.now(timezone.utc)}, "$unset": {"lease": "", "lease_expires": ""}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if result is not None and result.get("last_updated_at"):
+        # later runs of github.push_pull_requests_to_mongodb only fetch what changed after this harvest
+        db.sync_state.update_one({"_id": job["_id"]}, {"$max": {"last_updated_at": result["last_updated_at"]}}, upsert=True)
+
+
+def retry_delay(attempts):
+    return RETRY_DELAY * RETRY_FACTOR ** (attempts - 1)
+
+
+def release(job, error):
+    # back in the queue at the page it stopped after a rest, unless it failed too often or the repository is gone
+    fields = {"error": str(error)}
+    if job["attempts"] >= MAX_ATTEMPTS or isinstance(error, harvester.RepositoryUnavailable):
+        fields["status"] = FAILED
+    else:
+        fields["status"] = PENDING
+        fields["not_before"] = datetime.now(timezone.utc) + timedelta(seconds=retry_delay(job["attempts"]))
+    connections.get_db().harvest_jobs.update_one(
+        {"_id": job["_id"], "lease": job["lease"]},
+        {"$set": fields, "$unset": {"lease": "", "lease_expires": ""}},
+    )
+
+
+def seconds_to_next_retry():
+    """
+    Returns how long until the first pending job that waits to be retried may be claimed, or None when no job waits.
+    """
+    jobs = connections.get_db().harvest_jobs.find({"status": PENDING, "not_before": {"$exists": True}}, {"not_before": 1})
+    for job in jobs.sort([("not_before", ASCENDING)]).limit(1):
+        # MongoDB returns naive dates in UTC
+        not_before = job["not_before"].replace(tzinfo=timezone.utc)
+        return max((not_before - datetime.now(timezone.utc)).total_seconds(), 0)
+    return None
+
+
+def queue_status():
+    """
+    Returns the amount of jobs per status.
+    """
+    jobs = connections.get_db().harvest_jobs
+    return {status: jobs.count_documents({"status": status}) for status in [PENDING, RUNNING, DONE, FAILED]}
+
+# ------------------- Workers -------------------
+
+def harvest_job(job, page_pool):
+    """
+    Stores the pull requests of a job page by page, starting at the page after the last one that was stored.
+
+    Returns:
+    True when every page was stored, False when the lease was lost to another worker.
+    """
+    url = f"{harvester.API_URL}/repos/{job['_id']}/pulls?{JOB_PULL_REQUESTS_QUERY}"
+    responses = harvester.stream_responses(url, page_pool, start_page=job["next_page"])
+    try:
+        for page, response in enumerate(responses, start=job["next_page"]):
+            data = harvester.check_response(response)
+            pull_requests = [pr for pr in (github.parse_pull_request(job["_id"], pr) for pr in data) if pr is not None]
+            github.upsert_pull_requests_to_mongodb(pull_requests)
+            updated_at = max((pr["updated_at"] for pr in data), default=None)
+            if not checkpoint(job, page + 1, len(pull_requests), updated_at):
+                return False
+    finally:
+        responses.close()
+    return True
+
+
+def work(worker, page_pool):
+    """
+    Claims and harvests jobs until the queue is empty, waiting for the jobs that are to be retried.
+
+    Returns:
+    The amount of jobs this worker finished.
+    """
+    finished = 0
+    while True:
+        job = claim(worker)
+        if job is None:
+            wait = seconds_to_next_retry()
+            if wait is None:
+                return finished
+            with telemetry.timer("job_retry_wait"):
+                time.sleep(wait + 0.01)
+            continue
+
+        telemetry.event(f"{worker} harvesting {job['_id']} from page {job['next_page']}")
+        try:
+            if harvest_job(job, page_pool):
+                finish(job)
+                finished += 1
+            else:
+                telemetry.event(f"{worker} lost the lease on {job['_id']}", logging.WARNING)
+        except Exception as e:
+            telemetry.event(f"Failed to harvest {job['_id']}: {e}", logging.ERROR)
+            release(job, e)
+
+
+@telemetry.timed("job_queue.run_workers")
+def run_workers(repo_workers=harvester.MAX_REPO_WORKERS, page_workers=harvester.MAX_PAGE_WORKERS):
+    """
+    Drains the queue with repo_workers threads in this process, next to any other worker process.
+
+    Returns:
+    The amount of jobs this process finished.
+    """
+    ensure_indexes()
+    process = f"{socket.gethostname()}:{os.getpid()}"
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=page_workers) as page_pool, \
+            ThreadPoolExecutor(max_workers=repo_workers) as repo_pool:
+        futures = [repo_pool.submit(work, f"{process}:{i}", page_pool) for i in range(repo_workers)]
+        finished = sum(future.result() for future in futures)
+
+    telemetry.event(f"Finished {finished} jobs in {time.time() - start:.0f}s, queue: {queue_status()}")
+    connections.log_stats()
+    harvester.log_token_stats()
+    return finished
+
+
+if __name__ == "__main__":
+    connections.start_telemetry("job_queue")
+    parser = argparse.ArgumentParser(description="Queue repositories and harvest their pull requests, in as many processes as you like.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    enqueue_parser = subparsers.add_parser("enqueue", help="queue the next batch of candidates, or the given URLs")
+    enqueue_parser.add_argument("urls", nargs="*", help="repository URLs, the next candidates by default")
+    enqueue_parser.add_argument("--requeue", action="store_true", help="start finished jobs over")
+    work_parser = subparsers.add_parser("work", help="harvest queued jobs until the queue is empty")
+    work_parser.add_argument("--workers", type=int, default=harvester.MAX_REPO_WORKERS, help="repositories at a time")
+    subparsers.add_parser("status", help="show the amount of jobs per status")
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        ensure_indexes()
+        urls = args.urls or github.fetch_github_urls()
+        print(f"Queued {enqueue(urls, args.requeue)} jobs")
+        if not args.urls:
+            # the candidates are safe in the queue now
+            github.advance_candidate_cursor(urls)
+    elif args.command == "work":
+        run_workers(args.workers)
+    else:
+        print(queue_status())
@@ -0,0 +1,570 @@
+"""
+A local stand-in for MongoDB: every collection is a SQLite table of extended JSON documents, behind the part of
+the pymongo Collection API the scripts use. Conditions on indexed fields are pushed down to SQLite, aggregation is not supported.
+"""
+import re
+import sqlite3
+import threading
+from copy import deepcopy
+from datetime import datetime, timezone
+
+from bson import ObjectId, json_util
+from pymongo import DeleteMany, DeleteOne, InsertOne, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+# ------------------- Global Variables & Config -------------------
+
+# rows fetched from SQLite at a time while iterating a cursor
+FETCH_SIZE = 1000
+SORT_DIRECTIONS = {1: "ASC", -1: "DESC"}
+# how long a write waits for other processes using the same file, in seconds
+LOCK_TIMEOUT = 60
+
+# ------------------- Documents -------------------
+
+def get_values(document, path):
+    """
+    Finds the values at a dotted path the way MongoDB does, looking into the documents of arrays on the way.
+    """
+    values = [document]
+    for part in path.split("."):
+        next_values = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    next_values.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit():
+                    if int(part) < len(value):
+                        next_values.append(value[int(part)])
+                else:
+                    next_values.extend(item[part] for item in value if isinstance(item, dict) and part in item)
+        values = next_values
+    return values
+
+
+def type_bracket(value):
+    # MongoDB only compares values of the same type, except for the different number types
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, datetime):
+        return "date"
+    return type(value).__name__
+
+
+def comparable(value):
+    # BSON dates are instants, documents come back naive in UTC like pymongo returns them
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def equal(value, other):
+    return type_bracket(value) == type_bracket(other) and comparable(value) == comparable(other)
+
+
+def compare(value, operator, other):
+    if type_bracket(value) != type_bracket(other) or type_bracket(value) not in ("number", "string", "date", "ObjectId"):
+        return False
+    value = comparable(value)
+    other = comparable(other)
+    if operator == "$gt":
+        return value > other
+    if operator == "$gte":
+        return value >= other
+    if operator == "$lt":
+        return value < other
+    return value <= other
+
+
+def with_elements(values):
+    # conditions on an array field also match the elements of the array
+    candidates = []
+    for value in values:
+        candidates.append(value)
+        if isinstance(value, list):
+            candidates.extend(value)
+    return candidates
+
+
+def matches_operator(values, operator, argument, condition):
+    if operator == "$exists":
+        return bool(values) == bool(argument)
+    if operator == "$eq":
+        if argument is None and not values:
+            return True
+        return any(equal(value, argument) for value in with_elements(values))
+    if operator == "$ne":
+        return not matches_operator(values, "$eq", argument, condition)
+    if operator == "$in":
+        return any(matches_operator(values, "$eq", item, condition) for item in argument)
+    if operator == "$nin":
+        return not matches_operator(values, "$in", argument, condition)
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        return any(compare(value, operator, argument) for value in with_elements(values))
+    if operator == "$regex":
+        flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+        pattern = argument if isinstance(argument, re.Pattern) else re.compile(argument, flags)
+        return any(isinstance(value, str) and pattern.search(value) for value in with_elements(values))
+    if operator == "$options":
+        return True
+    if operator == "$not":
+        return not matches_condition(values, argument)
+    raise NotImplementedError(f"Query operator {operator} is not supported by the local store")
+
+
+def is_operator_document(condition):
+    return isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition)
+
+
+def matches_condition(values, condition):
+    if isinstance(condition, re.Pattern):
+        return matches_operator(values, "$regex", condition, {})
+    if is_operator_document(condition):
+        return all(matches_operator(values, operator, argument, condition) for operator, argument in condition.items())
+    return matches_operator(values, "$eq", condition, {})
+
+
+def matches(document, query):
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(document, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(document, part) for part in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, part) for part in condition):
+                return False
+        elif not matches_condition(get_values(document, key), condition):
+            return False
+    return True
+
+
+def set_path(document, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def unset_path(document, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+def get_path(document, path):
+    values = get_values(document, path)
+    return values[0] if values else None
+
+
+def apply_update(document, update, inserting):
+    """
+    Applies an update document, or an update pipeline that only sets values, to a document in place.
+    """
+    if isinstance(update, list):
+        for stage in update:
+            for operator, fields in stage.items():
+                if operator not in ("$set", "$addFields"):
+                    raise NotImplementedError(f"Update stage {operator} is not supported by the local store")
+                for path, value in fields.items():
+                    if isinstance(value, dict) or (isinstance(value, str) and value.startswith("$")):
+                        raise NotImplementedError("Expressions in update pipelines are not supported by the local store")
+                    set_path(document, path, value)
+        return
+
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            current = get_path(document, path)
+            if operator == "$set":
+                set_path(document, path, value)
+            elif operator == "$setOnInsert":
+                if inserting:
+                    set_path(document, path, value)
+            elif operator == "$unset":
+                unset_path(document, path)
+            elif operator == "$inc":
+                set_path(document, path, (current or 0) + value)
+            elif operator == "$min":
+                if current is None or compare(value, "$lt", current):
+                    set_path(document, path, value)
+            elif operator == "$max":
+                if current is None or compare(value, "$gt", current):
+                    set_path(document, path, value)
+            elif operator == "$push":
+                set_path(document, path, (current or []) + [value])
+            else:
+                raise NotImplementedError(f"Update operator {operator} is not supported by the local store")
+
+
+def upsert_document(query, update):
+    # a new document starts with the values the filter matched on
+    document = {key: deepcopy(value) for key, value in query.items()
+                if not key.startswith("$") and not is_operator_document(value) and not isinstance(value, re.Pattern)}
+    apply_update(document, update, inserting=True)
+    return document
+
+
+def project(document, projection):
+    if not projection:
+        return document
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    included = [path for path, value in projection.items() if value and path != "_id"]
+    if included:
+        result = {}
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        for path in included:
+            values = get_values(document, path)
+            if values:
+                set_path(result, path, values[0])
+        return result
+
+    result = document
+    for path in projection:
+        unset_path(result, path)
+    return result
+
+# ------------------- SQLite -------------------
+
+def key(value):
+    # _id values are stored as canonical extended JSON, so every BSON type can be the primary key
+    return json_util.dumps(value, sort_keys=True)
+
+
+def json_path(path):
+    return "$." + path.replace("'", "''")
+
+
+def field_expression(path):
+    return f"json_extract(doc, '{json_path(path)}')"
+
+
+def is_sql_value(value):
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+class InsertResult:
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+        self.inserted_id = inserted_ids[0] if inserted_ids else None
+
+
+class UpdateResult:
+    def __init__(self, matched_count=0, modified_count=0, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+
+
+class DeleteResult:
+    def __init__(self, deleted_count):
+        self.deleted_count = deleted_count
+
+
+class BulkWriteResult:
+    def __init__(self):
+        self.inserted_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.deleted_count = 0
+        self.upserted_ids = {}
+
+    @property
+    def upserted_count(self):
+        return len(self.upserted_ids)
+
+
+class LocalCursor:
+    def __init__(self, collection, query, projection):
+        self.collection = collection
+        self.query = query or {}
+        self.projection = projection
+        self.sort_keys = []
+        self.skip_count = 0
+        self.limit_count = 0
+
+    def sort(self, key_or_list, direction=1):
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction)]
+        self.sort_keys = list(key_or_list)
+        return self
+
+    def skip(self, count):
+        self.skip_count = count
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def __iter__(self):
+        returned = 0
+        skipped = 0
+        for document in self.collection.scan(self.query, self.sort_keys):
+            if skipped < self.skip_count:
+                skipped += 1
+                continue
+            yield project(document, self.projection)
+            returned += 1
+            if self.limit_count and returned >= self.limit_count:
+                return
+
+    def distinct(self, field):
+        values = []
+        for document in self:
+            for value in with_elements(get_values(document, field)):
+                if not isinstance(value, list) and not any(equal(value, seen) for seen in values):
+                    values.append(value)
+        return values
+
+
+class LocalCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.table = '"' + name.replace('"', '""') + '"'
+        self.indexed_fields = {"_id"}
+        with database.lock:
+            database.connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (id TEXT PRIMARY KEY, doc TEXT NOT NULL)")
+            # the fields indexed in an earlier run are still indexed
+            for (sql,) in database.connection.execute(
+                    "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (name,)):
+                self.indexed_fields.update(re.findall(r"json_extract\(doc, '\$\.([^']+)'\)", sql))
+
+    # ------------------- Reading -------------------
+
+    def where(self, query):
+        """
+        Translates the conditions on indexed fields to SQL, everything else is left to matches.
+        The SQL only has to select a superset of the matching documents.
+        """
+        clauses = []
+        parameters = []
+        for path, condition in query.items():
+            if path.startswith("$") or path not in self.indexed_fields:
+                continue
+            expression = "id" if path == "_id" else field_expression(path)
+            if path == "_id" and not is_operator_document(condition):
+                clauses.append("id = ?")
+                parameters.append(key(condition))
+            elif path == "_id":
+                if list(condition) == ["$in"] and condition["$in"]:
+                    clauses.append(f"id IN ({', '.join('?' * len(condition['$in']))})")
+                    parameters.extend(key(value) for value in condition["$in"])
+            elif is_sql_value(condition):
+                clauses.append(f"{expression} = ?")
+                parameters.append(condition)
+            elif is_operator_document(condition):
+                for operator, argument in condition.items():
+                    sql_operator = {"$eq": "=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}.get(operator)
+                    if sql_operator and is_sql_value(argument):
+                        clauses.append(f"{expression} {sql_operator} ?")
+                        parameters.append(argument)
+                    elif operator == "$in" and argument and all(is_sql_value(item) for item in argument):
+                        clauses.append(f"{expression} IN ({', '.join('?' * len(argument))})")
+                        parameters.extend(argument)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), parameters
+
+    def scan(self, query, sort_keys=()):
+        where, parameters = self.where(query)
+        order = ""
+        if sort_keys:
+            order = " ORDER BY " + ", ".join(f"{field_expression(field)} {SORT_DIRECTIONS[direction]}" for field, direction in sort_keys)
+
+        with self.database.lock:
+            cursor = self.database.connection.execute(f"SELECT doc FROM {self.table}{where}{order}", parameters)
+        while True:
+            with self.database.lock:
+                rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            for (row,) in rows:
+                document = json_util.loads(row)
+                if matches(document, query):
+                    yield document
+
+    def find(self, filter=None, projection=None):
+        return LocalCursor(self, filter, projection)
+
+    def find_one(self, filter=None, projection=None):
+        for document in self.find(filter, projection).limit(1):
+            return document
+        return None
+
+    def count_documents(self, filter):
+        return sum(1 for _ in self.scan(filter))
+
+    def distinct(self, field, filter=None):
+        return self.find(filter).distinct(field)
+
+    def aggregate(self, pipeline, **kwargs):
+        raise NotImplementedError("Aggregation pipelines are not supported by the local store")
+
+    # ------------------- Writing -------------------
+
+    def create_index(self, keys, unique=False, **kwargs):
+        # uniqueness is not enforced, every writer of this pipeline upserts on the unique fields anyway
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        columns = ", ".join(f"{field_expression(field)} {SORT_DIRECTIONS.get(direction, 'ASC')}" for field, direction in keys)
+        name = f"{self.name}_" + "_".join(f"{field}_{direction}" for field, direction in keys)
+        with self.database.lock:
+            self.database.connection.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON {self.table} ({columns})')
+        self.indexed_fields.update(field for field, _ in keys)
+        return name
+
+    def write(self, document):
+        self.database.connection.execute(f"INSERT OR REPLACE INTO {self.table} (id, doc) VALUES (?, ?)",
+                                         (key(document["_id"]), json_util.dumps(document)))
+
+    def insert(self, document):
+        document.setdefault("_id", ObjectId())
+        try:
+            self.database.connection.execute(f"INSERT INTO {self.table} (id, doc) VALUES (?, ?)",
+                                             (key(document["_id"]), json_util.dumps(document)))
+        except sqlite3.IntegrityError:
+            raise DuplicateKeyError(f"Duplicate _id {document['_id']} in {self.name}")
+        return document["_id"]
+
+    def update(self, query, update, upsert=False, many=False):
+        result = UpdateResult()
+        for document in list(self.scan(query)):
+            result.matched_count += 1
+            before = json_util.dumps(document)
+            apply_update(document, update, inserting=False)
+            if json_util.dumps(document) != before:
+                self.write(document)
+                result.modified_count += 1
+            if not many:
+                break
+
+        if upsert and result.matched_count == 0:
+            result.upserted_id = self.insert(upsert_document(query, update))
+        return result
+
+    def delete(self, query, many=False):
+        deleted = 0
+        for document in list(self.scan(query)):
+            self.database.connection.execute(f"DELETE FROM {self.table} WHERE id = ?", (key(document["_id"]),))
+            deleted += 1
+            if not many:
+                break
+        return DeleteResult(deleted)
+
+    def insert_one(self, document):
+        with self.database.transaction():
+            return InsertResult([self.insert(document)])
+
+    def insert_many(self, documents):
+        with self.database.transaction():
+            return InsertResult([self.insert(document) for document in documents])
+
+    def update_one(self, filter, update, upsert=False):
+        with self.database.transaction():
+            return self.update(filter, update, upsert)
+
+    def update_many(self, filter, update, upsert=False):
+        with self.database.transaction():
+            return self.update(filter, update, upsert, many=True)
+
+    def delete_one(self, filter):
+        with self.database.transaction():
+            return self.delete(filter)
+
+    def delete_many(self, filter):
+        with self.database.transaction():
+            return self.delete(filter, many=True)
+
+    def find_one_and_update(self, filter, update, sort=None, upsert=False, return_document=False, projection=None):
+        with self.database.transaction():
+            cursor = self.find(filter)
+            if sort:
+                cursor.sort(sort)
+            for document in cursor.limit(1):
+                before = deepcopy(document)
+                apply_update(document, update, inserting=False)
+                self.write(document)
+                return project(document if return_document else before, projection)
+            if upsert:
+                document = upsert_document(filter, update)
+                self.insert(document)
+                return project(document, projection) if return_document else None
+            return None
+
+    def bulk_write(self, requests, ordered=True):
+        """
+        Runs pymongo write operations (InsertOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany) in one transaction.
+        """
+        result = BulkWriteResult()
+        with self.database.transaction():
+            for index, request in enumerate(requests):
+                if isinstance(request, InsertOne):
+                    self.insert(request._doc)
+                    result.inserted_count += 1
+                elif isinstance(request, (UpdateOne, UpdateMany)):
+                    update = self.update(request._filter, request._doc, request._upsert, many=isinstance(request, UpdateMany))
+                    result.matched_count += update.matched_count
+                    result.modified_count += update.modified_count
+                    if update.upserted_id is not None:
+                        result.upserted_ids[index] = update.upserted_id
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    result.deleted_count += self.delete(request._filter, many=isinstance(request, DeleteMany)).deleted_count
+                else:
+                    raise NotImplementedError(f"{type(request).__name__} is not supported by the local store")
+        return result
+
+
+class LocalDatabase:
+    """
+    A SQLite file that behaves like a pymongo Database, see the top of this module.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.collections = {}
+
+    def transaction(self):
+        database = self
+
+        class Transaction:
+            def __enter__(self):
+                database.lock.acquire()
+                # take the write lock right away, so a read and the write that depends on it are atomic between processes
+                database.connection.execute("BEGIN IMMEDIATE")
+
+            def __exit__(self, exc_type, exc, traceback):
+                try:
+                    database.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+                finally:
+                    database.lock.release()
+
+        return Transaction()
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.collections:
+                self.collections[name] = LocalCollection(self, name)
+            return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_collection_names(self):
+        with self.lock:
+            return [name for (name,) in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
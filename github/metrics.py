@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+# ------------------- Global Variables & Config -------------------
+
+DOCUMENTATION_FLAGS = ["README_documentation", "comments_in_code", "wiki_present", "website_linked"]
+# contributions bounds of the new, contributing and core developer groups, every group starts at its bound
+# (new developers have more than 0), so every contributor is in exactly one group
+CONTRIBUTOR_GROUP_BOUNDS = [0, 10, 50]
+CONTRIBUTOR_GROUPS = ["new", "contributing", "core"]
+
+# ------------------- Loading -------------------
+
+def contributor_group_sizes(contributions):
+    """
+    Returns the amount of new, contributing and core developers among contributors with these amounts of contributions.
+    """
+    contributions = np.asarray(contributions, dtype=np.int64)
+    new, contributing, core = CONTRIBUTOR_GROUP_BOUNDS
+    return [int(((new < contributions) & (contributions < contributing)).sum()),
+            int(((contributing <= contributions) & (contributions < core)).sum()),
+            int((contributions >= core).sum())]
+
+
+def frames_from_documents(projects, contributor_groups):
+    """
+    Loads project documents, as they are in db.projects, into the tables compute_metrics works on.
+
+    Parameters:
+    - projects: The project documents.
+    - contributor_groups: The amount of new, contributing and core developers per github URL, see contributor_scripts.contributor_groups.
+
+    Returns:
+    A tuple of the projects, periods and contributor groups DataFrames.
+    """
+    rows = []
+    periods = []
+    for project in projects:
+        rows.append({
+            "github": project["github"],
+            "amount_of_pull_requests": project.get("amount_of_pull_requests", 0),
+            "average_pull_request_merge_time": project.get("average_pull_request_merge_time", 0),
+            **{flag: project.get(flag, False) for flag in DOCUMENTATION_FLAGS},
+        })
+        for i, period in enumerate(project.get("periods", [])):
+            periods.append((project["github"], i, period["count"]))
+
+    return (pd.DataFrame(rows, columns=["github", "amount_of_pull_requests", "average_pull_request_merge_time"] + DOCUMENTATION_FLAGS),
+            pd.DataFrame(periods, columns=["github", "period", "count"]),
+            pd.DataFrame([(github, *sizes) for github, sizes in contributor_groups.items()], columns=["github"] + CONTRIBUTOR_GROUPS))
+
+
+def frames_from_snapshot(snapshot):
+    """
+    Loads a snapshot (see snapshot.load_snapshot) into the tables compute_metrics works on, without rebuilding documents.
+
+    Returns:
+    A tuple of the projects, periods and contributor groups DataFrames.
+    """
+    projects = snapshot["projects"].select(["github", "amount_of_pull_requests", "average_pull_request_merge_time"] + DOCUMENTATION_FLAGS).to_pandas()
+    periods = snapshot["periods"].select(["github", "period", "count"]).to_pandas()
+    contributor_groups = snapshot["contributor_groups"].select(["github"] + CONTRIBUTOR_GROUPS).to_pandas()
+    return projects, periods, contributor_groups
+
+# ------------------- Metrics -------------------
+
+def group_stats(mask, total_projects, amount, weighted_time, periods, contributor_groups):
+    """
+    Computes every metric for the projects selected by mask.
+
+    Returns:
+    A dictionary with the amount and share (in %) of projects, the total amount of pull requests,
+    the PR weighted mean merge time, the average contributors gained per period and the contributors per group.
+    """
+    projects = int(mask.sum())
+    pull_requests = int(amount[mask].sum())
+    return {
+        "projects": projects,
+        "share": projects / total_projects * 100 if total_projects else 0,
+        "pull_requests": pull_requests,
+        "merge_time": int(weighted_time[mask].sum()) // pull_requests if pull_requests else 0,
+        "contributors_per_period": (periods[mask].sum(axis=0) / projects if projects else periods[mask].sum(axis=0)).tolist(),
+        "contributor_groups": contributor_groups[mask].sum(axis=0).astype(int).tolist(),
+    }
+
+
+def compute_metrics(projects, periods, contributor_groups):
+    """
+    Computes every metric the graphs need in one go, for every documentation flag and
+    every amount of documentation types, by masking columns instead of scanning the projects again.
+
+    Parameters:
+    - projects: DataFrame with a row per project, see frames_from_documents.
+    - periods: DataFrame with the contributors gained per project and period.
+    - contributor_groups: DataFrame with the amount of new, contributing and core developers per project.
+
+    Returns:
+    A dictionary with the total amount of projects, the data of the scatter plot, the metrics per flag
+    ('yes' and 'no') and the metrics per amount of documentation types (0 to 4, 'at_least_3' and 'at_most_1').
+    """
+    total_projects = len(projects)
+    github = projects["github"]
+    amount = projects["amount_of_pull_requests"].fillna(0).to_numpy(dtype=np.int64)
+    merge_time = projects["average_pull_request_merge_time"].fillna(0).to_numpy(dtype=np.int64)
+    weighted_time = amount * merge_time
+    flags = {flag: projects[flag].fillna(False).to_numpy(dtype=bool) for flag in DOCUMENTATION_FLAGS}
+    doc_types = np.sum(list(flags.values()), axis=0) if flags else np.zeros(total_projects, dtype=int)
+
+    # a matrix with a row per project and a column per period
+    period_matrix = periods.pivot_table(index="github", columns="period", values="count", aggfunc="sum") \
+        .reindex(github).fillna(0).to_numpy()
+
+    group_matrix = contributor_groups.groupby("github")[CONTRIBUTOR_GROUPS].sum() \
+        .reindex(github).fillna(0).to_numpy()
+
+    def stats(mask):
+        return group_stats(mask, total_projects, amount, weighted_time, period_matrix, group_matrix)
+
+    return {
+        "total_projects": total_projects,
+        "scatter": {"amount": amount.tolist(), "merge_time": merge_time.tolist()},
+        "flags": {flag: {"yes": stats(mask), "no": stats(~mask)} for flag, mask in flags.items()},
+        "doc_types": {
+            **{str(count): stats(doc_types == count) for count in range(len(DOCUMENTATION_FLAGS) + 1)},
+            "at_least_3": stats(doc_types >= 3),
+            "at_most_1": stats(doc_types <= 1),
+        },
+    }
@@ -0,0 +1,73 @@
+"""
+Converts the ISO string dates of pull requests harvested before dates were stored natively, and adds merge_seconds.
+Run it before contributors.py builds the contributors collection, as strings and dates don't compare, and before update_projects.py,
+which only aggregates on MongoDB once every date is native. It only reads unconverted documents, so it can be stopped and run again.
+"""
+import argparse
+
+from pymongo import UpdateOne
+import connections
+import harvester
+import telemetry
+from update_projects import as_date
+
+# ------------------- Global Variables & Config -------------------
+
+# how many pull requests are converted in one bulk write
+BATCH_SIZE = 1000
+DATE_FIELDS = ["created_at", "merged_at", "first_review_at"]
+
+# ------------------- Functions -------------------
+
+def converted_fields(pull_request):
+    """
+    Returns the fields of a pull request document that change, with the dates converted and merge_seconds added.
+    """
+    fields = {field: as_date(pull_request[field]) for field in DATE_FIELDS if field in pull_request}
+    if "reviews" in pull_request:
+        fields["reviews"] = [{**review, "submitted_at": as_date(review.get("submitted_at"))} for review in pull_request["reviews"]]
+    fields["merge_seconds"] = harvester.merge_seconds(fields["created_at"], fields["merged_at"])
+    return fields
+
+
+@telemetry.timed("migrate_dates.migrate")
+def migrate(batch_size=BATCH_SIZE):
+    """
+    Converts every pull request that has no merge_seconds yet, in batched bulk writes.
+
+    Parameters:
+    - batch_size: How many pull requests are converted in one bulk write.
+
+    Returns:
+    The amount of pull requests that were converted.
+    """
+    collection = connections.get_db().pull_requests
+    projection = {field: 1 for field in DATE_FIELDS + ["reviews"]}
+    updates = []
+    total = 0
+
+    def flush():
+        if updates:
+            collection.bulk_write(updates, ordered=False)
+            updates.clear()
+
+    for pull_request in collection.find({"merge_seconds": {"$exists": False}}, projection):
+        updates.append(UpdateOne({"_id": pull_request["_id"]}, {"$set": converted_fields(pull_request)}))
+        total += 1
+        if len(updates) >= batch_size:
+            flush()
+            telemetry.event(f"Converted {total} pull requests")
+
+    flush()
+    telemetry.event(f"Converted {total} pull requests in total")
+    return total
+
+
+if __name__ == "__main__":
+    connections.start_telemetry("migrate_dates")
+    parser = argparse.ArgumentParser(description="Store the dates of older pull requests as native dates and add merge_seconds.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="pull requests per bulk write")
+    args = parser.parse_args()
+
+    migrate(args.batch_size)
+    connections.log_stats()
@@ -0,0 +1,119 @@
+import matplotlib
+# render without a display, this has to happen before pyplot is imported anywhere
+matplotlib.use("Agg")
+
+import argparse
+import hashlib
+import inspect
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib.pyplot as plt
+import connections
+import generate_graphs
+import telemetry
+
+# ------------------- Global Variables & Config -------------------
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'figures')
+# remembers the hash of the data every figure was last rendered from
+CACHE_FILE = ".figure_cache.json"
+
+# ------------------- Functions -------------------
+
+def figure_hash(name, data, file_format):
+    """
+    Hashes everything a rendered figure depends on: its data, the format and the code that draws it,
+    so a figure is rendered again when either its data or its drawing code changes.
+    """
+    figure_function = generate_graphs.FIGURES[name][1]
+    payload = json.dumps({
+        "figure": name,
+        "format": file_format,
+        "data": data,
+        "code": inspect.getsource(figure_function),
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def load_cache(output_dir):
+    path = os.path.join(output_dir, CACHE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_cache(output_dir, cache):
+    with open(os.path.join(output_dir, CACHE_FILE), "w") as file:
+        json.dump(cache, file, indent=2, sort_keys=True)
+
+
+def render(name, data, path):
+    # runs in a worker process, only the data of a single figure is sent over
+    fig = generate_graphs.FIGURES[name][1](data)
+    fig.savefig(path, bbox_inches="tight")
+    plt.close(fig)
+    return path
+
+
+@telemetry.timed("render_figures.render_all")
+def render_all(output_dir=DEFAULT_OUTPUT_DIR, formats=("png",), workers=None, force=False):
+    """
+    Renders every figure of generate_graphs to files, in parallel worker processes.
+    The metrics are computed once in this process, figures whose data did not change since the last run are skipped.
+
+    Parameters:
+    - output_dir: Where the figures are written, as '<figure>.<format>'.
+    - formats: The file formats, anything matplotlib can save like png or svg.
+    - workers: The amount of worker processes, the amount of CPUs by default.
+    - force: Render every figure, even when it did not change.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    cache = load_cache(output_dir)
+
+    jobs = []
+    for name, (data_function, _) in generate_graphs.FIGURES.items():
+        data = data_function()
+        for file_format in formats:
+            key = f"{name}.{file_format}"
+            path = os.path.join(output_dir, key)
+            digest = figure_hash(name, data, file_format)
+            if not force and cache.get(key) == digest and os.path.exists(path):
+                telemetry.event(f"Skipping {key}, unchanged")
+                continue
+            jobs.append((key, digest, name, data, path))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render, name, data, path): (key, digest) for key, digest, name, data, path in jobs}
+        for future in as_completed(futures):
+            key, digest = futures[future]
+            try:
+                telemetry.event(f"Rendered {future.result()}")
+                cache[key] = digest
+            except Exception as e:
+                telemetry.event(f"Failed to render {key}: {e}", logging.ERROR)
+
+    save_cache(output_dir, cache)
+
+
+def main():
+    connections.start_telemetry("render_figures")
+    parser = argparse.ArgumentParser(description="Render every figure to files without a display.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_DIR, help="directory the figures are written to")
+    parser.add_argument("--format", action="append", dest="formats", help="file format, can be given more than once (default: png)")
+    parser.add_argument("--snapshot", help="read the data from this snapshot directory instead of MongoDB")
+    parser.add_argument("--workers", type=int, help="amount of worker processes")
+    parser.add_argument("--force", action="store_true", help="render every figure, even when it did not change")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        generate_graphs.SNAPSHOT_DIR = args.snapshot
+    render_all(args.output, args.formats or ["png"], args.workers, args.force)
+    connections.log_stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# ------------------- Global Variables & Config -------------------
+
+# how long a response is served from the cache, in seconds
+DEFAULT_TTL = 24 * 60 * 60
+# how big the stored bodies may get, in bytes, before the least recently used responses are dropped
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+# evicting goes down to this fraction of the maximum size, so not every store has to evict
+EVICT_TO = 0.9
+# the headers worth keeping, the harvester reads the Link header to find the other pages
+STORED_HEADERS = ["Content-Type", "Link", "ETag", "Last-Modified"]
+
+# ------------------- Functions -------------------
+
+def cache_key(method, url, accept):
+    return hashlib.sha256(f"{method} {url} {accept}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    An on-disk cache of GitHub API responses in a SQLite file, keyed by method, URL and Accept header.
+    Bodies are stored compressed, every entry expires after its TTL, and when the bodies together
+    get bigger than max_size the least recently used entries are dropped.
+
+    Only successful GET responses are stored. It is meant for development, where the same pages
+    are fetched over and over: a cached response is served even when GitHub has a newer one.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, stats=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stats = stats if stats is not None else Counter()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, method, url, accept):
+        """
+        Returns the cached response as a requests.Response with from_cache set, or None.
+        """
+        key = cache_key(method, url, accept)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status, headers, body, size, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["cache_misses"] += 1
+                return None
+
+            status, headers, body, size, expires_at = row
+            if expires_at <= now:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+                self.stats["cache_misses"] += 1
+                self.stats["cache_expired"] += 1
+                return None
+
+            self.connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.stats["cache_hits"] += 1
+
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response._content = zlib.decompress(body)
+        response.url = url
+        response.encoding = "utf-8"
+        response.from_cache = True
+        return response
+
+    def store(self, method, url, accept, response, ttl=None):
+        if response.status_code != 200:
+            return
+        headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+        body = zlib.compress(response.content)
+        key = cache_key(method, url, accept)
+        now = time.time()
+
+        with self.lock:
+            old = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, url, status, headers, body, size, expires_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, response.status_code, json.dumps(headers), body, len(body),
+                 now + (self.ttl if ttl is None else ttl), now))
+            self.size += len(body) - (old[0] if old else 0)
+            self.stats["cache_stores"] += 1
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        # expired entries go first, then the least recently used ones
+        target = self.max_size * EVICT_TO
+        rows = self.connection.execute(
+            "SELECT key, size FROM responses ORDER BY expires_at > ?, last_used", (time.time(),))
+        evicted = []
+        for key, size in rows:
+            if self.size <= target:
+                break
+            evicted.append((key,))
+            self.size -= size
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.stats["cache_evictions"] += len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.size = 0
@@ -0,0 +1,222 @@
+"""
+Permutation tests and bootstrap confidence intervals for the documentation comparisons of the graphs. Projects are
+resampled, and every statistic is a ratio of per-project sums, so a batch of resamples is one matrix product.
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import connections
+import metrics
+import snapshot
+import telemetry
+
+# ------------------- Global Variables & Config -------------------
+
+RESAMPLES = 10000
+# weights in one batch of resamples (resamples x projects), about 32 MB per process
+MAX_BATCH_WEIGHTS = 1 << 22
+CONFIDENCE = 0.95
+WORKERS = os.cpu_count() or 4
+
+# every statistic is sum(numerator) / sum(denominator) over the projects of a group
+STATISTICS = {
+    "merge_time": ("merge_seconds", "pull_requests"),
+    "pull_requests": ("pull_requests", "projects"),
+    "contributors_gained": ("contributors_gained", "projects"),
+}
+
+# set in every worker process by init_worker, so they are sent once instead of with every batch
+sums = None
+masks = None
+
+# ------------------- Data -------------------
+
+def project_sums(projects, periods):
+    """
+    Turns the tables of metrics.compute_metrics into the per-project sums the statistics are built from.
+
+    Returns:
+    A matrix with a row per project and a column per sum: merge_seconds, pull_requests, contributors_gained
+    (the average per period) and projects (always 1), and the column names.
+    """
+    amount = projects["amount_of_pull_requests"].fillna(0).to_numpy(dtype=np.float64)
+    merge_time = projects["average_pull_request_merge_time"].fillna(0).to_numpy(dtype=np.float64)
+    gained = periods.groupby("github")["count"].mean().reindex(projects["github"]).fillna(0).to_numpy(dtype=np.float64)
+    columns = ["merge_seconds", "pull_requests", "contributors_gained", "projects"]
+    return np.column_stack([amount * merge_time, amount, gained, np.ones(len(projects))]), columns
+
+
+def comparison_masks(projects):
+    """
+    Returns the groups of projects that are compared with the rest: every flag, and every amount of documentation types.
+    """
+    flags = {flag: projects[flag].fillna(False).to_numpy(dtype=bool) for flag in metrics.DOCUMENTATION_FLAGS}
+    doc_types = np.sum(list(flags.values()), axis=0)
+    masks = dict(flags)
+    for count in range(len(metrics.DOCUMENTATION_FLAGS) + 1):
+        masks[f"{count}_doc_types"] = doc_types == count
+    masks["at_least_3_doc_types"] = doc_types >= 3
+    masks["at_most_1_doc_types"] = doc_types <= 1
+    return masks
+
+# ------------------- Resampling -------------------
+
+def ratios(weighted, columns):
+    """
+    Computes every statistic from weighted sums (... x columns), nan when the denominator is 0.
+    """
+    index = {column: i for i, column in enumerate(columns)}
+    result = []
+    for numerator, denominator in STATISTICS.values():
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result.append(weighted[..., index[numerator]] / weighted[..., index[denominator]])
+    return np.stack(result, axis=-1)
+
+
+def init_worker(project_sums, group_masks):
+    global sums, masks
+    sums = project_sums
+    masks = group_masks
+
+
+def permutation_batch(task):
+    """
+    Shuffles which projects are in the group, size times.
+
+    Returns:
+    The differences between the group and the rest, a row per permutation and a column per statistic.
+    """
+    group, columns, size, seed = task
+    mask = masks[group]
+    rng = np.random.default_rng(seed)
+    weights = rng.permuted(np.broadcast_to(mask, (size, len(mask))).astype(np.float64), axis=1)
+    inside = weights @ sums
+    outside = sums.sum(axis=0) - inside
+    return ratios(inside, columns) - ratios(outside, columns)
+
+
+def bootstrap_batch(task):
+    """
+    Draws the projects of the group and of the rest with replacement, size times.
+
+    Returns:
+    The differences between the group and the rest, a row per bootstrap sample and a column per statistic.
+    """
+    group, columns, size, seed = task
+    mask = masks[group]
+    rng = np.random.default_rng(seed)
+    differences = []
+    for group in (mask, ~mask):
+        group_sums = sums[group]
+        count = len(group_sums)
+        weights = rng.multinomial(count, np.full(count, 1 / count), size=size).astype(np.float64) if count else np.zeros((size, 0))
+        differences.append(ratios(weights @ group_sums, columns))
+    return differences[0] - differences[1]
+
+
+def batches(group, projects, columns, resamples, seed):
+    batch_size = max(1, MAX_BATCH_WEIGHTS // max(1, projects))
+    sizes = [min(batch_size, resamples - start) for start in range(0, resamples, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    return [(group, columns, size, seed) for size, seed in zip(sizes, seeds)]
+
+
+def compare_groups(sums_matrix, columns, masks, resamples=RESAMPLES, workers=WORKERS, seed=0, confidence=CONFIDENCE):
+    """
+    Runs a permutation test and a bootstrap for every group and statistic.
+
+    Parameters:
+    - sums_matrix, columns: The per-project sums, see project_sums.
+    - masks: The groups to compare with the rest of the projects, see comparison_masks.
+    - resamples: How many permutations and bootstrap samples per group.
+    - workers: How many processes resample at the same time.
+    - seed: The same seed gives the same results.
+    - confidence: The level of the confidence intervals.
+
+    Returns:
+    A list of results, one per group and statistic, with the value in the group and in the rest, the difference,
+    its confidence interval and the two-sided permutation p-value.
+    """
+    names = list(masks)
+    masks_matrix = np.array([masks[name] for name in names], dtype=bool)
+    projects = len(sums_matrix)
+    tasks = []
+    for i in range(len(names)):
+        tasks.append([(permutation_batch, task) for task in batches(i, projects, columns, resamples, [seed, i, 0])]
+                     + [(bootstrap_batch, task) for task in batches(i, projects, columns, resamples, [seed, i, 1])])
+
+    # the observed statistics, in the group and in the rest
+    observed_inside = masks_matrix.astype(np.float64) @ sums_matrix
+    inside = ratios(observed_inside, columns)
+    outside = ratios(sums_matrix.sum(axis=0) - observed_inside, columns)
+    observed = inside - outside
+
+    results = []
+    tail = (1 - confidence) / 2 * 100
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(sums_matrix, masks_matrix)) as pool:
+        futures = [[(function, pool.submit(function, task)) for function, task in group] for group in tasks]
+
+        for i, name in enumerate(names):
+            permutations = np.concatenate([future.result() for function, future in futures[i] if function is permutation_batch])
+            bootstraps = np.concatenate([future.result() for function, future in futures[i] if function is bootstrap_batch])
+            for j, statistic in enumerate(STATISTICS):
+                # resamples with an empty group have no statistic
+                permuted = permutations[:, j][~np.isnan(permutations[:, j])]
+                sampled = bootstraps[:, j][~np.isnan(bootstraps[:, j])]
+                extreme = np.sum(np.abs(permuted) >= np.abs(observed[i, j]) - 1e-9)
+                low, high = np.percentile(sampled, [tail, 100 - tail]) if len(sampled) else (np.nan, np.nan)
+                results.append({
+                    "group": name,
+                    "statistic": statistic,
+                    "projects": int(masks_matrix[i].sum()),
+                    "group_value": float(inside[i, j]),
+                    "rest_value": float(outside[i, j]),
+                    "difference": float(observed[i, j]),
+                    "ci_low": float(low),
+                    "ci_high": float(high),
+                    "p_value": float((1 + extreme) / (1 + len(permuted))),
+                })
+    return results
+
+
+@telemetry.timed("significance.significance")
+def significance(snapshot_dir=None, resamples=RESAMPLES, workers=WORKERS, seed=0):
+    """
+    Loads the projects from a snapshot or the database and tests every documentation comparison, see compare_groups.
+    """
+    if snapshot_dir:
+        projects, periods, _ = metrics.frames_from_snapshot(snapshot.load_snapshot(snapshot_dir))
+    else:
+        # the contributor groups are not compared
+        projects, periods, _ = metrics.frames_from_documents(connections.get_db().projects.find(), {})
+    sums_matrix, columns = project_sums(projects, periods)
+    return compare_groups(sums_matrix, columns, comparison_masks(projects), resamples, workers, seed)
+
+
+def print_results(results):
+    print(f"{'group':24} {'statistic':20} {'projects':>8} {'group':>12} {'rest':>12} {'difference':>12} {'95% CI':>27} {'p':>7}")
+    for result in results:
+        ci = f"[{result['ci_low']:.1f}, {result['ci_high']:.1f}]"
+        print(f"{result['group']:24} {result['statistic']:20} {result['projects']:8} {result['group_value']:12.1f} "
+              f"{result['rest_value']:12.1f} {result['difference']:12.1f} {ci:>27} {result['p_value']:7.4f}")
+
+
+if __name__ == "__main__":
+    connections.start_telemetry("significance")
+    parser = argparse.ArgumentParser(description="Test whether the documentation comparisons of the graphs are significant.")
+    parser.add_argument("--snapshot", help="snapshot directory to read instead of the database")
+    parser.add_argument("--resamples", type=int, default=RESAMPLES, help="permutations and bootstrap samples per comparison")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="resampling processes")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = significance(args.snapshot, args.resamples, args.workers, args.seed)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    connections.log_stats()
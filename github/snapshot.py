@@ -0,0 +1,208 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import connections
+import contributor_scripts
+import metrics
+import telemetry
+
+# ------------------- Global Variables & Config -------------------
+
+# where the snapshot is written when no directory is given
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'snapshot')
+# how many documents are converted and written at a time
+BATCH_SIZE = 10000
+
+TIMESTAMP = pa.timestamp("s", tz="UTC")
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+PROJECTS_SCHEMA = pa.schema([
+    ("github", pa.string()),
+    ("downloads", pa.int64()),
+    ("average_pull_request_merge_time", pa.int64()),
+    ("median_pull_request_merge_time", pa.int64()),
+    ("p90_pull_request_merge_time", pa.int64()),
+    ("amount_of_pull_requests", pa.int64()),
+] + [(flag, pa.bool_()) for flag in metrics.DOCUMENTATION_FLAGS] + [
+    ("first_pr_date", TIMESTAMP),
+    ("last_pr_date", TIMESTAMP),
+])
+
+PERIODS_SCHEMA = pa.schema([
+    ("github", pa.string()),
+    ("period", pa.int32()),
+    ("start", TIMESTAMP),
+    ("end", TIMESTAMP),
+    ("count", pa.int64()),
+])
+
+SUBMITTERS_SCHEMA = pa.schema([
+    ("github", pa.string()),
+    ("name", pa.string()),
+    ("contributions", pa.int64()),
+    ("first_pull_request", TIMESTAMP),
+    ("last_pull_request", TIMESTAMP),
+])
+
+REVIEWERS_SCHEMA = pa.schema([
+    ("github", pa.string()),
+    ("name", pa.string()),
+    ("contributions", pa.int64()),
+    ("first_review", TIMESTAMP),
+    ("last_review", TIMESTAMP),
+])
+
+CONTRIBUTOR_GROUPS_SCHEMA = pa.schema([
+    ("github", pa.string()),
+    ("new", pa.int64()),
+    ("contributing", pa.int64()),
+    ("core", pa.int64()),
+])
+
+PULL_REQUESTS_SCHEMA = pa.schema([
+    ("project", pa.string()),
+    ("number", pa.int64()),
+    ("title", pa.string()),
+    ("created_at", TIMESTAMP),
+    ("merged_at", TIMESTAMP),
+    ("merge_seconds", pa.int64()),
+    ("submitter", pa.string()),
+    ("first_review_at", TIMESTAMP),
+])
+
+# ------------------- Functions -------------------
+
+def parse_date(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def format_date(value):
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc).strftime(DATE_FORMAT)
+
+
+class TableWriter:
+    """
+    Writes rows to an Arrow IPC file in batches, so a snapshot never has to fit in memory.
+    """
+
+    def __init__(self, path, schema):
+        self.schema = schema
+        self.rows = []
+        self.writer = pa.ipc.new_file(path, schema)
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            columns = []
+            for field in self.schema:
+                values = [row.get(field.name) for row in self.rows]
+                if field.type == TIMESTAMP:
+                    values = [parse_date(value) for value in values]
+                columns.append(pa.array(values, type=field.type))
+            self.writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+@telemetry.timed("snapshot.export_snapshot")
+def export_snapshot(directory=DEFAULT_SNAPSHOT_DIR):
+    """
+    Writes the projects and pull requests from MongoDB to typed columnar files, one Arrow IPC file per table.
+    The periods, submitters and reviewers embedded in the projects get a table of their own, keyed by github,
+    and so do the developer group sizes from the contributors collection.
+
+    Parameters:
+    - directory: Where the files are written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    db = connections.get_db()
+
+    projects = TableWriter(os.path.join(directory, "projects.arrow"), PROJECTS_SCHEMA)
+    periods = TableWriter(os.path.join(directory, "periods.arrow"), PERIODS_SCHEMA)
+    submitters = TableWriter(os.path.join(directory, "submitters.arrow"), SUBMITTERS_SCHEMA)
+    reviewers = TableWriter(os.path.join(directory, "reviewers.arrow"), REVIEWERS_SCHEMA)
+
+    for project in db.projects.find({}, {"_id": 0, "pkg": 0}):
+        github = project["github"]
+        projects.write({**project, "downloads": project.get("downloads", {}).get("downloads")})
+        for i, period in enumerate(project.get("periods", [])):
+            periods.write({"github": github, "period": i, **period})
+        for submitter in project.get("submitters", []):
+            submitters.write({"github": github, **submitter})
+        for reviewer in project.get("reviewers", []):
+            reviewers.write({"github": github, **reviewer})
+
+    for writer in (projects, periods, submitters, reviewers):
+        writer.close()
+
+    contributor_groups = TableWriter(os.path.join(directory, "contributor_groups.arrow"), CONTRIBUTOR_GROUPS_SCHEMA)
+    for github, (new, contributing, core) in contributor_scripts.contributor_groups(db).items():
+        contributor_groups.write({"github": github, "new": new, "contributing": contributing, "core": core})
+    contributor_groups.close()
+
+    pull_requests = TableWriter(os.path.join(directory, "pull_requests.arrow"), PULL_REQUESTS_SCHEMA)
+    for pull_request in db.pull_requests.find({}, {"_id": 0, "reviews": 0}):
+        pull_requests.write(pull_request)
+    pull_requests.close()
+
+    telemetry.event(f"Exported snapshot to {directory}")
+
+
+def read_table(directory, name):
+    # memory mapped, so the columns are only read from disk when they are used
+    with pa.memory_map(os.path.join(directory, f"{name}.arrow"), "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def load_snapshot(directory=DEFAULT_SNAPSHOT_DIR):
+    """
+    Opens a snapshot written by export_snapshot.
+
+    Returns:
+    A dictionary from table name to pyarrow Table.
+    """
+    return {name: read_table(directory, name) for name in ["projects", "periods", "submitters", "reviewers", "contributor_groups", "pull_requests"]}
+
+
+def project_documents(snapshot):
+    """
+    Rebuilds the project documents from a snapshot, in the same shape as db.projects,
+    so code written against MongoDB documents can run on a snapshot.
+    """
+    embedded = {"periods": {}, "submitters": {}, "reviewers": {}}
+    for name, rows in embedded.items():
+        for row in snapshot[name].to_pylist():
+            github = row.pop("github")
+            row.pop("period", None)
+            rows.setdefault(github, []).append({key: format_date(value) if isinstance(value, datetime) else value
+                                                for key, value in row.items()})
+
+    documents = []
+    for row in snapshot["projects"].to_pylist():
+        document = {key: format_date(value) if isinstance(value, datetime) else value
+                    for key, value in row.items() if value is not None}
+        document["downloads"] = {"downloads": row["downloads"]}
+        for name, rows in embedded.items():
+            if row["github"] in rows:
+                document[name] = rows[row["github"]]
+        documents.append(document)
+    return documents
+
+
+if __name__ == "__main__":
+    connections.start_telemetry("snapshot")
+    export_snapshot(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SNAPSHOT_DIR)
+    connections.log_stats()
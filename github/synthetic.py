@@ -0,0 +1,188 @@
+"""
+Generates npm, projects, pull_requests and contributors collections of any size, as skewed as the real data,
+for benchmarks and for trying the pipeline without harvesting.
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import connections
+import contributors
+import metrics
+import telemetry
+
+# ------------------- Global Variables & Config -------------------
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+BATCH_SIZE = 5000
+
+# projects get between MIN_PULL_REQUESTS and MAX_PULL_REQUESTS merged pull requests, most close to the minimum
+MIN_PULL_REQUESTS = 100
+MAX_PULL_REQUESTS = 1000
+PULL_REQUEST_EXPONENT = 2.0
+# a handful of contributors make most pull requests
+CONTRIBUTOR_EXPONENT = 1.6
+CONTRIBUTORS_PER_PROJECT = 200
+# median merge time of about a day, with a long tail
+MERGE_SECONDS_MEDIAN = 24 * 60 * 60
+MERGE_SECONDS_SIGMA = 1.8
+# the first pull request of a project is somewhere in these years, the project is active for up to 8 years
+FIRST_YEAR = 2012
+LAST_YEAR = 2022
+MAX_ACTIVE_DAYS = 8 * 365
+# every package of NPM_PACKAGES_PER_PROJECT shares a repository with another one
+NPM_PACKAGES_PER_PROJECT = 5
+
+# ------------------- Functions -------------------
+
+def zipf(rng, exponent, size, maximum):
+    # numpy's zipf is unbounded, draw again for the values that are too big
+    values = rng.zipf(exponent, size)
+    while (values > maximum).any():
+        too_big = values > maximum
+        values[too_big] = rng.zipf(exponent, too_big.sum())
+    return values
+
+
+def to_date(seconds):
+    return datetime.fromtimestamp(int(seconds), timezone.utc)
+
+
+def format_date(date):
+    return date.astimezone(timezone.utc).strftime(DATE_FORMAT)
+
+
+def project_name(i):
+    return f"owner{i}/repo{i}"
+
+
+def generate_pull_requests(rng, project, amount):
+    """
+    Generates the merged pull requests of a project, in the shape github.parse_pull_request stores them.
+    """
+    start = datetime(FIRST_YEAR, 1, 1, tzinfo=timezone.utc).timestamp() \
+        + rng.uniform(0, (LAST_YEAR - FIRST_YEAR) * 365 * 86400)
+    active = rng.uniform(90, MAX_ACTIVE_DAYS) * 86400
+    # bursts: pull requests cluster around a few busy moments of the project
+    centers = rng.uniform(start, start + active, max(1, amount // 50))
+    created = np.sort(np.clip(rng.choice(centers, amount) + rng.normal(0, 30 * 86400, amount), start, start + active))
+    merged = created + rng.lognormal(np.log(MERGE_SECONDS_MEDIAN), MERGE_SECONDS_SIGMA, amount)
+    submitters = zipf(rng, CONTRIBUTOR_EXPONENT, amount, CONTRIBUTORS_PER_PROJECT)
+    reviewers = zipf(rng, CONTRIBUTOR_EXPONENT, amount, CONTRIBUTORS_PER_PROJECT // 10)
+
+    return [{
+        "project": project,
+        "number": i + 1,
+        "title": f"Pull request {i + 1}",
+        "created_at": to_date(created[i]),
+        "merged_at": to_date(merged[i]),
+        "merge_seconds": int(merged[i]) - int(created[i]),
+        "submitter": f"user{submitters[i]}",
+        "reviewers": [f"user{reviewers[i]}"] if reviewers[i] != submitters[i] else [],
+        "assignees": [],
+    } for i in range(amount)]
+
+
+def generate_project(rng, i, amount):
+    reviewers = zipf(rng, CONTRIBUTOR_EXPONENT, amount, CONTRIBUTORS_PER_PROJECT // 10)
+    names, contributions = np.unique(reviewers, return_counts=True)
+    return {
+        "github": f"git+https://github.com/{project_name(i)}.git",
+        "downloads": {"downloads": int(rng.lognormal(15, 1))},
+        **{flag: bool(rng.random() < 0.5) for flag in metrics.DOCUMENTATION_FLAGS},
+        "reviewers": [{"name": f"user{name}", "contributions": int(count)} for name, count in zip(names, contributions)],
+    }
+
+
+def generate_npm_packages(rng, projects):
+    """
+    Generates npm packages, several per repository, some of them in the download range github.fetch_github_urls selects.
+    """
+    amount = projects * NPM_PACKAGES_PER_PROJECT
+    repositories = rng.integers(0, projects, amount)
+    modified = datetime(LAST_YEAR, 1, 1, tzinfo=timezone.utc).timestamp() + rng.uniform(0, 2 * 365 * 86400, amount)
+    downloads = rng.lognormal(14, 1.5, amount).astype(np.int64)
+    return [{
+        "name": f"package{i}",
+        "github": f"git+https://github.com/{project_name(repositories[i])}.git",
+        "downloads": {"downloads": int(downloads[i])},
+        "pkg": {"time": {"modified": datetime.fromtimestamp(modified[i], timezone.utc).isoformat()}},
+    } for i in range(amount)]
+
+
+def pull_request_amounts(rng, projects):
+    return zipf(rng, PULL_REQUEST_EXPONENT, projects, MAX_PULL_REQUESTS - MIN_PULL_REQUESTS) + MIN_PULL_REQUESTS
+
+
+def rest_pages(pull_requests, per_page=100):
+    """
+    Turns generated pull requests into the pages the REST API returns for them, newest first, for stub servers.
+    """
+    pages = []
+    for pr in reversed(pull_requests):
+        if not pages or len(pages[-1]) == per_page:
+            pages.append([])
+        pages[-1].append({
+            "number": pr["number"],
+            "title": pr["title"],
+            "created_at": format_date(pr["created_at"]),
+            "updated_at": format_date(pr["merged_at"]),
+            "merged_at": format_date(pr["merged_at"]),
+            "user": {"login": pr["submitter"], "type": "User"},
+            "requested_reviewers": [{"login": login} for login in pr["reviewers"]],
+            "assignees": [],
+        })
+    return pages
+
+
+def insert_in_batches(collection, documents):
+    for start in range(0, len(documents), BATCH_SIZE):
+        collection.insert_many(documents[start:start + BATCH_SIZE])
+
+
+@telemetry.timed("synthetic.generate")
+def generate(projects=1000, seed=0):
+    """
+    Fills the npm, projects, pull_requests and contributors collections with synthetic data.
+
+    Parameters:
+    - projects: How many projects are generated, the other collections grow with it.
+    - seed: The same seed always generates the same data.
+
+    Returns:
+    The amount of pull requests that were generated.
+    """
+    rng = np.random.default_rng(seed)
+    db = connections.get_db()
+    contributors.ensure_indexes()
+    insert_in_batches(db.npm, generate_npm_packages(rng, projects))
+
+    total = 0
+    batch = []
+    documents = []
+    for i, amount in enumerate(pull_request_amounts(rng, projects)):
+        documents.append(generate_project(rng, i, int(amount)))
+        batch.extend(generate_pull_requests(rng, project_name(i), int(amount)))
+        if len(batch) >= BATCH_SIZE:
+            insert_in_batches(db.pull_requests, batch)
+            contributors.record(batch)
+            total += len(batch)
+            batch = []
+    insert_in_batches(db.pull_requests, batch)
+    contributors.record(batch)
+    insert_in_batches(db.projects, documents)
+    total += len(batch)
+
+    telemetry.event(f"Generated {projects} projects with {total} pull requests")
+    return total
+
+
+if __name__ == "__main__":
+    connections.start_telemetry("synthetic")
+    parser = argparse.ArgumentParser(description="Fill the configured database with synthetic npm, projects and pull_requests collections.")
+    parser.add_argument("--projects", type=int, default=1000, help="amount of projects")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    generate(args.projects, args.seed)
+    connections.log_stats()
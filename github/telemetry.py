@@ -0,0 +1,278 @@
+"""
+Timers, counters, gauges and progress events for every stage of the pipeline. Log records go through a queue to a
+background thread that writes them to the console and a JSON lines log, and the values can be served to Prometheus.
+"""
+import atexit
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# ------------------- Global Variables & Config -------------------
+
+PROGRESS_INTERVAL = 10
+# counters that are reported with their rate
+THROUGHPUT_COUNTERS = ["pages", "pull_requests_stored", "http_bytes"]
+METRIC_PREFIX = "pipeline"
+
+counters = Counter()
+# (name, labels) -> value
+gauges = {}
+# stage -> [runs, seconds]
+timers = {}
+# how many values of every kind (count, gauge, timer, event) were recorded, for the overhead check of benchmark.py
+operations = Counter()
+# other counters that are reported with these, like connections.stats
+sources = []
+
+lock = threading.Lock()
+start_lock = threading.Lock()
+logger = logging.getLogger("pipeline")
+logger.propagate = False
+listener = None
+reporter = None
+server = None
+# stop is registered to run at exit with the first start, every later start would add it again
+stop_at_exit = False
+stopping = threading.Event()
+run_name = None
+started = time.time()
+
+# ------------------- Recording -------------------
+
+def count(name, amount=1):
+    with lock:
+        counters[name] += amount
+        operations["count"] += 1
+
+
+def gauge(name, value, **labels):
+    with lock:
+        gauges[(name, tuple(sorted(labels.items())))] = value
+        operations["gauge"] += 1
+
+
+def add_time(stage, seconds):
+    with lock:
+        timer = timers.setdefault(stage, [0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+        operations["timer"] += 1
+
+
+@contextmanager
+def timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    """
+    Decorates a function so every call of it is timed as stage.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def include(counter):
+    sources.append(counter)
+
+
+def event(message, level=logging.INFO, **fields):
+    """
+    Logs a progress message. The fields only go to the JSON log, and so do debug events, like one per project.
+    The log is started with the console only when no script started it.
+    """
+    if listener is None:
+        start()
+    with lock:
+        operations["event"] += 1
+    logger.log(level, message, extra={"fields": fields})
+
+# ------------------- Reporting -------------------
+
+def label_text(labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels)
+
+
+def summary():
+    """
+    Returns the counters, gauges and timers recorded so far, and the seconds since the start.
+    """
+    with lock:
+        values = Counter(counters)
+        for source in sources:
+            values.update(source)
+        return {
+            "seconds": time.time() - started,
+            "counters": dict(values),
+            "gauges": {f"{name}{{{label_text(labels)}}}" if labels else name: value for (name, labels), value in gauges.items()},
+            "timers": {stage: {"runs": runs, "seconds": seconds} for stage, (runs, seconds) in timers.items()},
+        }
+
+
+def log_summary():
+    values = summary()
+    stages = ", ".join(f"{stage} {timer['seconds']:.2f}s/{timer['runs']}" for stage, timer in values["timers"].items())
+    rates = ", ".join(f"{name.replace('_', ' ')} {values['counters'][name] / values['seconds']:.1f}/s"
+                      for name in THROUGHPUT_COUNTERS if values["counters"].get(name))
+    event(f"Stages: {stages or 'none'}" + (f", throughput: {rates}" if rates else ""), **values)
+
+
+def report_progress(interval):
+    last = None
+    while not stopping.wait(interval):
+        with lock:
+            current = {name: counters[name] for name in THROUGHPUT_COUNTERS}
+        if last is not None and current != last:
+            rates = {name: (current[name] - last[name]) / interval for name in THROUGHPUT_COUNTERS}
+            event("Progress: " + ", ".join(f"{current[name]} {name.replace('_', ' ')} ({rates[name]:.1f}/s)" for name in THROUGHPUT_COUNTERS),
+                  **current, **{f"{name}_per_second": rate for name, rate in rates.items()})
+        last = current
+
+
+def metric_name(name):
+    return METRIC_PREFIX + "_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def render_prometheus():
+    """
+    Returns every value in the Prometheus text format.
+    """
+    values = summary()
+    lines = []
+    for name, value in sorted(values["counters"].items()):
+        lines += [f"# TYPE {metric_name(name)}_total counter", f"{metric_name(name)}_total {value}"]
+
+    with lock:
+        current_gauges = sorted(gauges.items())
+    typed = set()
+    for (name, labels), value in current_gauges:
+        if value is None:
+            continue
+        if name not in typed:
+            lines.append(f"# TYPE {metric_name(name)} gauge")
+            typed.add(name)
+        lines.append(f"{metric_name(name)}{{{label_text(labels)}}} {value}" if labels else f"{metric_name(name)} {value}")
+
+    if values["timers"]:
+        lines += [f"# TYPE {METRIC_PREFIX}_stage_seconds_total counter", f"# TYPE {METRIC_PREFIX}_stage_runs_total counter"]
+        for stage, timer in sorted(values["timers"].items()):
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_total{{stage="{stage}"}} {timer["seconds"]}')
+            lines.append(f'{METRIC_PREFIX}_stage_runs_total{{stage="{stage}"}} {timer["runs"]}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({
+            "time": record.created,
+            "level": record.levelname.lower(),
+            "run": run_name,
+            "event": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }, default=str)
+
+# ------------------- Lifecycle -------------------
+
+def start(run=None, log_path=None, prometheus_port=None, progress_interval=None, console=True):
+    """
+    Starts the thread that writes the log, and optionally the progress reports and the Prometheus endpoint.
+    Only the first call does anything, until stop.
+
+    Parameters:
+    - run: The name of the script, in every JSON line.
+    - log_path: Where the JSON lines are appended, no JSON log when None.
+    - prometheus_port: Serve the values on http://127.0.0.1:<port>/metrics, no endpoint when None.
+    - progress_interval: Log the throughput every so many seconds, never when None.
+    - console: Print the messages of the events, like print did.
+    """
+    global listener, reporter, server, run_name, started, stop_at_exit
+    with start_lock:
+        if listener is not None:
+            return
+        handlers = []
+        if console:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setLevel(logging.INFO)
+            handlers.append(handler)
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            handler = logging.FileHandler(log_path)
+            handler.setFormatter(JSONFormatter())
+            handlers.append(handler)
+        # without a JSON log, debug events are dropped before they reach the queue
+        logger.setLevel(logging.DEBUG if log_path else logging.INFO)
+
+        records = queue.SimpleQueue()
+        logger.handlers = [logging.handlers.QueueHandler(records)]
+        listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        listener.start()
+        run_name = run
+        started = time.time()
+        stopping.clear()
+
+        if progress_interval:
+            reporter = threading.Thread(target=report_progress, args=(progress_interval,), daemon=True)
+            reporter.start()
+        if prometheus_port is not None:
+            server = ThreadingHTTPServer(("127.0.0.1", prometheus_port), MetricsHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        if not stop_at_exit:
+            atexit.register(stop)
+            stop_at_exit = True
+
+
+def stop():
+    """
+    Stops the background threads, after every queued log record was written.
+    """
+    global listener, reporter, server
+    with start_lock:
+        stopping.set()
+        if reporter is not None:
+            reporter.join()
+            reporter = None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            server = None
+        if listener is not None:
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+            listener = None
@@ -0,0 +1,61 @@
+import configparser
+import os
+import sys
+
+import pytest
+
+# the scripts import each other by module name, like when they are started from github/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import connections
+import harvester
+import benchmark
+
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    """
+    Points every script at an in-memory mongomock database instead of the one in config.ini.
+    """
+    mongomock = pytest.importorskip("mongomock")
+    db = mongomock.MongoClient().test
+    monkeypatch.setattr(connections, "get_db", lambda: db)
+    monkeypatch.setattr(connections, "uses_mongodb", lambda: True)
+    return db
+
+
+@pytest.fixture
+def local_db(tmp_path, monkeypatch):
+    """
+    Points every script at an empty local store, see local_store.py.
+    """
+    monkeypatch.setattr(connections, "config", configparser.ConfigParser())
+    monkeypatch.setattr(connections, "backend", None)
+    monkeypatch.setattr(connections, "local_db", None)
+    return connections.use_local_store(str(tmp_path / "test.sqlite"))
+
+
+@pytest.fixture
+def stub_api(monkeypatch):
+    """
+    Starts stub servers of the GitHub API, see benchmark.StubHandler, and sends the harvester's requests to the last one.
+    The response cache and the tokens of config.ini are not used, requests go out with a token pool of one test token.
+
+    Returns:
+    A function that starts a server with a handler class, and returns its base URL.
+    """
+    monkeypatch.setattr(connections, "config", configparser.ConfigParser())
+    monkeypatch.setattr(harvester, "rate_limiter", harvester.TokenPool("test", ["test-token"]))
+    servers = []
+
+    def start(handler):
+        server = benchmark.serve_stub_api(handler)
+        servers.append(server)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        monkeypatch.setattr(harvester, "API_URL", url)
+        return url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
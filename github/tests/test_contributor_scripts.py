@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta, timezone
+import random
+
+import pytest
+import contributor_scripts
+import metrics
+
+
+def add_pull_request(db, project, submitter, day):
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(days=day)
+    db.pull_requests.insert_one({"project": project, "submitter": submitter, "created_at": created,
+                                 "merged_at": created + timedelta(hours=1), "merge_seconds": 3600})
+
+
+def test_aggregate_matches_projects_by_exact_name(local_db):
+    # 'foo/bar.js' used to be cut at the dot, and the old regex matched 'foo/bar' inside 'foo/bar-utils'
+    for github_url in ["git+https://github.com/foo/bar.js.git", "git+https://github.com/foo/bar.git", "https://github.com/foo/bar-utils"]:
+        local_db.projects.insert_one({"github": github_url})
+    add_pull_request(local_db, "foo/bar.js", "alice", 0)
+    add_pull_request(local_db, "foo/bar.js", "alice", 2)
+    add_pull_request(local_db, "foo/bar", "bob", 1)
+
+    contributor_scripts.aggregate()
+
+    submitters = {project["github"]: project.get("submitters") for project in local_db.projects.find({})}
+    assert [(s["name"], s["contributions"]) for s in submitters["git+https://github.com/foo/bar.js.git"]] == [("alice", 2)]
+    assert [(s["name"], s["contributions"]) for s in submitters["git+https://github.com/foo/bar.git"]] == [("bob", 1)]
+    assert submitters["https://github.com/foo/bar-utils"] is None
+
+
+@pytest.fixture(params=["mongo_db", "local_db"])
+def db(request):
+    # the aggregation on MongoDB and its Python version on the local store
+    return request.getfixturevalue(request.param)
+
+
+def add_contributors(db):
+    for github_url, flag in [("git+https://github.com/foo/bar.git", True), ("https://github.com/foo/bar-utils", False), ("git+https://github.com/foo/new.git", False)]:
+        db.projects.insert_one({"github": github_url, "amount_of_pull_requests": 1, "README_documentation": flag})
+    # the groups start at their bound
+    for login, count in [("a", 9), ("b", 10), ("c", 49), ("d", 50)]:
+        db.contributors.insert_one({"project": "foo/bar", "login": login, "count": count})
+    db.contributors.insert_one({"project": "foo/bar-utils", "login": "a", "count": 1})
+
+
+def test_contributor_groups_come_from_the_contributors_collection(db):
+    add_contributors(db)
+
+    assert contributor_scripts.contributor_groups(db) == {
+        "git+https://github.com/foo/bar.git": [1, 2, 1],
+        "https://github.com/foo/bar-utils": [1, 0, 0],
+    }
+
+
+def test_metrics_count_the_contributor_groups(local_db):
+    add_contributors(local_db)
+
+    frames = metrics.frames_from_documents(local_db.projects.find({}), contributor_scripts.contributor_groups(local_db))
+    computed = metrics.compute_metrics(*frames)
+
+    assert computed["flags"]["README_documentation"]["yes"]["contributor_groups"] == [1, 2, 1]
+    # projects without contributors count as none
+    assert computed["flags"]["README_documentation"]["no"]["contributor_groups"] == [1, 0, 0]
+
+
+def test_snapshot_has_the_same_metrics(local_db, tmp_path):
+    add_contributors(local_db)
+    snapshot = pytest.importorskip("snapshot")
+
+    snapshot.export_snapshot(str(tmp_path))
+
+    frames = metrics.frames_from_documents(local_db.projects.find({}), contributor_scripts.contributor_groups(local_db))
+    assert metrics.compute_metrics(*metrics.frames_from_snapshot(snapshot.load_snapshot(str(tmp_path)))) == metrics.compute_metrics(*frames)
+
+
+def test_projects_without_contributors_are_counted_from_their_reviewers(db):
+    add_contributors(db)
+    reviewers = [{"name": name, "contributions": contributions} for name, contributions in [("a", 1), ("b", 10), ("c", 50), ("d", 70)]]
+    db.projects.insert_one({"github": "git+https://github.com/foo/exported.git", "reviewers": reviewers})
+    # the contributors collection wins over the embedded reviewers
+    db.projects.update_one({"github": "git+https://github.com/foo/bar.git"}, {"$set": {"reviewers": reviewers}})
+
+    groups = contributor_scripts.contributor_groups(db)
+
+    assert groups["git+https://github.com/foo/exported.git"] == [1, 1, 2]
+    assert groups["git+https://github.com/foo/bar.git"] == [1, 2, 1]
+
+
+def test_contributors_of_projects_stored_before_the_collection_are_computed(local_db):
+    for project in ["foo/old", "foo/new"]:
+        local_db.projects.insert_one({"github": f"git+https://github.com/{project}.git"})
+    add_pull_request(local_db, "foo/old", "alice", 0)
+    add_pull_request(local_db, "foo/old", "alice", 1)
+    # the harvester recorded the contributors of the new project only
+    add_pull_request(local_db, "foo/new", "bob", 2)
+    local_db.contributors.insert_one({"project": "foo/new", "login": "bob", "count": 1,
+                                      "first_pull_request": datetime(2024, 1, 3), "last_pull_request": datetime(2024, 1, 3)})
+
+    contributor_scripts.aggregate()
+
+    submitters = {project["github"]: project["submitters"] for project in local_db.projects.find({})}
+    assert [(s["name"], s["contributions"]) for s in submitters["git+https://github.com/foo/old.git"]] == [("alice", 2)]
+    assert [(s["name"], s["contributions"]) for s in submitters["git+https://github.com/foo/new.git"]] == [("bob", 1)]
+
+
+def loop_contributors_gained(pull_requests, inclusive=True):
+    """
+    The loop get_contributors_gained used to run, one pass over the pull requests per period.
+    It left out pull requests exactly on the edge of a period, with inclusive periods include their start
+    and the last one also its end, like gained_per_period.
+    """
+    start = min(pr["created_at"] for pr in pull_requests)
+    end = max(pr["created_at"] for pr in pull_requests)
+    period_duration = (end - start).total_seconds() / contributor_scripts.PERIODS
+    periods = []
+    contributor_names = []
+    for i in range(contributor_scripts.PERIODS):
+        period_start = start + timedelta(seconds=i * period_duration)
+        period_end = start + timedelta(seconds=(i + 1) * period_duration)
+        period_contributor_count = 0
+        for pr in pull_requests:
+            if inclusive:
+                in_period = period_start <= pr["created_at"] < period_end or (i == contributor_scripts.PERIODS - 1 and pr["created_at"] == end)
+            else:
+                in_period = period_start < pr["created_at"] < period_end
+            if in_period and pr["submitter"] not in contributor_names:
+                contributor_names.append(pr["submitter"])
+                period_contributor_count += 1
+        periods.append({"start": period_start.strftime(contributor_scripts.DATE_FORMAT),
+                        "end": period_end.strftime(contributor_scripts.DATE_FORMAT),
+                        "count": period_contributor_count})
+    return periods
+
+
+def gained(db):
+    db.projects.insert_one({"github": "git+https://github.com/foo/bar.git"})
+    contributor_scripts.get_contributors_gained()
+    return db.projects.find_one({})["periods"]
+
+
+def test_contributors_gained_match_the_loop(local_db):
+    rng = random.Random(0)
+    start = datetime(2024, 1, 1)
+    # 100 days, so the edges of the 10 periods fall on whole seconds like the dates
+    seconds = [0, 100 * 86400] + [rng.randrange(100 * 86400) for _ in range(500)]
+    pull_requests = [{"project": "foo/bar", "submitter": f"user{rng.randrange(60)}", "created_at": start + timedelta(seconds=s),
+                      "merged_at": start + timedelta(seconds=s + 3600), "merge_seconds": 3600} for s in seconds]
+    local_db.pull_requests.insert_many(pull_requests)
+
+    periods = gained(local_db)
+
+    assert periods == loop_contributors_gained(pull_requests)
+    assert sum(period["count"] for period in periods) == len({pr["submitter"] for pr in pull_requests})
+
+
+def test_contributors_on_the_edge_of_a_period_are_counted(local_db):
+    for submitter, day in [("alice", 0), ("alice", 35), ("bob", 10), ("carol", 50), ("dave", 100)]:
+        add_pull_request(local_db, "foo/bar", submitter, day)
+    pull_requests = list(local_db.pull_requests.find({}))
+
+    periods = gained(local_db)
+
+    # the start and the end of the project, and the start of the second and the sixth period
+    assert [period["count"] for period in periods] == [1, 1, 0, 0, 0, 1, 0, 0, 0, 1]
+    assert periods == loop_contributors_gained(pull_requests)
+    # the loop only counted alice, at her second pull request
+    assert [period["count"] for period in loop_contributors_gained(pull_requests, inclusive=False)] == [0, 0, 0, 1, 0, 0, 0, 0, 0, 0]
@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import tarfile
+
+import pytest
+import doc_scanner
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "tarballs")
+URL = "git+https://github.com/owner/repo.git"
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("var a = 1;\n\nvar b = 2;\n", (2, 0)),
+    ("/**\n * Adds.\n */\nfunction add() {}\n", (4, 3)),
+    ("return a + b; // the sum\n", (1, 1)),
+    # comment markers inside strings
+    ("var url = 'http://example.org';\nvar glob = \"src/*.js\";\n", (2, 0)),
+    # inside regular expressions, also in a character class, where the / does not end the expression
+    ("var a = /\\/\\/x/;\nvar b = /[/*]+/g;\nvar c = 1;\n", (3, 0)),
+    ("if (/^\\/\\//.test(line)) {}\n", (1, 0)),
+    # a / after a value is a division, the // after it is a comment
+    ("var half = a / b / 2; // rounded later\n", (1, 1)),
+    # template literals span lines and can hold anything
+    ("var t = `one\n// two\n/* three`;\nf(); // four\n", (4, 1)),
+    ("var t = `${a}//${b}`;\n", (1, 0)),
+])
+def test_count_comment_lines(source, expected):
+    assert doc_scanner.count_comment_lines(source) == expected
+
+
+def test_scan_tarball_skips_dependencies_and_build_output():
+    scan = doc_scanner.scan_tarball(os.path.join(FIXTURES, "owner_repo.tar.gz"))
+
+    # src/index.js and lib/plain.ts, the comments in node_modules and dist are not counted
+    assert scan == {"files": 2, "lines": 15, "comment_lines": 4, "readme_bytes": 394, "homepage": "https://repo.example.org"}
+
+
+@pytest.fixture
+def fixtures(tmp_path, local_db):
+    """
+    Copies the fixture tarballs to a directory that the tests can change, and adds a project for them.
+    """
+    shutil.copytree(FIXTURES, tmp_path / "tarballs")
+    local_db.projects.insert_one({"github": URL})
+    return str(tmp_path / "tarballs")
+
+
+def scan(fixtures):
+    return doc_scanner.scan_projects([URL], fixtures, workers=1)
+
+
+def test_scan_projects_from_fixtures(local_db, fixtures):
+    flags = {"README_documentation": True, "comments_in_code": True, "website_linked": True, "wiki_present": False}
+
+    assert scan(fixtures) == {URL: flags}
+
+    sha = doc_scanner.file_sha(os.path.join(fixtures, "owner_repo.tar.gz"))
+    project = local_db.projects.find_one({"github": URL}, {"_id": 0})
+    assert project == {"github": URL, **flags, "documentation_sha": sha}
+    assert local_db.doc_scans.find_one({"_id": f"owner/repo@{sha}"})["comment_lines"] == 4
+
+
+def test_scan_projects_reuses_the_scan_of_a_commit(local_db, fixtures):
+    scan(fixtures)
+    scanned_at = local_db.doc_scans.find_one()["scanned_at"]
+    # the same commit, an empty tarball would have no comments if it was scanned again
+    sha = doc_scanner.file_sha(os.path.join(fixtures, "owner_repo.tar.gz"))
+    with open(os.path.join(fixtures, "metadata.json"), "w") as file:
+        json.dump({"owner/repo": {"sha": sha, "has_wiki": True}}, file)
+    with tarfile.open(os.path.join(fixtures, "owner_repo.tar.gz"), "w:gz"):
+        pass
+
+    flags = scan(fixtures)[URL]
+
+    assert flags["comments_in_code"] and flags["wiki_present"]
+    assert local_db.doc_scans.count_documents({}) == 1
+    assert local_db.doc_scans.find_one()["scanned_at"] == scanned_at
+
+
+def test_scan_projects_scans_a_new_commit(local_db, fixtures):
+    scan(fixtures)
+    # the same repository without any comments, as a new commit
+    os.remove(os.path.join(fixtures, "owner_repo.tar.gz"))
+    with tarfile.open(os.path.join(FIXTURES, "owner_repo.tar.gz")) as original, \
+            tarfile.open(os.path.join(fixtures, "owner_repo.tar.gz"), "w:gz") as changed:
+        for member in original:
+            if not member.name.endswith("index.js"):
+                changed.addfile(member, original.extractfile(member) if member.isfile() else None)
+
+    assert not scan(fixtures)[URL]["comments_in_code"]
+    assert local_db.doc_scans.count_documents({}) == 2
@@ -0,0 +1,227 @@
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+import numpy as np
+import benchmark
+import github
+import harvester
+import local_store
+import synthetic
+
+PROJECT = "owner/repo"
+URL = f"git+https://github.com/{PROJECT}.git"
+
+
+def serve_repository(stub_api, amount=250):
+    pull_requests = synthetic.generate_pull_requests(np.random.default_rng(0), PROJECT, amount)
+    stub_api(type("Handler", (benchmark.StubHandler,), {"pages": {PROJECT: benchmark.encode_pages(pull_requests)}}))
+
+
+def add_candidate(db):
+    db.npm.insert_one({"github": URL, "downloads": {"downloads": github.MIN_DOWNLOADS + 1}, "pkg": {"time": {"modified": "2024-01-01"}}})
+
+
+def stored_counts(db):
+    return (db.pull_requests.count_documents({}),
+            db.projects.count_documents({}),
+            sum(contributor["count"] for contributor in db.contributors.find({})))
+
+
+def test_find_and_harvest_good_repos_stores_nothing_twice(local_db, stub_api):
+    serve_repository(stub_api)
+    add_candidate(local_db)
+
+    assert github.find_and_harvest_good_repos() == [URL]
+    assert stored_counts(local_db) == (250, 1, 250)
+    local_db.projects.update_one({"github": URL}, {"$set": {"amount_of_pull_requests": 250}})
+
+    github.reset_candidate_cursor()
+    assert github.find_and_harvest_good_repos() == [URL]
+    assert stored_counts(local_db) == (250, 1, 250)
+    # what was computed for the project is kept
+    assert local_db.projects.find_one({"github": URL})["amount_of_pull_requests"] == 250
+
+
+def test_find_and_harvest_good_repos_after_a_sync(local_db, stub_api):
+    serve_repository(stub_api)
+    add_candidate(local_db)
+    github.store_projects([URL])
+
+    github.push_pull_requests_to_mongodb([URL])
+    assert github.find_and_harvest_good_repos() == [URL]
+    assert stored_counts(local_db) == (250, 1, 250)
+
+
+def test_owner_and_repo_keep_dots_in_the_name():
+    assert github.get_owner_and_repo("git+https://github.com/element-plus/element-plus.git") == ("element-plus", "element-plus")
+    assert github.get_owner_and_repo("git+https://github.com/foo/bar.js.git") == ("foo", "bar.js")
+    assert github.get_owner_and_repo("https://github.com/foo/bar.js#main") == ("foo", "bar.js")
+    assert github.get_owner_and_repo("git+ssh://git@github.com/foo/bar.git") == ("foo", "bar")
+    assert github.get_owner_and_repo("git@github.com:foo/bar.git") == ("foo", "bar")
+
+
+@pytest.fixture(params=["mongo_db", "local_db"])
+def db(request):
+    # the aggregation on MongoDB and its Python version on the local store
+    return request.getfixturevalue(request.param)
+
+
+def test_candidate_cursor_only_moves_when_a_batch_is_done(db):
+    urls = [f"git+https://github.com/owner/repo{i:02}.git" for i in range(25)]
+    for i, url in enumerate(urls):
+        # packages of the same repository, a package that is published again, and one out of the download range
+        db.npm.insert_many([
+            {"github": url, "downloads": {"downloads": github.MIN_DOWNLOADS + i + 1}, "pkg": {"time": {"modified": f"2024-01-{i % 28 + 1:02}"}}},
+            {"github": url, "downloads": {"downloads": github.MIN_DOWNLOADS + 1}, "pkg": {"time": {"modified": "2020-01-01"}}},
+        ])
+    db.npm.insert_one({"github": "git+https://github.com/owner/big.git", "downloads": {"downloads": github.MAX_DOWNLOADS + 1}})
+
+    first = github.fetch_github_urls(10)
+    assert first == urls[:10]
+    # an interrupted run gets the same batch again
+    db.npm.update_many({"github": urls[3]}, {"$set": {"pkg.time.modified": "2025-01-01"}})
+    assert github.fetch_github_urls(10) == first
+
+    github.advance_candidate_cursor(first)
+    assert github.fetch_github_urls(10) == urls[10:20]
+    github.advance_candidate_cursor(urls[10:20])
+    github.advance_candidate_cursor(github.fetch_github_urls(10))
+    assert github.fetch_github_urls(10) == []
+
+    github.reset_candidate_cursor()
+    assert github.fetch_github_urls(10) == first
+
+
+def test_deleting_a_project_deletes_its_records(local_db):
+    for project in ["foo/bar", "foo/bar.js"]:
+        local_db.projects.insert_one({"github": f"git+https://github.com/{project}.git"})
+        local_db.pull_requests.insert_one({"project": project, "number": 1})
+        local_db.contributors.insert_one({"project": project, "login": "alice", "count": 1})
+
+    github.delete_records_for_projects(["foo/bar"])
+
+    assert [document["github"] for document in local_db.projects.find({})] == ["git+https://github.com/foo/bar.js.git"]
+    assert [document["project"] for document in local_db.pull_requests.find({})] == ["foo/bar.js"]
+    assert [document["project"] for document in local_db.contributors.find({})] == ["foo/bar.js"]
+
+
+def test_a_batch_only_reads_its_own_candidates(local_db, monkeypatch):
+    urls = [f"git+https://github.com/owner/repo{i:03}.git" for i in range(300)]
+    local_db.npm.insert_many([{"github": url, "downloads": {"downloads": github.MIN_DOWNLOADS + 1}} for url in urls])
+    github.advance_candidate_cursor(urls[:200])
+    read = []
+    scan = local_store.LocalCollection.scan
+
+    def counting_scan(self, query, sort_keys=()):
+        for document in scan(self, query, sort_keys):
+            if self.name == "npm":
+                read.append(document["github"])
+            yield document
+
+    monkeypatch.setattr(local_store.LocalCollection, "scan", counting_scan)
+
+    assert github.fetch_github_urls(10) == urls[200:210]
+    # the candidates after the cursor, and one more to see that the batch is full
+    assert read == urls[200:211]
+
+
+class FlakyHandler(benchmark.StubHandler):
+    """
+    Answers owner/repo2 with 500, and repositories without pages with 404 like deleted ones.
+    """
+
+    def do_GET(self):
+        if "/owner/repo2/" not in self.path:
+            return super().do_GET()
+        self.send_response(500)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def test_cursor_stops_at_the_first_repository_that_failed(local_db, stub_api, monkeypatch):
+    monkeypatch.setattr(harvester, "MAX_RETRIES", 0)
+    rng = np.random.default_rng(0)
+    # repo1 is gone for good, repo2 fails for now
+    pages = {f"owner/repo{i}": benchmark.encode_pages(synthetic.generate_pull_requests(rng, f"owner/repo{i}", 250)) for i in [0, 3]}
+    stub_api(type("Handler", (FlakyHandler,), {"pages": pages}))
+    urls = [f"git+https://github.com/owner/repo{i}.git" for i in range(4)]
+    for url in urls:
+        local_db.npm.insert_one({"github": url, "downloads": {"downloads": github.MIN_DOWNLOADS + 1}})
+
+    assert github.find_and_harvest_good_repos() == [urls[0], urls[3]]
+    assert github.fetch_github_urls() == urls[2:]
+
+    github.find_good_repos()
+    assert github.fetch_github_urls() == urls[2:]
+
+
+def test_documents_without_a_number_are_replaced(local_db, stub_api):
+    serve_repository(stub_api)
+    add_candidate(local_db)
+    local_db.pull_requests.insert_many([{"project": PROJECT, "title": f"harvested before numbers were stored {i}"} for i in range(250)])
+
+    assert github.find_and_harvest_good_repos() == [URL]
+    assert stored_counts(local_db) == (250, 1, 250)
+    assert local_db.pull_requests.count_documents({"number": {"$exists": False}}) == 0
+
+
+class ETagHandler(benchmark.StubHandler):
+    """
+    Serves the pages of PROJECT with an ETag and answers 304 when If-None-Match has it, like the REST API does.
+    Records the page and status of every request, subclasses set pages and requested.
+    """
+    lock = threading.Lock()
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        pages = self.pages[PROJECT]
+        page = int(dict(parse_qsl(parts.query)).get("page", 1))
+        body = pages[page - 1] if page <= len(pages) else b"[]"
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        status = 304 if self.headers.get("If-None-Match") == etag else 200
+        with self.lock:
+            self.requested.append((page, status))
+
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Link", f'<http://{self.headers["Host"]}{parts.path}?page={len(pages)}>; rel="last"')
+        if status == 304:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_sync_stops_at_the_first_unchanged_page(local_db, stub_api):
+    pull_requests = synthetic.generate_pull_requests(np.random.default_rng(0), PROJECT, 251)
+    # the last one is new, it was updated after all the others
+    pull_requests[-1]["merged_at"] = max(pr["merged_at"] for pr in pull_requests) + timedelta(days=1)
+    handler = type("Handler", (ETagHandler,), {"pages": {PROJECT: benchmark.encode_pages(pull_requests[:250])}, "requested": []})
+    stub_api(handler)
+
+    def sync():
+        handler.requested.clear()
+        with ThreadPoolExecutor(max_workers=4) as page_pool:
+            return github.sync_pull_requests(URL, page_pool)
+
+    # cold: every page
+    assert sync() == 250
+    assert sorted(handler.requested) == [(1, 200), (2, 200), (3, 200)]
+    assert local_db.pull_requests.count_documents({}) == 250
+
+    # warm: nothing changed, the first page is not modified and nothing else is requested
+    assert sync() == 0
+    assert handler.requested == [(1, 304)]
+
+    # the new pull request changes the first page, which is enough to find it
+    handler.pages[PROJECT] = benchmark.encode_pages(pull_requests)
+    assert sync() >= 1
+    assert handler.requested == [(1, 200)]
+    assert local_db.pull_requests.count_documents({}) == 251
+    assert local_db.pull_requests.find_one({"number": 251})["title"] == "Pull request 251"
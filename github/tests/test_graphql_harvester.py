@@ -0,0 +1,82 @@
+import json
+import os
+from datetime import datetime, timezone
+
+import pytest
+import benchmark
+import github
+import graphql_harvester
+import harvester
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PROJECTS = ["octo/alpha", "octo/beta", "octo/gone"]
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as file:
+        return json.load(file)
+
+
+class ReplayHandler(benchmark.StubHandler):
+    """
+    Answers GraphQL queries with the recorded response of the exchange with the same variables,
+    and the REST API with the recorded pages, see tests/fixtures.
+    """
+    pages = {project: [json.dumps(page).encode() for page in pages] for project, pages in load_fixture("rest_pages.json").items()}
+    exchanges = load_fixture("graphql_exchanges.json")
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        responses = [exchange["response"] for exchange in self.exchanges if exchange["variables"] == request["variables"]]
+        body = json.dumps(responses[0]).encode() if responses else b'{"message": "no recorded exchange"}'
+        self.send_response(200 if responses else 400)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def replay_api(stub_api, monkeypatch):
+    monkeypatch.setattr(graphql_harvester, "rate_limiter", harvester.TokenPool("test GraphQL", ["test-token"]))
+    stub_api(ReplayHandler)
+
+
+def harvest_graphql():
+    stored = []
+    graphql_harvester.harvest(PROJECTS, lambda project, pull_requests: stored.extend(pull_requests))
+    return {(pr["project"], pr["number"]): pr for pr in stored}
+
+
+def harvest_rest():
+    urls = [f"git+https://github.com/{project}.git" for project in PROJECTS]
+    results = harvester.harvest(urls, github.get_pull_requests_url, github.parse_pull_requests)
+    return {(pr["project"], pr["number"]): pr for pull_requests in results.values() for pr in pull_requests}
+
+
+def test_graphql_documents_match_the_rest_documents(replay_api):
+    graphql = harvest_graphql()
+    rest = harvest_rest()
+
+    # merged pull requests by humans only, of both pages of alpha, and nothing of the repository that is gone
+    assert sorted(graphql) == [("octo/alpha", 1), ("octo/alpha", 2), ("octo/alpha", 4), ("octo/beta", 1), ("octo/beta", 2)]
+    assert sorted(rest) == sorted(graphql)
+    for key, pr in graphql.items():
+        assert {field: value for field, value in pr.items() if field not in ("reviews", "first_review_at")} == rest[key]
+
+
+def test_graphql_documents_have_the_submitted_reviews(replay_api):
+    graphql = harvest_graphql()
+
+    def date(text):
+        return datetime.fromisoformat(text).replace(tzinfo=timezone.utc)
+
+    # the review of the submitter on their own pull request doesn't count as the first review
+    assert graphql[("octo/alpha", 1)]["first_review_at"] == date("2023-01-03T08:00:00")
+    assert [review["reviewer"] for review in graphql[("octo/alpha", 1)]["reviews"]] == ["alice", "bob"]
+    # pending reviews are left out, deleted accounts are 'ghost'
+    assert graphql[("octo/alpha", 2)]["reviews"] == [{"reviewer": "ghost", "state": "COMMENTED", "submitted_at": date("2023-01-04T15:10:00")}]
+    assert graphql[("octo/alpha", 4)]["first_review_at"] is None
+    assert graphql[("octo/beta", 1)]["submitter"] == "ghost"
+    assert graphql[("octo/beta", 2)]["first_review_at"] == date("2022-12-25T10:00:00")
+    assert graphql[("octo/beta", 2)]["merge_seconds"] == 9 * 86400 - 9 * 3600
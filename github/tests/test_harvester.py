@@ -0,0 +1,375 @@
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+import pytest
+import requests
+import benchmark
+import github
+import harvester
+import synthetic
+import telemetry
+
+
+def repository_pages(project, amount, seed=0):
+    pull_requests = synthetic.generate_pull_requests(np.random.default_rng(seed), project, amount)
+    return benchmark.encode_pages(pull_requests)
+
+
+def expected_pull_requests(url, pages):
+    return github.parse_pull_requests(url, [json.loads(page) for page in pages])
+
+
+class RecordingHandler(benchmark.StubHandler):
+    """
+    Records every requested path and how many requests were answered at the same time.
+    Subclasses set pages, requested and state.
+    """
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.requested.append(self.path)
+            self.state["active"] += 1
+            self.state["most_active"] = max(self.state["most_active"], self.state["active"])
+        try:
+            # slow enough that parallel requests overlap
+            time.sleep(0.05)
+            super().do_GET()
+        finally:
+            with self.lock:
+                self.state["active"] -= 1
+
+
+def recording_handler(pages, base=RecordingHandler, **attributes):
+    return type("Handler", (base,), {"pages": pages, "requested": [], "state": {"active": 0, "most_active": 0}, **attributes})
+
+
+def test_pages_are_fetched_in_parallel_and_kept_in_order(stub_api):
+    pages = {f"owner/repo{i}": repository_pages(f"owner/repo{i}", 450, seed=i) for i in range(3)}
+    handler = recording_handler(pages)
+    stub_api(handler)
+    urls = [f"git+https://github.com/{project}.git" for project in pages]
+
+    results = harvester.harvest(urls, github.get_pull_requests_url, github.parse_pull_requests)
+
+    assert results == {url: expected_pull_requests(url, pages[project]) for url, project in zip(urls, pages)}
+    # every page once, the first page of a repository tells how many there are
+    assert len(handler.requested) == sum(len(repository) for repository in pages.values())
+    assert len(set(handler.requested)) == len(handler.requested)
+    assert handler.state["most_active"] > 1
+
+
+def test_consumer_that_stops_early_skips_the_remaining_pages(stub_api):
+    pages = {"owner/repo": repository_pages("owner/repo", 2000)}
+    handler = recording_handler(pages)
+    stub_api(handler)
+    url = "git+https://github.com/owner/repo.git"
+
+    def first_page(repo_url, pages):
+        return next(pages)
+
+    results = harvester.harvest([url], github.get_pull_requests_url, first_page)
+
+    assert results[url] == json.loads(pages["owner/repo"][0])
+    # the first page and at most a window of pages ahead
+    assert len(handler.requested) <= 1 + harvester.PAGE_WINDOW
+    assert len(handler.requested) < len(pages["owner/repo"])
+
+
+class ThrottlingHandler(RecordingHandler):
+    """
+    Answers the first request with a rate limit that is almost used up, and resets it at state['reset'].
+    """
+
+    def do_GET(self):
+        with self.lock:
+            self.state["response"] = self.state.get("response", 0) + 1
+        super().do_GET()
+
+    def send_header(self, keyword, value):
+        if self.state["response"] == 1 and keyword == "X-RateLimit-Remaining":
+            value = str(harvester.RATE_LIMIT_RESERVE - 1)
+        if self.state["response"] == 1 and keyword == "X-RateLimit-Reset":
+            value = str(self.state["reset"])
+        super().send_header(keyword, value)
+
+
+def test_harvest_waits_for_the_rate_limit_reset(stub_api):
+    pages = {"owner/repo": repository_pages("owner/repo", 450)}
+    # whole seconds, so at least one second later even when the first response is slow
+    reset = int(time.time()) + 2
+    handler = recording_handler(pages, ThrottlingHandler)
+    handler.state["reset"] = reset
+    stub_api(handler)
+    url = "git+https://github.com/owner/repo.git"
+    waits = telemetry.summary()["timers"].get("rate_limit_wait", {}).get("runs", 0)
+
+    results = harvester.harvest([url], github.get_pull_requests_url, github.parse_pull_requests)
+
+    assert results[url] == expected_pull_requests(url, pages["owner/repo"])
+    assert telemetry.summary()["timers"]["rate_limit_wait"]["runs"] > waits
+    # no page but the first one was sent before the reset
+    assert len(handler.requested) == len(pages["owner/repo"])
+
+
+class ExhaustedHandler(RecordingHandler):
+    """
+    Answers the first request with 403 and an exhausted rate limit, like GitHub does, and the rest normally.
+    """
+
+    def do_GET(self):
+        with self.lock:
+            first = not self.requested
+            self.requested.append(self.path)
+        if not first:
+            return benchmark.StubHandler.do_GET(self)
+        body = b'{"message": "API rate limit exceeded"}'
+        self.send_response(403)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-RateLimit-Remaining", "0")
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 1))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_exhausted_rate_limit_is_waited_for_instead_of_failing(stub_api):
+    pages = {"owner/repo": repository_pages("owner/repo", 250)}
+    handler = recording_handler(pages, ExhaustedHandler)
+    stub_api(handler)
+    url = "git+https://github.com/owner/repo.git"
+
+    results = harvester.harvest([url], github.get_pull_requests_url, github.parse_pull_requests)
+
+    assert results[url] == expected_pull_requests(url, pages["owner/repo"])
+    # the first page twice, once rate limited
+    assert len(handler.requested) == len(pages["owner/repo"]) + 1
+    assert harvester.rate_limiter.metrics()[0]["requests"] == len(handler.requested)
+
+
+class RateLimitHandler(benchmark.StubHandler):
+    """
+    A fake API that keeps a rate limit per token, and answers the first request of the tokens in
+    secondary_limited with a secondary rate limit. Subclasses set tokens and secondary_limited.
+    """
+    lock = threading.Lock()
+
+    def do_GET(self):
+        token = self.headers["Authorization"].split()[-1]
+        with self.lock:
+            state = self.tokens[token]
+            state["requests"] += 1
+            secondary = token in self.secondary_limited and state["requests"] == 1
+            if not secondary:
+                state["remaining"] -= 1
+            remaining = state["remaining"]
+        body = b'{"message": "You have exceeded a secondary rate limit."}' if secondary else b"[]"
+        self.send_response(403 if secondary else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-RateLimit-Limit", "5000")
+        self.send_header("X-RateLimit-Remaining", str(remaining))
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        if secondary:
+            self.send_header("Retry-After", "60")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def rate_limit_api(stub_api, monkeypatch, remaining, secondary_limited=()):
+    tokens = {token: {"remaining": amount, "requests": 0} for token, amount in remaining.items()}
+    stub_api(type("Handler", (RateLimitHandler,), {"tokens": tokens, "secondary_limited": set(secondary_limited)}))
+    pool = harvester.TokenPool("test", list(remaining))
+    monkeypatch.setattr(harvester, "rate_limiter", pool)
+    return tokens, pool
+
+
+def fetch(times):
+    return [harvester.fetch_page(f"{harvester.API_URL}/repos/owner/repo/pulls").status_code for _ in range(times)]
+
+
+def test_requests_go_to_the_token_with_the_most_remaining(stub_api, monkeypatch):
+    tokens, pool = rate_limit_api(stub_api, monkeypatch, {"low": 100, "high": 4000})
+
+    assert fetch(20) == [200] * 20
+    # the first request of every token tells how much it has left
+    assert tokens["low"]["requests"] == 1
+    assert tokens["high"]["requests"] == 19
+
+
+def test_exhausted_tokens_are_parked_until_their_reset(stub_api, monkeypatch):
+    tokens, pool = rate_limit_api(stub_api, monkeypatch, {"exhausted": harvester.RATE_LIMIT_RESERVE + 1, "fresh": 4000})
+
+    assert fetch(10) == [200] * 10
+    assert tokens["exhausted"]["requests"] == 1
+    assert tokens["fresh"]["requests"] == 9
+
+
+def test_secondary_rate_limit_parks_the_token_for_its_retry_after(stub_api, monkeypatch):
+    tokens, pool = rate_limit_api(stub_api, monkeypatch, {"limited": 4000, "other": 3000}, secondary_limited=["limited"])
+
+    assert fetch(5) == [200] * 5
+    # the rate limited request was sent again with the other token, which is used until the first one comes back
+    assert tokens["limited"]["requests"] == 1
+    assert tokens["other"]["requests"] == 5
+    metrics = {metric["token"]: metric for metric in pool.metrics()}
+    assert metrics["...ited"]["rate_limited"] == 1
+    assert pool.states[0].parked_until > time.time() + 50
+
+
+def test_token_metrics(stub_api, monkeypatch):
+    tokens, pool = rate_limit_api(stub_api, monkeypatch, {"token-one": 1001})
+
+    fetch(1)
+
+    assert pool.metrics() == [{"token": "...-one", "requests": 1, "rate_limited": 0, "remaining": 1000,
+                               "limit": 5000, "reset": pool.states[0].reset, "utilisation": 0.8}]
+
+
+SECONDARY_RATE_LIMIT_BODY = json.dumps({
+    "message": "You have exceeded a secondary rate limit. Please wait a few minutes before you try again.",
+    "documentation_url": "https://docs.github.com/rest/overview/rate-limits-for-the-rest-api#about-secondary-rate-limits",
+}).encode()
+
+
+class FaultHandler(benchmark.StubHandler):
+    """
+    Answers requests with the next of its faults until they run out, and normally after that: a status code,
+    'drop' to close the connection without an answer, or 'secondary' for a secondary rate limit without Retry-After.
+    Requests to /loop are redirected to themselves. Subclasses set faults and requested.
+    """
+    pages = {"owner/repo": [b"[]"]}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        if self.path == "/loop":
+            self.send_response(302)
+            self.send_header("Location", "/loop")
+            self.end_headers()
+            return
+        with self.lock:
+            self.requested.append((time.time(), self.headers["Authorization"].split()[-1]))
+            fault = self.faults.pop(0) if self.faults else None
+        if fault is None:
+            return super().do_GET()
+        if fault == "drop":
+            return
+        body = SECONDARY_RATE_LIMIT_BODY if fault == "secondary" else b""
+        self.send_response(403 if fault == "secondary" else fault)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-RateLimit-Remaining", "4000")
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def fault_api(stub_api, monkeypatch):
+    """
+    Starts a FaultHandler with short backoffs and a circuit breaker of its own.
+
+    Returns:
+    A function that starts the server with faults, a breaker threshold and cooldown and tokens, and returns the handler.
+    """
+    monkeypatch.setattr(harvester, "BACKOFF_BASE", 0.01)
+
+    def start(faults, threshold=harvester.BREAKER_THRESHOLD, cooldown=harvester.BREAKER_COOLDOWN, tokens=("test-token",)):
+        handler = type("Handler", (FaultHandler,), {"faults": list(faults), "requested": []})
+        host = urlsplit(stub_api(handler)).netloc
+        monkeypatch.setitem(harvester.circuit_breakers, host, harvester.CircuitBreaker(host, threshold, cooldown))
+        monkeypatch.setattr(harvester, "rate_limiter", harvester.TokenPool("test", list(tokens)))
+        return handler
+
+    return start
+
+
+def counter(name):
+    return telemetry.summary()["counters"].get(name, 0)
+
+
+def send():
+    return harvester.send("GET", f"{harvester.API_URL}/repos/owner/repo/pulls")
+
+
+def test_server_errors_and_dropped_connections_are_retried(fault_api):
+    handler = fault_api([502, "drop", 503])
+    retries = counter("http_retries")
+
+    assert send().status_code == 200
+    assert len(handler.requested) == 4
+    assert counter("http_retries") - retries == 3
+
+
+def test_unavailable_repositories_are_not_retried(fault_api):
+    for status in harvester.UNAVAILABLE_STATUSES:
+        handler = fault_api([status])
+        retries = counter("http_retries")
+
+        assert send().status_code == status
+        assert len(handler.requested) == 1
+        assert counter("http_retries") == retries
+
+
+def test_persistent_server_errors_are_given_up(fault_api, monkeypatch):
+    monkeypatch.setattr(harvester, "MAX_RETRIES", 2)
+    handler = fault_api([503] * 10)
+
+    assert send().status_code == 503
+    assert len(handler.requested) == 3
+
+
+def test_persistent_connection_errors_are_raised(fault_api, monkeypatch):
+    monkeypatch.setattr(harvester, "MAX_RETRIES", 1)
+    handler = fault_api(["drop"] * 10)
+
+    with pytest.raises(requests.ConnectionError):
+        send()
+    assert len(handler.requested) == 2
+
+
+def test_secondary_rate_limit_without_retry_after_parks_the_token(fault_api):
+    handler = fault_api(["secondary"], tokens=("token-one", "token-two"))
+    retries = counter("http_retries")
+
+    assert send().status_code == 200
+    # not an error, so not retried, but sent again with the other token
+    assert [token for _, token in handler.requested] == ["token-one", "token-two"]
+    assert counter("http_retries") == retries
+    first, second = harvester.rate_limiter.states
+    assert first.rate_limited == 1
+    assert first.parked_until > time.time() + harvester.SECONDARY_RATE_LIMIT_WAIT - 5
+    assert second.parked_until == 0
+
+
+def test_circuit_opens_after_failures_and_closes_after_a_successful_probe(fault_api):
+    handler = fault_api([502] * 4, threshold=3, cooldown=1)
+    opened = counter("circuit_opened")
+
+    assert send().status_code == 200
+
+    times = [requested for requested, _ in handler.requested]
+    assert len(times) == 5
+    # the third failure opens the circuit, the probe after the cooldown fails and opens it again
+    assert counter("circuit_opened") - opened == 2
+    assert times[3] - times[2] >= 1
+    assert times[4] - times[3] >= 1
+    assert harvester.get_circuit_breaker(harvester.API_URL).failures == 0
+
+
+def test_probe_that_fails_without_an_answer_from_the_host_lets_another_request_probe(fault_api, monkeypatch):
+    monkeypatch.setattr(harvester, "MAX_RETRIES", 0)
+    handler = fault_api([502], threshold=1, cooldown=0.1)
+
+    assert send().status_code == 502
+    # the probe is redirected until requests gives up, which is not a failure of the host
+    with pytest.raises(requests.TooManyRedirects):
+        harvester.send("GET", f"{harvester.API_URL}/loop")
+
+    # a probe that is never given up would keep this waiting forever
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(send()), daemon=True)
+    thread.start()
+    thread.join(10)
+    assert [response.status_code for response in responses] == [200]
+    assert len(handler.requested) == 2
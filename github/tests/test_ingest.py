@@ -0,0 +1,49 @@
+import io
+import json
+
+import pytest
+from bson import json_util
+import ingest
+import metrics
+
+
+def load_export():
+    with open(ingest.DEFAULT_FILE, encoding="utf-8") as file:
+        return json.load(file, object_hook=json_util.object_hook)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, ingest.CHUNK_SIZE])
+def test_streamed_array_matches_json_load(chunk_size):
+    with open(ingest.DEFAULT_FILE, encoding="utf-8") as file:
+        text = file.read()
+    # numbers, strings and objects split over chunks, and elements bigger than a chunk
+    file = io.StringIO(text[text.index("[") + 1:])
+
+    assert list(ingest.iterate_json_array(file, chunk_size)) == load_export()
+
+
+def test_json_lines_match_json_load(tmp_path):
+    path = tmp_path / "projects.jsonl"
+    path.write_text("\n".join(json_util.dumps(document) for document in load_export()) + "\n\n", encoding="utf-8")
+
+    assert list(ingest.iterate_documents(str(path))) == load_export()
+
+
+def test_unclosed_array_is_an_error():
+    with pytest.raises(ValueError):
+        list(ingest.iterate_json_array(io.StringIO('{"github": "a"}, {"github": "b"}'), 4))
+
+
+def test_ingested_projects_have_what_the_graphs_need(local_db):
+    ingest.ingest(batch_size=10)
+    ingest.ingest(batch_size=10)
+
+    export = load_export()
+    assert local_db.projects.count_documents({}) == len(export)
+    stored = {project["_id"]: project for project in local_db.projects.find({})}
+    for document in export:
+        assert {field: stored[document["_id"]].get(field) for field in document} == document
+
+    computed = metrics.compute_metrics(*metrics.frames_from_documents(local_db.projects.find({}), {}))
+    assert sum(computed["scatter"]["amount"]) > 0
+    assert sum(computed["scatter"]["merge_time"]) > 0
@@ -0,0 +1,144 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pytest
+import benchmark
+import harvester
+import job_queue
+import synthetic
+
+PROJECT = "owner/repo"
+URL = f"git+https://github.com/{PROJECT}.git"
+
+
+class FailingPagesHandler(benchmark.StubHandler):
+    """
+    Answers the pages in failures with 500, as often as their count says, and records the page of every request.
+    Subclasses set pages, failures and requested.
+    """
+    lock = threading.Lock()
+
+    def do_GET(self):
+        page = int(dict(parse_qsl(urlsplit(self.path).query)).get("page", 1))
+        with self.lock:
+            self.requested.append((time.time(), page))
+            failing = self.failures.get(page, 0) > 0
+            if failing:
+                self.failures[page] -= 1
+        if not failing:
+            return super().do_GET()
+        self.send_response(500)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+@pytest.fixture
+def queue_api(local_db, stub_api, monkeypatch):
+    """
+    Serves a repository of 5 pages with the given failures, without retries inside a job and with short rests between jobs.
+
+    Returns:
+    A function that starts the server with failures, a dictionary from page to how often it fails, and returns the handler.
+    """
+    monkeypatch.setattr(harvester, "MAX_RETRIES", 0)
+    monkeypatch.setattr(job_queue, "RETRY_DELAY", 0.1)
+    monkeypatch.setattr(job_queue, "RETRY_FACTOR", 2)
+    pull_requests = synthetic.generate_pull_requests(np.random.default_rng(0), PROJECT, 450)
+
+    def start(failures):
+        handler = type("Handler", (FailingPagesHandler,), {
+            "pages": {PROJECT: benchmark.encode_pages(pull_requests)}, "failures": dict(failures), "requested": []})
+        stub_api(handler)
+        job_queue.ensure_indexes()
+        job_queue.enqueue([URL])
+        return handler
+
+    return start
+
+
+def work():
+    with ThreadPoolExecutor(max_workers=4) as page_pool:
+        return job_queue.work("test-worker", page_pool)
+
+
+def get_job(db):
+    return db.harvest_jobs.find_one({"_id": PROJECT})
+
+
+def test_failed_job_continues_after_the_last_stored_page(local_db, queue_api):
+    handler = queue_api({3: 1})
+
+    assert work() == 1
+
+    job = get_job(local_db)
+    assert (job["status"], job["attempts"], job["next_page"], job["pages"]) == (job_queue.DONE, 2, 6, 5)
+    assert local_db.pull_requests.count_documents({}) == job["pull_requests"] == 450
+    pages = [page for _, page in handler.requested]
+    # the pages before the failed one are not requested again
+    assert pages.count(1) == pages.count(2) == 1
+    assert pages.count(3) == 2
+
+
+def test_failed_attempts_are_spaced_out_before_the_job_fails(local_db, queue_api):
+    handler = queue_api({1: 10})
+
+    assert work() == 0
+
+    job = get_job(local_db)
+    assert (job["status"], job["attempts"]) == (job_queue.FAILED, job_queue.MAX_ATTEMPTS)
+    times = [requested for requested, _ in handler.requested]
+    assert len(times) == job_queue.MAX_ATTEMPTS
+    assert times[1] - times[0] >= job_queue.retry_delay(1)
+    assert times[2] - times[1] >= job_queue.retry_delay(2)
+
+
+def test_released_job_is_not_claimed_before_its_retry(local_db, monkeypatch):
+    job_queue.enqueue([URL])
+    job_queue.release(job_queue.claim("first"), Exception("secondary rate limit"))
+
+    assert job_queue.claim("second") is None
+    assert 0 < job_queue.seconds_to_next_retry() <= job_queue.RETRY_DELAY
+
+    monkeypatch.setattr(job_queue, "datetime", type("Later", (datetime,), {
+        "now": staticmethod(lambda tz=None: datetime.now(tz) + timedelta(seconds=job_queue.RETRY_DELAY + 1))}))
+    assert job_queue.claim("second")["attempts"] == 2
+
+
+def test_expired_lease_is_taken_over_and_the_old_lease_is_rejected(local_db):
+    job_queue.enqueue([URL])
+    first = job_queue.claim("first")
+    assert job_queue.claim("second") is None
+
+    local_db.harvest_jobs.update_one({"_id": PROJECT}, {"$set": {"lease_expires": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    second = job_queue.claim("second")
+    assert second["lease"] != first["lease"]
+
+    # the worker that lost its lease can't move the checkpoint or finish the job
+    assert not job_queue.checkpoint(first, 3, 100, None)
+    job_queue.finish(first)
+    assert job_queue.checkpoint(second, 2, 100, None)
+    job = get_job(local_db)
+    assert (job["status"], job["worker"], job["next_page"], job["pull_requests"]) == (job_queue.RUNNING, "second", 2, 100)
+
+
+def test_requeue_keeps_the_checkpoint_of_failed_jobs(local_db):
+    job_queue.enqueue([URL])
+    job = job_queue.claim("worker")
+    job_queue.checkpoint(job, 3, 200, None)
+    job_queue.release(job, harvester.RepositoryUnavailable("gone"))
+
+    assert job_queue.enqueue([URL], requeue=True) == 1
+    job = get_job(local_db)
+    assert (job["status"], job["attempts"], job["next_page"], job["pages"]) == (job_queue.PENDING, 0, 3, 1)
+    assert "error" not in job
+
+    job = job_queue.claim("worker")
+    job_queue.finish(job)
+    assert job_queue.enqueue([URL], requeue=True) == 1
+    job = get_job(local_db)
+    # finished jobs start over, to pick up what changed
+    assert (job["status"], job["next_page"], job["pages"], job["pull_requests"]) == (job_queue.PENDING, 1, 0, 0)
@@ -0,0 +1,49 @@
+from datetime import datetime, timezone
+
+import migrate_dates
+
+
+def naive(date):
+    # the local store gives back what was stored, aware or not, both are UTC
+    return date.replace(tzinfo=None)
+
+
+def add_old_pull_requests(db, amount):
+    # like the harvester stored them before the dates were native
+    db.pull_requests.insert_many([{
+        "project": "owner/repo",
+        "number": i,
+        "created_at": f"2024-03-{i + 1:02d}T10:00:00Z",
+        "merged_at": f"2024-03-{i + 1:02d}T12:30:15Z",
+        "first_review_at": f"2024-03-{i + 1:02d}T11:00:00Z",
+        "reviews": [{"login": "alice", "state": "APPROVED", "submitted_at": f"2024-03-{i + 1:02d}T11:00:00Z"},
+                    {"login": "bob", "state": "COMMENTED"}],
+    } for i in range(amount)])
+
+
+def test_string_dates_become_native_dates(local_db):
+    add_old_pull_requests(local_db, 5)
+    created = datetime(2024, 4, 1, tzinfo=timezone.utc)
+    local_db.pull_requests.insert_one({"project": "owner/repo", "number": 100, "created_at": created,
+                                      "merged_at": created, "merge_seconds": 0})
+
+    assert migrate_dates.migrate(batch_size=2) == 5
+
+    for pr in local_db.pull_requests.find({"number": {"$lt": 100}}):
+        assert naive(pr["created_at"]) == datetime(2024, 3, pr["number"] + 1, 10)
+        assert naive(pr["merged_at"]) == datetime(2024, 3, pr["number"] + 1, 12, 30, 15)
+        assert naive(pr["first_review_at"]) == datetime(2024, 3, pr["number"] + 1, 11)
+        assert pr["merge_seconds"] == 2 * 3600 + 30 * 60 + 15
+        alice, bob = pr["reviews"]
+        assert (alice["login"], naive(alice["submitted_at"])) == ("alice", datetime(2024, 3, pr["number"] + 1, 11))
+        assert (bob["login"], bob["submitted_at"]) == ("bob", None)
+    assert not any(isinstance(pr["created_at"], str) for pr in local_db.pull_requests.find({}))
+
+
+def test_a_second_run_converts_nothing(local_db):
+    add_old_pull_requests(local_db, 3)
+    migrate_dates.migrate()
+    converted = list(local_db.pull_requests.find({}, {"_id": 0}))
+
+    assert migrate_dates.migrate() == 0
+    assert list(local_db.pull_requests.find({}, {"_id": 0})) == converted
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+import render_figures
+import matplotlib.pyplot as plt
+import generate_graphs
+
+MARKER = b"not rendered again"
+
+
+def bar_figure(data):
+    fig, ax = plt.subplots()
+    ax.bar(list(data), list(data.values()))
+    return fig
+
+
+@pytest.fixture
+def figures(monkeypatch):
+    """
+    Replaces the figures of generate_graphs with one bar chart of data the test can change.
+    The worker processes are forked, so they see it too.
+    """
+    data = {"a": 1, "b": 2}
+    monkeypatch.setattr(generate_graphs, "FIGURES", {"bars": (lambda: dict(data), bar_figure)})
+    return data
+
+
+def render(output_dir, formats=("png",)):
+    """
+    Renders the figures, after marking the files that exist, so a file without the marker was rendered.
+
+    Returns:
+    The files that were rendered.
+    """
+    existing = [name for name in os.listdir(output_dir) if name.startswith("bars.")] if os.path.exists(output_dir) else []
+    for name in existing:
+        with open(os.path.join(output_dir, name), "wb") as file:
+            file.write(MARKER)
+    render_figures.render_all(str(output_dir), formats, workers=1)
+
+    rendered = []
+    for name in sorted(os.listdir(output_dir)):
+        with open(os.path.join(output_dir, name), "rb") as file:
+            if name.startswith("bars.") and file.read() != MARKER:
+                rendered.append(name)
+    return rendered
+
+
+def test_unchanged_figures_are_skipped(tmp_path, figures):
+    assert render(tmp_path) == ["bars.png"]
+    assert render(tmp_path) == []
+
+
+def test_changed_data_is_rendered_again(tmp_path, figures):
+    render(tmp_path)
+    figures["c"] = 3
+
+    assert render(tmp_path) == ["bars.png"]
+    assert render(tmp_path) == []
+
+
+def test_new_format_is_rendered_on_its_own(tmp_path, figures):
+    render(tmp_path)
+
+    assert render(tmp_path, ("png", "svg")) == ["bars.svg"]
+    assert render(tmp_path, ("png", "svg")) == []
+
+
+def test_deleted_figure_is_rendered_again(tmp_path, figures):
+    render(tmp_path)
+    os.remove(tmp_path / "bars.png")
+
+    assert render(tmp_path) == ["bars.png"]
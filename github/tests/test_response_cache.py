@@ -0,0 +1,130 @@
+import json
+import os
+import sqlite3
+
+import pytest
+import requests
+import response_cache
+
+URL = "https://api.github.com/repos/owner/repo/pulls?page="
+
+
+class Clock:
+    """
+    Stands in for the time module of response_cache, every call is a second later, so no two uses are at the same time.
+    """
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    return clock
+
+
+def make_response(body, status=200, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = body
+    return response
+
+
+def store(cache, page, body):
+    cache.store("GET", URL + str(page), "application/json", make_response(body))
+
+
+def get(cache, page):
+    return cache.get("GET", URL + str(page), "application/json")
+
+
+def stored_bodies(cache):
+    return cache.connection.execute("SELECT body FROM responses").fetchall()
+
+
+def test_body_and_headers_survive_the_compression(tmp_path, clock):
+    cache = response_cache.ResponseCache(str(tmp_path / "cache.sqlite"))
+    body = json.dumps([{"number": i, "title": "Pull request", "state": "closed"} for i in range(100)]).encode()
+    link = '<https://api.github.com/repos/owner/repo/pulls?page=3>; rel="last"'
+    cache.store("GET", URL + "1", "application/json", make_response(body, headers={
+        "Link": link, "ETag": '"abc"', "X-RateLimit-Remaining": "4999"}))
+
+    response = get(cache, 1)
+
+    assert response.from_cache and response.status_code == 200
+    assert response.content == body and response.json()[99]["number"] == 99
+    assert dict(response.headers) == {"Link": link, "ETag": '"abc"'}
+    [(stored,)] = stored_bodies(cache)
+    assert len(stored) == cache.size < len(body) // 5
+
+
+def test_only_successful_responses_are_stored(tmp_path, clock):
+    cache = response_cache.ResponseCache(str(tmp_path / "cache.sqlite"))
+    cache.store("GET", URL + "1", "application/json", make_response(b"{}", status=404))
+
+    assert get(cache, 1) is None
+    assert cache.size == 0 and cache.stats["cache_stores"] == 0
+
+
+def test_entries_expire_after_their_ttl(tmp_path, clock):
+    cache = response_cache.ResponseCache(str(tmp_path / "cache.sqlite"), ttl=10)
+    store(cache, 1, b"[1]")
+    cache.store("GET", URL + "2", "application/json", make_response(b"[2]"), ttl=100)
+
+    assert get(cache, 1).content == b"[1]"
+    clock.now += 10
+
+    assert get(cache, 1) is None
+    assert get(cache, 2).content == b"[2]"
+    # the expired entry is gone, not only hidden
+    assert len(stored_bodies(cache)) == 1
+    assert cache.size == len(stored_bodies(cache)[0][0])
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    # random bytes don't compress, so every entry takes about 1000 bytes
+    bodies = {page: os.urandom(1000) for page in range(1, 5)}
+    cache = response_cache.ResponseCache(str(tmp_path / "cache.sqlite"), max_size=3500)
+    for page in range(1, 4):
+        store(cache, page, bodies[page])
+    assert get(cache, 1) is not None
+
+    store(cache, 4, bodies[4])
+
+    # page 2 was used the longest ago, page 1 was read after it was stored
+    assert get(cache, 2) is None
+    assert [get(cache, page).content for page in [1, 3, 4]] == [bodies[1], bodies[3], bodies[4]]
+    assert cache.size <= 3500 * response_cache.EVICT_TO
+    assert cache.stats["cache_evictions"] == 1
+    # the size is kept in memory, it matches what is on disk, also when the file is opened again
+    on_disk = sum(len(body) for body, in stored_bodies(cache))
+    assert cache.size == on_disk == response_cache.ResponseCache(cache.path).size
+
+
+def test_counters(tmp_path, clock):
+    cache = response_cache.ResponseCache(str(tmp_path / "cache.sqlite"), ttl=10)
+    assert get(cache, 1) is None
+    store(cache, 1, b"[1]")
+    store(cache, 1, b"[1, 2]")
+    get(cache, 1)
+    get(cache, 1)
+    clock.now += 10
+    get(cache, 1)
+
+    assert cache.stats == {"cache_misses": 2, "cache_stores": 2, "cache_hits": 2, "cache_expired": 1}
+    assert cache.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 0
+
+
+def test_cache_file_is_shared_between_connections(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    store(response_cache.ResponseCache(path), 1, b"[1]")
+
+    assert get(response_cache.ResponseCache(path), 1).content == b"[1]"
+    assert sqlite3.connect(path).execute("SELECT url FROM responses").fetchone() == (URL + "1",)
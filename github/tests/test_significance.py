@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import significance
+
+PROJECTS = 200
+
+
+def make_projects(rng, group_merge_time, rest_merge_time):
+    """
+    Projects where the first quarter has the documentation flag, with merge times around the given ones.
+    """
+    group = np.arange(PROJECTS) < PROJECTS // 4
+    merge_time = np.where(group, group_merge_time, rest_merge_time) * rng.lognormal(0, 0.3, PROJECTS)
+    projects = pd.DataFrame({
+        "github": [f"git+https://github.com/owner/repo{i}.git" for i in range(PROJECTS)],
+        "amount_of_pull_requests": rng.integers(10, 100, PROJECTS),
+        "average_pull_request_merge_time": merge_time,
+    })
+    periods = pd.DataFrame({"github": projects["github"], "count": rng.integers(0, 5, PROJECTS)})
+    sums, columns = significance.project_sums(projects, periods)
+    return sums, columns, {"documented": group}
+
+
+def merge_time_result(sums, columns, masks):
+    results = significance.compare_groups(sums, columns, masks, resamples=2000, workers=1)
+    [result] = [result for result in results if result["statistic"] == "merge_time"]
+    return result
+
+
+def test_planted_difference_is_significant():
+    sums, columns, masks = make_projects(np.random.default_rng(0), 3600, 4 * 3600)
+
+    result = merge_time_result(sums, columns, masks)
+
+    assert result["projects"] == PROJECTS // 4
+    assert result["group_value"] < result["rest_value"]
+    assert result["p_value"] < 0.001
+    assert result["ci_low"] <= result["difference"] <= result["ci_high"] < 0
+
+
+def test_no_difference_is_not_significant():
+    sums, columns, masks = make_projects(np.random.default_rng(0), 3600, 3600)
+
+    result = merge_time_result(sums, columns, masks)
+
+    assert result["p_value"] > 0.05
+    assert result["ci_low"] < 0 < result["ci_high"]
+
+
+def test_same_seed_gives_the_same_results():
+    sums, columns, masks = make_projects(np.random.default_rng(0), 3600, 2 * 3600)
+
+    first = significance.compare_groups(sums, columns, masks, resamples=500, workers=1)
+    assert significance.compare_groups(sums, columns, masks, resamples=500, workers=2) == first
@@ -0,0 +1,98 @@
+import json
+import logging
+import urllib.error
+import urllib.request
+from collections import Counter
+
+import pytest
+import telemetry
+
+
+@pytest.fixture
+def fresh(monkeypatch):
+    """
+    Stops the telemetry the other tests started and records into empty values, so only this test's show up.
+    """
+    telemetry.stop()
+    monkeypatch.setattr(telemetry, "counters", Counter())
+    monkeypatch.setattr(telemetry, "gauges", {})
+    monkeypatch.setattr(telemetry, "timers", {})
+    monkeypatch.setattr(telemetry, "sources", [])
+    yield
+    telemetry.stop()
+
+
+def test_events_are_written_as_json_lines(tmp_path, fresh):
+    path = tmp_path / "logs" / "run.jsonl"
+    telemetry.start("test", log_path=str(path), console=False)
+
+    telemetry.event("Stored 3 pull requests", project="owner/repo", amount=3)
+    telemetry.event("Working on owner/repo", logging.DEBUG)
+    telemetry.event("Failed", logging.ERROR)
+    telemetry.stop()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(line["level"], line["run"], line["event"]) for line in lines] == [
+        ("info", "test", "Stored 3 pull requests"), ("debug", "test", "Working on owner/repo"), ("error", "test", "Failed")]
+    assert (lines[0]["project"], lines[0]["amount"]) == ("owner/repo", 3)
+    assert all(isinstance(line["time"], float) for line in lines)
+
+
+def test_debug_events_only_go_to_the_json_log(tmp_path, fresh, capsys):
+    path = tmp_path / "run.jsonl"
+    telemetry.start("test", log_path=str(path))
+
+    telemetry.event("for everyone")
+    telemetry.event("only in the log", logging.DEBUG)
+    telemetry.stop()
+
+    assert capsys.readouterr().out == "for everyone\n"
+    assert len(path.read_text().splitlines()) == 2
+
+
+def test_values_are_served_to_prometheus(fresh):
+    telemetry.start("test", prometheus_port=0, console=False)
+    telemetry.count("pages", 3)
+    telemetry.count("http_bytes", 1024)
+    telemetry.gauge("rate_limit_remaining", 4999, token="token-1")
+    telemetry.gauge("rate_limit_remaining", 12, token="token-2")
+    telemetry.gauge("queue_depth", None)
+    telemetry.include(Counter({"mongo.queries": 7}))
+    telemetry.add_time("github.harvest", 1.5)
+    telemetry.add_time("github.harvest", 0.5)
+
+    url = f"http://127.0.0.1:{telemetry.server.server_address[1]}"
+    with urllib.request.urlopen(url + "/metrics") as response:
+        assert response.headers["Content-Type"].startswith("text/plain")
+        lines = response.read().decode().splitlines()
+
+    assert lines == [
+        "# TYPE pipeline_http_bytes_total counter",
+        "pipeline_http_bytes_total 1024",
+        "# TYPE pipeline_mongo_queries_total counter",
+        "pipeline_mongo_queries_total 7",
+        "# TYPE pipeline_pages_total counter",
+        "pipeline_pages_total 3",
+        "# TYPE pipeline_rate_limit_remaining gauge",
+        'pipeline_rate_limit_remaining{token="token-1"} 4999',
+        'pipeline_rate_limit_remaining{token="token-2"} 12',
+        "# TYPE pipeline_stage_seconds_total counter",
+        "# TYPE pipeline_stage_runs_total counter",
+        'pipeline_stage_seconds_total{stage="github.harvest"} 2.0',
+        'pipeline_stage_runs_total{stage="github.harvest"} 2',
+    ]
+    with pytest.raises(urllib.error.HTTPError):
+        urllib.request.urlopen(url + "/other")
+
+
+def test_stop_is_registered_at_exit_once(fresh, monkeypatch):
+    registered = []
+    monkeypatch.setattr(telemetry.atexit, "register", registered.append)
+    monkeypatch.setattr(telemetry, "stop_at_exit", False)
+
+    for _ in range(3):
+        telemetry.start("test", console=False)
+        telemetry.start("test", console=False)
+        telemetry.stop()
+
+    assert registered == [telemetry.stop]
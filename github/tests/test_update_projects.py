@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import synthetic
+import update_projects
+
+
+def seed_pull_requests(db):
+    rng = np.random.default_rng(0)
+    pull_requests = []
+    # odd and even amounts, so both cases of the median are covered, and a project with a single pull request
+    for i, amount in enumerate([1, 2, 7, 10, 101, 250]):
+        pull_requests += synthetic.generate_pull_requests(rng, f"owner/repo{i}", amount)
+    # pull requests stored before merge_seconds was, the pipeline subtracts their dates
+    for pr in pull_requests[::3]:
+        del pr["merge_seconds"]
+    db.pull_requests.insert_many(pull_requests)
+    return pull_requests
+
+
+def test_merge_time_stats_match_the_reference(mongo_db):
+    seed_pull_requests(mongo_db)
+
+    stats = update_projects.merge_time_stats()
+
+    assert stats == update_projects.merge_time_stats_reference(mongo_db.pull_requests.find())
+    assert sorted(stats) == [f"owner/repo{i}" for i in range(6)]
+
+
+def test_merge_time_stats_of_some_projects(mongo_db):
+    seed_pull_requests(mongo_db)
+    projects = ["owner/repo2", "owner/repo5"]
+
+    stats = update_projects.merge_time_stats(projects)
+
+    assert stats == update_projects.merge_time_stats_reference(mongo_db.pull_requests.find({"project": {"$in": projects}}))
+
+
+def test_merge_times_keep_whole_days(mongo_db):
+    created = datetime(2024, 3, 1, tzinfo=timezone.utc)
+    mongo_db.pull_requests.insert_many([
+        {"project": "owner/repo", "created_at": created, "merged_at": created + timedelta(days=3, seconds=5)},
+        {"project": "owner/repo", "created_at": created, "merged_at": created + timedelta(seconds=10)},
+    ])
+
+    stats = update_projects.merge_time_stats()["owner/repo"]
+
+    assert stats == {"count": 2, "mean": (3 * 86400 + 15) / 2, "median": (3 * 86400 + 15) / 2, "p90": 3 * 86400 + 5}
+    assert stats == update_projects.merge_time_stats_reference(mongo_db.pull_requests.find())["owner/repo"]
+
+
+def test_string_dates_are_detected(mongo_db):
+    seed_pull_requests(mongo_db)
+    assert not update_projects.has_string_dates()
+
+    mongo_db.pull_requests.insert_one({"project": "owner/old", "created_at": "2020-01-01T00:00:00Z", "merged_at": "2020-01-02T00:00:00Z"})
+    assert update_projects.has_string_dates()
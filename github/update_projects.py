@@ -1,138 +1,214 @@
-import configparser
-from pymongo import MongoClient
-import os
-from datetime import datetime
-
-def load_api_token():
-    config = configparser.ConfigParser()
-    # os. is cursed, but somehow only this works
-    config.read(os.getcwd() + '\\github\\config.ini')
-    return config.get('DEFAULT', 'GITHUB_API_TOKEN')
-
-# Use the loaded API token
-api_token = load_api_token()
-headers = {
-    "Accept": "application/vnd.github.v3+json",
-    "Authorization": f"token {api_token}",
-}
-
-def load_mongodb_config():
-    config = configparser.ConfigParser()
-    # again cursed, but my computer hates me, and this is the only way it works for me
-    config.read(os.getcwd() + '\\github\\config.ini')
-    return {
-        'host': config.get('mongodb', 'DB_HOST'),
-        'port': config.getint('mongodb', 'DB_PORT'),
-        'user': config.get('mongodb', 'DB_USER'),
-        'password': config.get('mongodb', 'DB_PASS'),
-        'dbname': config.get('mongodb', 'DB_NAME')
-    }
+import connections
+import logging
+from collections import defaultdict
+import harvester
+import telemetry
+from github import get_owner_and_repo
+from pymongo import ASCENDING, UpdateOne
+
+# how many project updates are sent to MongoDB in one bulk write
+BATCH_SIZE = 500
+# the percentile stored next to the mean and the median
+PERCENTILE = 90
+
+EMPTY_STATS = {"count": 0, "mean": 0, "median": 0, "p90": 0}
 
 
-def get_working_projects():
-    mdb_config = load_mongodb_config()
-    # MongoDB URI string
-    mongo_uri = f"mongodb://{mdb_config['user']}:{mdb_config['password']}@{mdb_config['host']}:{mdb_config['port']}/{mdb_config['dbname']}?authSource=admin"
-    client = MongoClient(mongo_uri)
-    db = client[mdb_config['dbname']]
+def ensure_indexes():
+    db = connections.get_db()
+    # every update is matched on github, and every project looks up its pull requests
+    db.projects.create_index([("github", ASCENDING)])
+    db.pull_requests.create_index([("project", ASCENDING)])
+
+
+def get_working_projects(query=None):
+    db = connections.get_db()
     collection = db.projects
     # get all projects from db
-    cursor = collection.find()
+    cursor = collection.find(query or {})
     return cursor
 
 
-def get_owner_and_repo(repo_link):
-    # first clean up repo link
-    if repo_link[0:4] == "git+":
-        repo_link = repo_link[4:]
-    if repo_link[-4:] == ".git":
-        repo_link = repo_link[:-4]
-    # now link is in format of 'https://github.com/<owner>/<repo>'
-    owner_repo = repo_link[19:]
-    # all that is left is now '<owner>/<repo>'
-    owner, repo = owner_repo.split('/')
-    return owner, repo
+def as_date(value):
+    # pull requests harvested before the dates were stored natively have ISO strings, see migrate_dates.py
+    return harvester.parse_date(value) if isinstance(value, str) else value
 
 
 def get_delta_time(pull_request):
-    # very simple to get all time stamps
-    time_created = datetime.strptime(pull_request["created_at"][:-1], "%Y-%m-%dT%H:%M:%S")
-    time_merged = datetime.strptime(pull_request["merged_at"][:-1], "%Y-%m-%dT%H:%M:%S")
-    return time_merged-time_created
-
-
-def update_project(project, avg_time, amount):
-    mdb_config = load_mongodb_config()
-    # MongoDB URI string
-    mongo_uri = f"mongodb://{mdb_config['user']}:{mdb_config['password']}@{mdb_config['host']}:{mdb_config['port']}/{mdb_config['dbname']}?authSource=admin"
-    client = MongoClient(mongo_uri)
-    db = client[mdb_config['dbname']]
-    collection = db.projects
-    # set the time and amount of pull requests correctly for a given project
-    collection.update_many({"github": project["github"]}, {"$set": {"average_pull_request_merge_time": avg_time}})
-    collection.update_many({"github": project["github"]}, {"$set": {"amount_of_pull_requests": amount}})
+    return as_date(pull_request["merged_at"]) - as_date(pull_request["created_at"])
 
 
+def get_merge_seconds(pull_request):
+    # stored at ingest, only older documents need their dates subtracted
+    if "merge_seconds" in pull_request:
+        return pull_request["merge_seconds"]
+    return get_delta_time(pull_request).total_seconds()
+
 
 def get_pull_requests(owner, repo):
-    mdb_config = load_mongodb_config()
-    # MongoDB URI string
-    mongo_uri = f"mongodb://{mdb_config['user']}:{mdb_config['password']}@{mdb_config['host']}:{mdb_config['port']}/{mdb_config['dbname']}?authSource=admin"
-    client = MongoClient(mongo_uri)
-    db = client[mdb_config['dbname']]
+    db = connections.get_db()
     collection = db.pull_requests
     # getting all pull requests where the project is from the same owner and from the right repo
     cursor = collection.find({"project": f"{owner}/{repo}"})
     return cursor
 
 
-def add_fields_to_document(project):
-    mdb_config = load_mongodb_config()
-    # MongoDB URI string
-    mongo_uri = f"mongodb://{mdb_config['user']}:{mdb_config['password']}@{mdb_config['host']}:{mdb_config['port']}/{mdb_config['dbname']}?authSource=admin"
-    client = MongoClient(mongo_uri)
-    db = client[mdb_config['dbname']]
-    collection = db.projects
-    # adding using seperate update_many funcs so they appear in the right order
-    # in python order does not matter, but in mongodb compass it does
-    collection.update_many({"github": project["github"]}, {"$set": {"average_pull_request_merge_time": 0}})
-    collection.update_many({"github": project["github"]}, {"$set": {"README_documentation": False,
-                                                                    "comments_in_code": False,
-                                                                    "website_linked": False,
-                                                                    "wiki_present": False}})
-    collection.update_many({"github": project["github"]}, {"$set": {"amount_of_pull_requests": 0}})
+def summarize_merge_times(times):
+    """
+    Computes the merge time statistics of one project, see merge_time_stats.
+
+    Parameters:
+    - times: The merge times in seconds.
+    """
+    if not times:
+        return dict(EMPTY_STATS)
+    times = sorted(times)
+    n = len(times)
+    return {
+        "count": n,
+        "mean": sum(times) / n,
+        # average of the two middle values when the amount is even
+        "median": (times[(n - 1) // 2] + times[n // 2]) / 2,
+        # nearest rank, in integers so it can't differ from the pipeline by rounding
+        "p90": times[(PERCENTILE * n + 99) // 100 - 1],
+    }
 
 
-def main():
-    # get the projects we want to work with
-    projects = get_working_projects()
+def merge_time_stats_reference(pull_requests):
+    """
+    Computes the merge time statistics per project in Python, the reference for merge_time_stats.
+    Unlike timedelta.seconds, total_seconds keeps the days of pull requests that took longer than a day.
+
+    Parameters:
+    - pull_requests: The pull request documents, of any amount of projects.
+
+    Returns:
+    A dictionary from project to its count, mean, median and p90 merge time in seconds.
+    """
+    merge_times = defaultdict(list)
+    for pull_request in pull_requests:
+        merge_times[pull_request["project"]].append(get_merge_seconds(pull_request))
+    return {project: summarize_merge_times(times) for project, times in merge_times.items()}
+
+
+def has_string_dates():
+    # pull requests harvested before the dates were stored natively, until migrate_dates.py converted them
+    return connections.get_db().pull_requests.find_one({"created_at": {"$type": "string"}}, {"_id": 1}) is not None
+
+
+def merge_time_stats(projects=None):
+    """
+    Computes the merge time statistics of all projects in MongoDB with a single aggregation,
+    so only the final numbers per project come back instead of every pull request.
+    The dates must be native dates, see has_string_dates.
+
+    Parameters:
+    - projects: Only compute the statistics of these projects, in '<owner>/<repo>' format.
+
+    Returns:
+    The same dictionary as merge_time_stats_reference.
+    """
+    def element_at(index):
+        return {"$arrayElemAt": ["$times", {"$toInt": index}]}
+
+    pipeline = []
+    if projects is not None:
+        pipeline.append({"$match": {"project": {"$in": list(projects)}}})
+    pipeline += [
+        # subtracting dates gives milliseconds
+        {"$project": {"project": 1, "merge_seconds": {"$ifNull": ["$merge_seconds", {"$divide": [{"$subtract": [
+            "$merged_at",
+            "$created_at",
+        ]}, 1000]}]}}},
+        # $push keeps the order of the input, so the times of every project end up sorted
+        {"$sort": {"project": 1, "merge_seconds": 1}},
+        {"$group": {"_id": "$project",
+                    "count": {"$sum": 1},
+                    "mean": {"$avg": "$merge_seconds"},
+                    "times": {"$push": "$merge_seconds"}}},
+        {"$project": {
+            "count": 1,
+            "mean": 1,
+            "median": {"$avg": [
+                element_at({"$floor": {"$divide": [{"$subtract": ["$count", 1]}, 2]}}),
+                element_at({"$floor": {"$divide": ["$count", 2]}}),
+            ]},
+            "p90": element_at({"$subtract": [
+                {"$floor": {"$divide": [{"$add": [{"$multiply": [PERCENTILE, "$count"]}, 99]}, 100]}}, 1]}),
+        }},
+    ]
+
+    cursor = connections.get_db().pull_requests.aggregate(pipeline, allowDiskUse=True)
+    return {result.pop("_id"): result for result in cursor}
+
+
+def project_update(project, stats):
+    """
+    Builds the update that adds the computed fields to a project, to be sent with bulk_write.
+    MongoDB adds new fields of a single $set in alphabetical order, so every group of fields
+    gets its own stage of an update pipeline, that way they still appear in the right order in MongoDB Compass.
+    """
+    return UpdateOne({"github": project["github"]}, [
+        {"$set": {"average_pull_request_merge_time": int(stats["mean"])}},
+        {"$set": {"README_documentation": False,
+                  "comments_in_code": False,
+                  "website_linked": False,
+                  "wiki_present": False}},
+        {"$set": {"amount_of_pull_requests": stats["count"]}},
+        {"$set": {"median_pull_request_merge_time": int(stats["median"]),
+                  f"p{PERCENTILE}_pull_request_merge_time": int(stats["p90"])}},
+    ])
+
+
+def flush_updates(updates):
+    if updates:
+        connections.get_db().projects.bulk_write(updates, ordered=False)
+        telemetry.event(f"Updated {len(updates)} projects")
+
+
+@telemetry.timed("update_projects.main")
+def main(batch_size=BATCH_SIZE, server_side=None):
+    """
+    Adds the merge time statistics and the documentation fields to every project that does not have them yet.
+
+    Parameters:
+    - batch_size: How many project updates are sent in one bulk write.
+    - server_side: Compute the statistics of all projects in one MongoDB aggregation,
+      instead of fetching the pull requests of every project. By default only on MongoDB,
+      the local store has no aggregation pipelines, and only when every date is a native date.
+    """
+    if server_side is None:
+        server_side = connections.uses_mongodb() and not has_string_dates()
+        if connections.uses_mongodb() and not server_side:
+            telemetry.event("Some pull requests still have string dates, run migrate_dates.py to compute "
+                            "the statistics in one aggregation", logging.WARNING)
+    ensure_indexes()
+
+    # get the projects we want to work with, projects that already are processed have the documentation fields
+    projects = list(get_working_projects({"README_documentation": {"$exists": False}}))
+    names = ["/".join(get_owner_and_repo(project["github"])) for project in projects]
+    stats = merge_time_stats(names) if server_side else {}
+    updates = []
 
     # for each project
-    for project in projects:
-        # if the project already is processed, skip it
-        if "README_documentation" in project.keys():
-            print("Skipping project ", project["github"])
-            continue
-
-        print("Working on ", project["github"])
+    for project, name in zip(projects, names):
+        telemetry.event(f"Working on {project['github']}", logging.DEBUG)
 
-        # add the needed fields to the document
-        add_fields_to_document(project)
+        if not server_side:
+            # get all pull requests, and calculate how many there are and what the merge times are
+            owner, repo = name.split("/")
+            stats.update(merge_time_stats_reference(get_pull_requests(owner, repo)))
 
-        # get all pull requests
-        owner, repo = get_owner_and_repo(project["github"])
-        pull_requests = get_pull_requests(owner, repo)
-        total = 0
-        time = 0
+        # update the project with the merge times and total amount of pull requests
+        updates.append(project_update(project, stats.get(name, EMPTY_STATS)))
+        if len(updates) >= batch_size:
+            flush_updates(updates)
+            updates = []
 
-        # calculate how many pull requests in total, and what the average time is
-        for request in pull_requests:
-            total += 1
-            time += get_delta_time(request).seconds
-        
-        # update the project with average time and total amount of pull requests
-        update_project(project, time//total, total)
+    flush_updates(updates)
+    connections.log_stats()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    connections.start_telemetry("update_projects")
+    main()